@@ -0,0 +1,123 @@
+"""
+Cold-start benchmark: import-time profile and time-to-first-request.
+
+    python benchmarks/import_time.py               # report + enforce budgets
+    python benchmarks/import_time.py --top 30      # show more of the profile
+
+1. Runs `python -X importtime -c "import main"` and reports the total import
+   time plus the heaviest top-level imports.
+2. Starts `uvicorn main:app` and measures wall time until GET /health answers.
+
+Exits non-zero if either number is over budget, so it can gate CI.
+"""
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Budgets (milliseconds). Raise them deliberately, in the same PR as the
+# change that needs it.
+IMPORT_BUDGET_MS = 1200
+TIME_TO_FIRST_REQUEST_BUDGET_MS = 3000
+
+# Modules that must NOT be imported by `import main` (loaded lazily on first use)
+LAZY_MODULES = ("livekit", "google.cloud.storage", "langchain_openai", "httpx", "rich", "smtplib")
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile_imports(top: int):
+    """Return (total_ms, heaviest top-level imports, eagerly imported lazy modules)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        raise SystemExit("`import main` failed")
+
+    top_level = []
+    imported = set()
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative_us, indent, name = match.groups()
+        imported.add(name)
+        if len(indent) <= 1:
+            top_level.append((int(cumulative_us) / 1000, name))
+
+    total_ms = sum(ms for ms, _ in top_level)
+    heaviest = sorted(top_level, reverse=True)[:top]
+    eager = [m for m in LAZY_MODULES if m in imported]
+    return total_ms, heaviest, eager
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_request(timeout_s: float = 30.0) -> float:
+    """Spawn uvicorn and return ms until /health responds 200"""
+    port = _free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout_s:
+            if proc.poll() is not None:
+                raise SystemExit("uvicorn exited before serving /health")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as resp:
+                    if resp.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except OSError:
+                time.sleep(0.02)
+        raise SystemExit(f"/health not ready after {timeout_s}s")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="How many top-level imports to list")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--ttfr-budget-ms", type=float, default=TIME_TO_FIRST_REQUEST_BUDGET_MS)
+    parser.add_argument("--skip-server", action="store_true", help="Only profile imports")
+    args = parser.parse_args(argv)
+
+    failures = []
+
+    total_ms, heaviest, eager = profile_imports(args.top)
+    print(f"import main: {total_ms:.0f} ms (budget {args.import_budget_ms:.0f} ms)")
+    for ms, name in heaviest:
+        print(f"  {ms:8.1f} ms  {name}")
+    if total_ms > args.import_budget_ms:
+        failures.append(f"import time {total_ms:.0f} ms > {args.import_budget_ms:.0f} ms")
+    if eager:
+        failures.append(f"modules that should load lazily were imported eagerly: {', '.join(eager)}")
+
+    if not args.skip_server:
+        ttfr_ms = time_to_first_request()
+        print(f"time to first request: {ttfr_ms:.0f} ms (budget {args.ttfr_budget_ms:.0f} ms)")
+        if ttfr_ms > args.ttfr_budget_ms:
+            failures.append(f"time to first request {ttfr_ms:.0f} ms > {args.ttfr_budget_ms:.0f} ms")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+Webhook status-update throughput: wide call_history vs slim call_history + side tables.
+
+    BENCH_DATABASE_URL=postgresql://... python benchmarks/webhook_update_throughput.py
+    python benchmarks/webhook_update_throughput.py --calls 2000 --updates 20000 --workers 8
+
+Builds both layouts in a throwaway schema (bench_webhook, dropped afterwards):
+
+  before: transcript / events_log / agent_events / recording bytes inline in call_history
+  after:  call_history with hot scalar columns only (migration 6), payloads in
+          call_transcripts / call_events / call_recordings
+
+then replays the webhook's update pattern (status / duration / ended_at /
+updated_at on random calls, one transaction each) from N threads and reports
+updates per second, WAL bytes per update and the HOT-update ratio.
+Needs a scratch database - never point it at production.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCHEMA = "bench_webhook"
+
+WIDE_TABLE = f"""
+    CREATE TABLE {SCHEMA}.call_history (
+        id SERIAL PRIMARY KEY,
+        call_id TEXT NOT NULL UNIQUE,
+        user_id INTEGER NOT NULL,
+        status TEXT,
+        duration DOUBLE PRECISION,
+        created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMPTZ,
+        ended_at TIMESTAMPTZ,
+        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+        voice_name TEXT,
+        to_number TEXT,
+        transcript JSONB,
+        transcript_gzip BYTEA,
+        events_log JSONB DEFAULT '[]',
+        agent_events JSONB DEFAULT '[]',
+        recording_blob_data BYTEA,
+        recording_size INTEGER
+    )
+"""
+
+SLIM_TABLES = [
+    f"""
+    CREATE TABLE {SCHEMA}.call_history (
+        id SERIAL PRIMARY KEY,
+        call_id TEXT NOT NULL UNIQUE,
+        user_id INTEGER NOT NULL,
+        status TEXT,
+        duration DOUBLE PRECISION,
+        created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMPTZ,
+        ended_at TIMESTAMPTZ,
+        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+        voice_name TEXT,
+        to_number TEXT
+    ) WITH (fillfactor = 85)
+    """,
+    f"CREATE TABLE {SCHEMA}.call_transcripts (call_id TEXT PRIMARY KEY, transcript JSONB, transcript_gzip BYTEA)",
+    f"CREATE TABLE {SCHEMA}.call_events (call_id TEXT PRIMARY KEY, events_log JSONB, agent_events JSONB)",
+    f"CREATE TABLE {SCHEMA}.call_recordings (call_id TEXT PRIMARY KEY, data BYTEA, size INTEGER)",
+]
+
+
+def sample_payloads():
+    """Roughly the size of a short real call: ~40 turns, ~12 webhook events, 200 KB audio"""
+    transcript = {"items": [
+        {"type": "message", "role": "assistant" if i % 2 else "user", "content": [f"turn {i} " + "lorem ipsum " * 8]}
+        for i in range(40)
+    ]}
+    events = [{"event": f"event_{i}", "timestamp": "2024-01-01T00:00:00", "data": {"room": {"name": "x" * 40}}} for i in range(12)]
+    agent_events = [{"event_type": f"agent_{i}", "event_data": {"k": "v" * 30}} for i in range(8)]
+    return json.dumps(transcript), json.dumps(events), json.dumps(agent_events), os.urandom(200 * 1024)
+
+
+def setup(conn, layout: str, calls: int):
+    transcript, events, agent_events, recording = sample_payloads()
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+        if layout == "before":
+            cursor.execute(WIDE_TABLE)
+        else:
+            for statement in SLIM_TABLES:
+                cursor.execute(statement)
+
+        for i in range(calls):
+            call_id = f"bench-{i}"
+            cursor.execute(
+                f"INSERT INTO {SCHEMA}.call_history (call_id, user_id, status, voice_name, to_number) "
+                "VALUES (%s, 1, 'initiated', 'voice', '+15550000000')",
+                (call_id,)
+            )
+            if layout == "before":
+                cursor.execute(
+                    f"UPDATE {SCHEMA}.call_history SET transcript = %s, events_log = %s, agent_events = %s, "
+                    "recording_blob_data = %s, recording_size = %s WHERE call_id = %s",
+                    (transcript, events, agent_events, psycopg2.Binary(recording), len(recording), call_id)
+                )
+            else:
+                cursor.execute(f"INSERT INTO {SCHEMA}.call_transcripts VALUES (%s, %s, NULL)", (call_id, transcript))
+                cursor.execute(f"INSERT INTO {SCHEMA}.call_events VALUES (%s, %s, %s)", (call_id, events, agent_events))
+                cursor.execute(f"INSERT INTO {SCHEMA}.call_recordings VALUES (%s, %s, %s)",
+                               (call_id, psycopg2.Binary(recording), len(recording)))
+    conn.commit()
+
+
+def run_updates(dsn: str, calls: int, updates: int, workers: int) -> float:
+    """Replay webhook-style status updates; returns elapsed seconds"""
+    per_worker = updates // workers
+    statuses = ["ringing", "in_progress", "completed"]
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        conn = psycopg2.connect(dsn)
+        try:
+            for _ in range(per_worker):
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        f"UPDATE {SCHEMA}.call_history SET status = %s, duration = %s, "
+                        "ended_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE call_id = %s",
+                        (rng.choice(statuses), rng.random() * 300, f"bench-{rng.randrange(calls)}")
+                    )
+                conn.commit()
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started
+
+
+def measure(dsn: str, layout: str, calls: int, updates: int, workers: int) -> dict:
+    conn = psycopg2.connect(dsn)
+    try:
+        setup(conn, layout, calls)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"VACUUM ANALYZE {SCHEMA}.call_history")
+            cursor.execute("SELECT pg_stat_reset_single_table_counters(%s::regclass)", (f"{SCHEMA}.call_history",))
+            cursor.execute("SELECT pg_current_wal_lsn()")
+            wal_start = cursor.fetchone()[0]
+
+        elapsed = run_updates(dsn, calls, updates, workers)
+        done = (updates // workers) * workers
+
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s)", (wal_start,))
+            wal_bytes = float(cursor.fetchone()[0])
+            if conn.server_version >= 150000:
+                cursor.execute("SELECT pg_stat_force_next_flush()")
+            else:
+                time.sleep(0.5)  # let the stats collector catch up
+            cursor.execute(
+                "SELECT n_tup_upd, n_tup_hot_upd FROM pg_stat_user_tables WHERE schemaname = %s AND relname = 'call_history'",
+                (SCHEMA,)
+            )
+            n_upd, n_hot = cursor.fetchone() or (0, 0)
+            cursor.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    finally:
+        conn.close()
+
+    return {
+        "layout": layout,
+        "updates_per_sec": done / elapsed,
+        "wal_bytes_per_update": wal_bytes / done,
+        "hot_ratio": (n_hot / n_upd) if n_upd else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook update throughput, wide vs slim call_history")
+    parser.add_argument("--calls", type=int, default=1000, help="rows in call_history")
+    parser.add_argument("--updates", type=int, default=10000, help="total status updates")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent connections")
+    args = parser.parse_args()
+
+    dsn = os.getenv("BENCH_DATABASE_URL")
+    if not dsn:
+        raise SystemExit("Set BENCH_DATABASE_URL to a scratch database")
+
+    results = [measure(dsn, layout, args.calls, args.updates, args.workers) for layout in ("before", "after")]
+
+    print(f"{'layout':<8} {'updates/s':>10} {'WAL B/update':>13} {'HOT %':>7}")
+    for r in results:
+        print(f"{r['layout']:<8} {r['updates_per_sec']:>10.0f} {r['wal_bytes_per_update']:>13.0f} {r['hot_ratio'] * 100:>6.1f}%")
+    before, after = results
+    print(f"\nthroughput x{after['updates_per_sec'] / before['updates_per_sec']:.2f}, "
+          f"WAL x{after['wal_bytes_per_update'] / max(before['wal_bytes_per_update'], 1):.2f}")
+
+
+if __name__ == "__main__":
+    main()
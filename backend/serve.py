@@ -0,0 +1,101 @@
+"""
+Production entry point.
+
+    python serve.py
+
+Runs N uvicorn workers (WEB_CONCURRENCY, default: one per available core) on
+uvloop + httptools when installed, sizes each worker's Postgres pool so all
+workers together stay within DB_MAX_CONNECTIONS, and shuts down gracefully so
+in-flight transcript/recording ingestion can drain (see create_app lifespan).
+
+`python main.py` remains the single-process --reload dev server.
+"""
+import importlib.util
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def available_cores() -> int:
+    """CPU cores this process may actually run on (respects container cpusets)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def pick_implementation(preferred: str) -> str:
+    """Use the fast implementation when installed, otherwise let uvicorn choose"""
+    return preferred if importlib.util.find_spec(preferred) else "auto"
+
+
+def main():
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", "8000"))
+    workers = int(os.getenv("WEB_CONCURRENCY") or available_cores())
+    workers = max(1, workers)
+
+    # ✅ Split the database connection budget across workers. Each worker's
+    # threadpool and background loops share its pool, so don't spread the
+    # budget thinner than DB_MIN_CONNECTIONS_PER_WORKER - run fewer workers instead
+    db_max_connections = int(os.getenv("DB_MAX_CONNECTIONS", "50"))
+    min_per_worker = int(os.getenv("DB_MIN_CONNECTIONS_PER_WORKER", "8"))
+    if db_max_connections // workers < min_per_worker:
+        capped = max(1, db_max_connections // min_per_worker)
+        if capped < workers:
+            print(
+                f"⚠️ {workers} workers would get {db_max_connections // workers} DB connections each "
+                f"(DB_MAX_CONNECTIONS={db_max_connections}) - running {capped} workers instead",
+                flush=True,
+            )
+            workers = capped
+    pool_max = max(1, db_max_connections // workers)  # never more than the budget in total
+    pool_min = min(int(os.getenv("DB_POOL_MIN", "2")), pool_max)
+    # Workers are spawned as subprocesses and inherit these
+    os.environ["DB_POOL_MAX"] = str(pool_max)
+    os.environ["DB_POOL_MIN"] = str(pool_min)
+
+    loop = pick_implementation("uvloop")
+    http = pick_implementation("httptools")
+    graceful_timeout = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30"))
+
+    # ✅ Only trust X-Forwarded-For from our own proxies - with "*" any client could
+    # pick its IP and get a fresh rate-limit bucket on every request
+    forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1").strip()
+    if "*" in {ip.strip() for ip in forwarded_allow_ips.split(",")}:
+        print("⚠️ FORWARDED_ALLOW_IPS='*' is not allowed (spoofable client IPs) - using 127.0.0.1", flush=True)
+        forwarded_allow_ips = "127.0.0.1"
+    os.environ.setdefault("SHUTDOWN_DRAIN_TIMEOUT", str(max(1, graceful_timeout - 5)))
+
+    print(
+        "🚀 Starting server\n"
+        f"   bind:              {host}:{port}\n"
+        f"   workers:           {workers} (cores available: {available_cores()})\n"
+        f"   event loop:        {loop}\n"
+        f"   http parser:       {http}\n"
+        f"   trusted proxies:   {forwarded_allow_ips}\n"
+        f"   db pool / worker:  min={pool_min} max={pool_max} (total budget {db_max_connections})\n"
+        f"   graceful shutdown: {graceful_timeout}s (background drain {os.environ['SHUTDOWN_DRAIN_TIMEOUT']}s)",
+        flush=True,
+    )
+
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        proxy_headers=True,
+        forwarded_allow_ips=forwarded_allow_ips,
+        timeout_graceful_shutdown=graceful_timeout,
+        access_log=os.getenv("ACCESS_LOG", "1").lower() in {"1", "true", "yes"},
+    )
+
+
+if __name__ == "__main__":
+    main()
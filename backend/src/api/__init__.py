@@ -3,12 +3,52 @@ from fastapi import HTTPException
 from fastapi.responses import JSONResponse
 from urllib.request import Request
 from datetime import datetime
+import os
 
 def create_app():
+    import asyncio
+    from contextlib import asynccontextmanager
     from fastapi import FastAPI
     from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import ORJSONResponse
+    from src.utils.db import PGDB
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # ✅ Only a version check - DDL runs at deploy time (src/utils/migrations.py)
+        await asyncio.to_thread(PGDB().check_schema_version)
+        # ✅ Keep next months' call_history partitions created ahead of time
+        from src.utils.maintenance import run_partition_maintenance
+        maintenance = asyncio.create_task(
+            run_partition_maintenance(float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "21600")))
+        )
+        # ✅ Keep live-call admission counters in sync with call_history
+        from src.utils.admission import admission
+        reconcile = asyncio.create_task(admission.run_reconcile_loop())
+        # ✅ Keep the in-memory token revocation set in sync with revoked_tokens
+        from src.utils.jwt_utils import run_revocation_refresh
+        revocations = asyncio.create_task(run_revocation_refresh())
+        # ✅ Batched writes of buffered agent telemetry
+        from src.utils.agent_events import agent_events
+        telemetry = asyncio.create_task(agent_events.run_flush_loop())
+        # ✅ Re-queue transcript/recording downloads lost to a crash or the last shutdown
+        from src.utils.utils import run_artifact_reconcile_loop
+        artifacts = asyncio.create_task(run_artifact_reconcile_loop())
+        yield
+        maintenance.cancel()
+        reconcile.cancel()
+        revocations.cancel()
+        telemetry.cancel()
+        artifacts.cancel()
+        await agent_events.flush()
+        # ✅ Graceful shutdown: let transcript/recording ingestion finish, then close the pool
+        from src.utils.utils import drain_background_tasks
+        await drain_background_tasks(float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "25")))
+        PGDB().close_pool()
 
     app = FastAPI(
+        lifespan=lifespan,
+        default_response_class=ORJSONResponse,  # ✅ orjson: fast, native datetime/UUID support
         title="Auth",
         description="Assist the user using the Knowledgebase",
         version="0.1.0",
@@ -19,6 +59,12 @@ def create_app():
 
     app.max_request_size = 200 * 1024 * 1024
 
+    # ✅ Token-bucket rate limiting - innermost, so 429s still get CORS headers
+    # and rejected requests never reach routing, bcrypt or the DB pool
+    if os.getenv("RATE_LIMIT_ENABLED", "1").lower() in {"1", "true", "yes"}:
+        from src.utils.rate_limit import RateLimitMiddleware
+        app.add_middleware(RateLimitMiddleware)
+
     # Set up CORS middleware
     app.add_middleware(
         CORSMiddleware,
@@ -28,6 +74,14 @@ def create_app():
         allow_headers=["*"],  # Allows all headers
     )
 
+    # ✅ gzip/brotli for JSON responses (history, transcripts); audio and
+    # Range responses from /calls/{call_id}/recording/stream pass through
+    from src.api.compression import CompressionMiddleware
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+    )
+
     app.include_router(router, tags=["Auth"], prefix="/api")
 
     # Route Handlers
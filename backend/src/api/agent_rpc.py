@@ -0,0 +1,277 @@
+"""
+Batched operations for the LiveKit agent.
+
+Instead of one HTTP request (and one pooled connection checkout) per mid-call
+action, the agent can send several operations at once:
+
+    POST /api/agent/rpc
+    {"operations": [
+        {"id": "1", "method": "report_event", "params": {"call_id": "...", "status": "connected"}},
+        {"id": "2", "method": "book_appointment", "params": {...}}
+    ]}
+
+or keep a WebSocket open on /api/agent/ws and send the same payload (plus an
+optional request "id" echoed back) per message.
+
+All database work of a batch runs in ONE transaction: either every operation is
+applied or none is. Side effects that must not be rolled back - calendar
+emails, artifact downloads, admission slot release - run after the commit.
+
+The single-purpose /agent/* endpoints use the same operations, so the HTTP and
+batched paths cannot drift apart.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+
+from src.utils.db import PGDB
+from src.utils.admission import admission
+from src.utils.agent_events import agent_events
+from src.utils.utils import fetch_and_store_transcript, fetch_and_store_recording, spawn_background_task, artifact_delay
+
+db = PGDB()
+
+MAX_OPERATIONS = int(os.getenv("AGENT_RPC_MAX_OPERATIONS", "50"))
+
+AGENT_REPORTED_STATUSES = {"initialized", "dialing", "connected", "unanswered"}
+
+
+class AgentRPCError(Exception):
+    """Invalid operation or parameters (the batch is rejected, nothing is written)"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        self.status_code = status_code
+        super().__init__(message)
+
+
+# ==================== OPERATIONS ====================
+# Each operation validates its params, does its DB work on `conn` (the batch
+# transaction) and returns (result, after_commit) - after_commit is an optional
+# coroutine function run once the transaction has committed; it may add to result.
+
+def get_appointments(conn, params: dict):
+    user_id = params.get("user_id")
+    if not user_id:
+        raise AgentRPCError("Missing user_id")
+    appointments = db.get_user_appointments(int(user_id), params.get("from_date"), conn=conn)
+    result = {
+        "success": True,
+        "user_id": user_id,
+        "appointments": [
+            {
+                "id": apt["id"],
+                "date": str(apt["appointment_date"]),
+                "start_time": str(apt["start_time"]),
+                "end_time": str(apt["end_time"]),
+                "attendee_email": apt["attendee_email"],
+                "attendee_name": apt["attendee_name"],
+                "title": apt["title"],
+                "description": apt["description"],
+                "status": apt["status"]
+            }
+            for apt in appointments
+        ]
+    }
+    return result, None
+
+
+def book_appointment(conn, params: dict):
+    user_id = params.get("user_id")
+    appointment_date = params.get("appointment_date")
+    start_time = params.get("start_time")
+    end_time = params.get("end_time")
+    attendee_name = params.get("attendee_name", "Valued Customer")
+    title = params.get("title", "Appointment")
+    description = params.get("description", "")
+    organizer_name = params.get("organizer_name")
+    organizer_email = params.get("organizer_email")
+
+    if not all([user_id, appointment_date, start_time, end_time, organizer_email]):
+        raise AgentRPCError("Missing required fields")
+
+    appointment_id = db.create_appointment(
+        user_id=user_id,
+        appointment_date=appointment_date,
+        start_time=start_time,
+        end_time=end_time,
+        attendee_name=attendee_name,
+        attendee_email=organizer_email,
+        title=title,
+        description=description,
+        call_id=params.get("call_id"),
+        conn=conn
+    )
+    result = {
+        "success": True,
+        "appointment_id": appointment_id,
+        "email_sent": False,
+        "message": "Appointment booked successfully"
+    }
+
+    async def send_invite():
+        from src.api.router import get_mail_obj
+
+        # Send calendar invite email (only once the booking is committed)
+        result["email_sent"] = await get_mail_obj().send_email_with_calendar_event(
+            attendee_email=organizer_email,
+            attendee_name=organizer_name,
+            appointment_date=appointment_date,
+            start_time=start_time,
+            end_time=end_time,
+            title=title,
+            description=description,
+            organizer_name=organizer_name,
+            organizer_email=organizer_email
+        )
+        logging.info(f"✅ Appointment booked successfully: {appointment_id}")
+
+    return result, send_invite
+
+
+def save_call_data(conn, params: dict):
+    call_id = params.get("call_id")
+    if not call_id:
+        raise AgentRPCError("Missing call_id")
+    transcript_blob = params.get("transcript_blob")
+    recording_blob = params.get("recording_blob")
+
+    updates = {
+        "transcript_blob": transcript_blob,
+        "recording_blob": recording_blob
+    }
+    # ✅ Readiness the clients can see until the delayed downloads report back
+    for kind, blob in (("transcript", transcript_blob), ("recording", recording_blob)):
+        updates[f"{kind}_status"] = "pending" if blob else None
+        updates[f"{kind}_attempts"] = 0
+        updates[f"{kind}_error"] = None
+    db.update_call_history(call_id, updates, conn=conn)
+
+    async def schedule_downloads():
+        # ✅ DELAYED transcript (5s)
+        if transcript_blob:
+            async def delayed_transcript():
+                await artifact_delay(call_id, "transcript", 5)
+                logging.info(f"📄 Downloading transcript for {call_id}")
+                await fetch_and_store_transcript(call_id, None, transcript_blob)
+            spawn_background_task(delayed_transcript(), name=f"transcript-{call_id}")
+
+        # ✅ DELAYED recording (15s)
+        if recording_blob:
+            async def delayed_recording():
+                await artifact_delay(call_id, "recording", 15)
+                logging.info(f"🎵 Downloading recording for {call_id}")
+                await fetch_and_store_recording(call_id, None, recording_blob)
+            spawn_background_task(delayed_recording(), name=f"recording-{call_id}")
+
+    return {"success": True}, schedule_downloads
+
+
+def report_event(conn, params: dict):
+    call_id = params.get("call_id")
+    status = params.get("status")
+    if not call_id or not status:
+        raise AgentRPCError("Missing data")
+    if status not in AGENT_REPORTED_STATUSES:
+        raise AgentRPCError("Invalid status")
+
+    # ✅ Handle unanswered (final - goes through the rollup path)
+    if status == "unanswered":
+        db.finalize_call(call_id, status, {
+            "ended_at": datetime.now(timezone.utc),
+            "duration": 0
+        }, conn=conn)
+
+        async def release_slot():
+            await admission.release(call_id)
+            agent_events.end_call(call_id)
+
+        return {"success": True}, release_slot
+
+    db.set_agent_call_status(call_id, status, conn=conn)
+    return {"success": True}, None
+
+
+OPERATIONS = {
+    "get_appointments": get_appointments,
+    "book_appointment": book_appointment,
+    "save_call_data": save_call_data,
+    "report_event": report_event,
+}
+
+
+# ==================== EXECUTION ====================
+
+def parse_operations(payload) -> list:
+    """Normalize a request body to [(op id, handler, params)]; raises AgentRPCError"""
+    if not isinstance(payload, dict):
+        raise AgentRPCError("Request body must be a JSON object")
+    operations = payload.get("operations")
+    if operations is None and "method" in payload:
+        operations = [payload]  # single operation shorthand
+    if not isinstance(operations, list) or not operations:
+        raise AgentRPCError("'operations' must be a non-empty list")
+    if len(operations) > MAX_OPERATIONS:
+        raise AgentRPCError(f"At most {MAX_OPERATIONS} operations per batch")
+
+    parsed = []
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict):
+            raise AgentRPCError(f"Operation {index} must be an object")
+        handler = OPERATIONS.get(op.get("method"))
+        if handler is None:
+            raise AgentRPCError(f"Operation {index}: unknown method '{op.get('method')}'")
+        params = op.get("params") or {}
+        if not isinstance(params, dict):
+            raise AgentRPCError(f"Operation {index}: 'params' must be an object")
+        parsed.append((op.get("id", index), handler, params))
+    return parsed
+
+
+def _run_in_transaction(operations: list) -> list:
+    """Runs in a worker thread: every operation on one connection, one commit"""
+    outcomes = []
+    with db.transaction("agent_rpc") as conn:
+        for op_id, handler, params in operations:
+            try:
+                result, after_commit = handler(conn, params)
+            except AgentRPCError as e:
+                if op_id is None:
+                    raise
+                raise AgentRPCError(f"Operation {op_id}: {e}", e.status_code) from e
+            outcomes.append((op_id, result, after_commit))
+    return outcomes
+
+
+async def execute(operations: list) -> list:
+    """
+    Run parsed operations atomically, then their post-commit side effects.
+    Returns [{"id", "result"}] in request order.
+    """
+    outcomes = await asyncio.to_thread(_run_in_transaction, operations)
+
+    hooks = [after_commit() for _, _, after_commit in outcomes if after_commit]
+    if hooks:
+        for error in await asyncio.gather(*hooks, return_exceptions=True):
+            if isinstance(error, Exception):
+                logging.error(f"❌ Agent RPC post-commit step failed: {error}")
+
+    return [{"id": op_id, "result": result} for op_id, result, _ in outcomes]
+
+
+async def handle_batch(payload) -> tuple:
+    """(status code, response body) for one batch - shared by HTTP and WebSocket"""
+    try:
+        results = await execute(parse_operations(payload))
+        return 200, {"success": True, "results": results}
+    except AgentRPCError as e:
+        return e.status_code, {"success": False, "error": str(e)}
+    except Exception as e:
+        logging.error(f"❌ Agent RPC batch failed (rolled back): {e}")
+        return 500, {"success": False, "error": str(e)}
+
+
+async def run_single(method: str, params: dict) -> dict:
+    """One operation, for the single-purpose /agent/* endpoints"""
+    results = await execute([(None, OPERATIONS[method], params)])
+    return results[0]["result"]
@@ -26,8 +26,19 @@ class UserOut(BaseModel):
 class LoginResponse(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
     user: UserOut
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+class TokenResponse(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str
+    expires_in: int
+
 class UpdateUserProfileRequest(BaseModel):
     # user_id: int
     first_name: Optional[str] = None
@@ -56,11 +67,17 @@ class CallDetailsPayload(BaseModel):
     # caller_email: EmailStr
 
 class Assistant_Payload(BaseModel):
-    outbound_number: str      # Phone number to dial
+    outbound_number: Optional[str] = None  # Phone number to dial (or contact_id)
+    contact_id: Optional[int] = None       # Dial an imported contact instead
     caller_name: str          # Your name/company name
     caller_email: str         # Your email (for sending calendar invites)
     caller_number: str        # Your phone number
     objective: str
     context: str
     language: str 
-    voice: str 
\ No newline at end of file
+    voice: str
+
+
+class DoNotCallPayload(BaseModel):
+    phone_number: str
+    reason: Optional[str] = None
@@ -0,0 +1,197 @@
+import gzip
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli  # optional - falls back to gzip when not installed
+except ImportError:
+    brotli = None
+
+
+# Already-compressed media and byte-range responses are never re-encoded
+EXCLUDED_CONTENT_TYPES = ("audio/", "video/", "image/", "application/octet-stream", "application/zip", "application/gzip")
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """Map each encoding in an Accept-Encoding header to its q-value"""
+    encodings = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[token] = q
+    return encodings
+
+
+def choose_encoding(header: str, available=None):
+    """Pick the best supported encoding the client accepts ('br', 'gzip' or None)"""
+    available = available or (("br", "gzip") if brotli else ("gzip",))
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in available:  # listed in server preference order
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def accepts_encoding(header: str, encoding: str) -> bool:
+    """True if the client explicitly (or via *) accepts `encoding`"""
+    accepted = parse_accept_encoding(header)
+    return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+
+def compress_body(body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class _StreamCompressor:
+    """Incremental compressor for streaming responses (CSV/NDJSON exports, SSE, ...)"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=brotli_quality)
+            self._gz = None
+        else:
+            self._br = None
+            self._gz = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, chunk: bytes) -> bytes:
+        # Flush after every chunk so the client receives data as it is produced
+        if self._br:
+            return self._br.process(chunk) + self._br.flush()
+        return self._gz.compress(chunk) + self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self._br:
+            return self._br.finish()
+        return self._gz.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """
+    gzip/brotli response compression with Accept-Encoding negotiation.
+
+    - Bodies smaller than `minimum_size` are sent as-is.
+    - Responses that already carry Content-Encoding (e.g. pre-compressed
+      transcripts), partial content (206) and audio/video/binary content types
+      pass through untouched.
+    - Streaming responses are compressed chunk by chunk.
+    - A strong ETag on a compressed response is made weak (as nginx does), so
+      If-None-Match still matches while If-Range never pairs it with the
+      identity bytes.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5,
+                 excluded_content_types=EXCLUDED_CONTENT_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.excluded_content_types = tuple(excluded_content_types)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        await _CompressionResponder(self, encoding, send).run(scope, receive)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message = None
+        self.mode = None  # None until the first body chunk: "passthrough" | "stream"
+        self.compressor = None
+
+    async def run(self, scope, receive):
+        await self.middleware.app(scope, receive, self.send_wrapper)
+
+    def _should_compress(self, headers: MutableHeaders) -> bool:
+        if self.start_message["status"] in (204, 206, 304):
+            return False
+        if "content-encoding" in headers:
+            return False
+        if "no-transform" in headers.get("cache-control", ""):
+            return False
+        content_type = headers.get("content-type", "").lower()
+        return not content_type.startswith(self.middleware.excluded_content_types)
+
+    async def send_wrapper(self, message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            self.start_message = message
+            return
+
+        if message_type != "http.response.body":
+            # e.g. http.response.pathsend - flush the held start message and pass through
+            if self.start_message is not None and self.mode is None:
+                self.mode = "passthrough"
+                await self.send(self.start_message)
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.mode is None:
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            if not self._should_compress(headers) or (not more_body and len(body) < self.middleware.minimum_size):
+                self.mode = "passthrough"
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                # the encoded body is a different representation - it may no longer
+                # share the identity body's strong validator (RFC 9110 8.8.3)
+                headers["ETag"] = "W/" + etag
+
+            if not more_body:
+                compressed = compress_body(body, self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+                headers["Content-Length"] = str(len(compressed))
+                self.mode = "passthrough"
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+
+            if "content-length" in headers:
+                del headers["Content-Length"]
+            self.mode = "stream"
+            self.compressor = _StreamCompressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+            await self.send(self.start_message)
+            await self.send({"type": "http.response.body", "body": self.compressor.compress(body), "more_body": True})
+            return
+
+        if self.mode == "stream":
+            chunk = self.compressor.compress(body) if body else b""
+            if not more_body:
+                chunk += self.compressor.finish()
+            await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+            return
+
+        await self.send(message)
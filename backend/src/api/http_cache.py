@@ -0,0 +1,87 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Response
+
+FINAL_CALL_STATUSES = {"completed", "unanswered"}
+
+# Artifacts of a finalized call never change, so clients may keep them forever
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# Still in progress: cache, but revalidate every time (cheap thanks to the ETag)
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(checksum: str, variant: str = None) -> str:
+    """Strong ETag from a stored content checksum (+ variant, e.g. 'gz' for a gzip body)"""
+    tag = checksum[:32]
+    if variant:
+        tag = f"{tag}-{variant}"
+    return f'"{tag}"'
+
+
+def http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Weak comparison (RFC 9110 13.1.2) - W/ prefixes are ignored for If-None-Match
+    candidates = [c.strip().removeprefix("W/") for c in header.split(",")]
+    return etag in candidates
+
+
+def is_not_modified(headers, etag: str = None, last_modified: datetime = None) -> bool:
+    """
+    Evaluate If-None-Match / If-Modified-Since for a GET.
+    If-None-Match takes precedence; If-Modified-Since is only used without it.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return bool(etag) and _etag_matches(if_none_match, etag)
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        # HTTP dates have one-second resolution
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def if_range_allows_partial(headers, etag: str = None, last_modified: datetime = None) -> bool:
+    """If-Range: only honour the Range header when the validator still matches"""
+    if_range = headers.get("if-range")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return bool(etag) and if_range.strip() == etag
+    if last_modified:
+        try:
+            return http_date(last_modified) == http_date(parsedate_to_datetime(if_range))
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cache_headers(etag: str = None, last_modified: datetime = None, status: str = None) -> dict:
+    """Validator + Cache-Control headers for a call artifact"""
+    headers = {
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if status in FINAL_CALL_STATUSES else REVALIDATE_CACHE_CONTROL,
+    }
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified_response(headers: dict) -> Response:
+    """304 with the validators and caching headers, no body"""
+    return Response(status_code=304, headers=headers)
@@ -2,54 +2,78 @@ import json
 import logging
 import os
 import io
+import base64
 
 import traceback
+import hashlib
+import uuid
 from datetime import datetime, timedelta,timezone
 from typing import Dict, List, Optional, Tuple, Any
-import requests
 import asyncio
 from dotenv import load_dotenv
 from fastapi import (
     APIRouter,
     Depends,
+    File,
     HTTPException,
     Query,
     Request,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
 )
 from datetime import datetime
 
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse,StreamingResponse
+from fastapi.responses import JSONResponse,ORJSONResponse,StreamingResponse,FileResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi import HTTPException, Response
-from rich import print
 from src.api.base_models import (
     UserLogin,
     UserRegister,
     UserOut,
     LoginResponse,
+    RefreshTokenRequest,
+    TokenResponse,
     UpdateUserProfileRequest,
-    Assistant_Payload
+    Assistant_Payload,
+    DoNotCallPayload
 )
 from src.models.System_Prompt import SystemPromptBuilder
-from src.utils.db import PGDB 
-from src.utils.mail_management import Send_Mail
-from src.utils.jwt_utils import create_access_token
-from src.utils.utils import get_current_user,add_call_event, get_livekit_call_status,fetch_and_store_transcript,fetch_and_store_recording, calculate_duration, check_if_answered
-from livekit import api
+from src.utils.db import PGDB, transcript_response_gzip, call_id_filter, new_call_id
+from src.api.compression import accepts_encoding
+from src.api import agent_rpc
+from src.api.http_cache import make_etag, cache_headers, is_not_modified, if_range_allows_partial, not_modified_response
+from src.utils.jwt_utils import create_access_token, new_refresh_token, parse_refresh_token, revoke_token, decode_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
+from src.utils.contacts import normalize_phone
+from src.utils.admission import admission, AdmissionRejected
+from src.utils.agent_events import agent_events
+from src.utils.recording_pipeline import choose_rendition, downsample_peaks, ORIGINAL, PREVIEW
+from src.utils.recording_cache import recording_cache, archived_token
+from src.utils.metrics import metrics
+from src.utils.utils import auth_scheme, get_current_user,is_admin,add_call_event, get_livekit_call_status, _fetch_from_gcs_blob, calculate_duration, answered_signal, webhook_event_time, spawn_background_task, ARTIFACT_RETRY_DELAY
 
 load_dotenv()
 
 router = APIRouter()
-mail_obj = Send_Mail()
-db = PGDB()
+db = PGDB()  # ✅ No connection yet - the pool is created on first use
+_mail_obj = None
 load_dotenv(override=True)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GCS_BUCKET_NAME = os.getenv("GOOGLE_BUCKET_NAME")
 GCS_SERVICE_ACCOUNT_KEY = os.getenv("GCS_SERVICE_ACCOUNT_KEY")  
 
 
+def get_mail_obj():
+    """Mail client, created on first use (keeps smtplib/pytz out of cold start)"""
+    global _mail_obj
+    if _mail_obj is None:
+        from src.utils.mail_management import Send_Mail
+        _mail_obj = Send_Mail()
+    return _mail_obj
+
+
 # error response 
 def error_response(message, status_code=400):
     return JSONResponse(
@@ -74,26 +98,38 @@ def register_user(user: UserRegister):
         traceback.print_exc()
         return error_response(status_code=500, message=f"Registration failed: {str(e)}")
 
+def issue_tokens(user_id: int, session_id: str, refresh_token: str) -> dict:
+    """Access token bound to its refresh session (sid) + the rotated refresh token"""
+    return {
+        "access_token": create_access_token({"sub": str(user_id), "sid": session_id}),
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+
 @router.post("/login",response_model=LoginResponse,)
-def login_user(user: UserLogin):
+def login_user(user: UserLogin, request: Request):
     try:
         user_dict = {
         "email": user.email,
         "password": user.password
     }
-        logging.info(f"User dict: {user_dict}")
+        logging.info(f"Login attempt: {user_dict['email']}")
         user_dict["email"] = user_dict["email"].strip().lower()
         result = db.login_user(user_dict)
         if not result:
             return error_response("Invalid username or password", status_code=422)
         
         
-        token = create_access_token({"sub": str(result["id"])})
-        return {
-            "access_token": token,
-            "token_type": "bearer",
-            "user": result
-        }
+        # ✅ bcrypt only here; renewals go through /token/refresh
+        session_id = uuid.uuid4().hex
+        refresh_token, refresh_hash = new_refresh_token(session_id)
+        db.create_auth_session(
+            session_id, result["id"], refresh_hash, REFRESH_TOKEN_EXPIRE_DAYS,
+            user_agent=request.headers.get("user-agent"),
+        )
+        return {**issue_tokens(result["id"], session_id, refresh_token), "user": result}
         
     except ValueError as ve:
         # Return 401 when credentials are invalid
@@ -105,6 +141,42 @@ def login_user(user: UserLogin):
     
 
 
+@router.post("/token/refresh", response_model=TokenResponse)
+def refresh_access_token(body: RefreshTokenRequest):
+    """
+    Exchange a refresh token for a new access token + refresh token (rotation).
+    One indexed UPDATE on auth_sessions - no password hashing, no users lookup.
+    """
+    parsed = parse_refresh_token(body.refresh_token)
+    if not parsed:
+        return error_response("Invalid refresh token", status_code=401)
+    session_id, presented_hash = parsed
+    refresh_token, refresh_hash = new_refresh_token(session_id)
+    try:
+        session = db.rotate_auth_session(session_id, presented_hash, refresh_hash)
+    except Exception as e:
+        logging.error(f"Error refreshing token: {str(e)}")
+        return error_response("Internal server error", status_code=500)
+    if not session:
+        return error_response("Invalid or expired refresh token", status_code=401)
+    return issue_tokens(session["user_id"], session_id, refresh_token)
+
+
+@router.post("/logout")
+def logout_user(token=Depends(auth_scheme), user=Depends(get_current_user)):
+    """End this login session: revoke its refresh token and the current access token"""
+    payload = decode_access_token(token.credentials)
+    try:
+        if payload.get("sid"):
+            db.revoke_auth_session(payload["sid"], user["id"])
+        revoke_token(payload)
+    except Exception as e:
+        logging.error(f"Error during logout: {str(e)}")
+        return error_response("Internal server error", status_code=500)
+    return {"message": "Logged out"}
+
+
+
 voices = {
     # English voices
     "david": "1SM7GgM6IMuvQlz2BwM3",
@@ -122,9 +194,73 @@ voices = {
 }
 
 @router.post("/assistant-initiate-call")
-async def make_call_with_livekit(payload: Assistant_Payload, user=Depends(get_current_user)):
+async def make_call_with_livekit(payload: Assistant_Payload, request: Request, user=Depends(get_current_user)):
+    """
+    Start an outbound call.
+
+    Send an `Idempotency-Key` header to make retries safe: a retry with the same
+    key and body replays the original response without dispatching again.
+    """
+    idempotency_key = request.headers.get("idempotency-key")
+    if not idempotency_key:
+        return await initiate_call(payload, user)
+
+    if len(idempotency_key) > 255:
+        return error_response("Idempotency-Key must be at most 255 characters", status_code=400)
+
+    request_hash = hashlib.sha256(
+        json.dumps(payload.model_dump(), sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    claimed, existing = db.claim_idempotency_key(user["id"], idempotency_key, request_hash)
+
+    if not claimed:
+        if existing["request_hash"] != request_hash:
+            return error_response("Idempotency-Key was already used with a different request", status_code=422)
+        if existing["status"] == "completed":
+            logging.info(f"♻️ Replaying response for Idempotency-Key {idempotency_key}")
+            return ORJSONResponse(
+                existing["response_body"],
+                status_code=existing["response_status"],
+                headers={"Idempotent-Replayed": "true"}
+            )
+        return JSONResponse(
+            {"error": "A request with this Idempotency-Key is still in progress"},
+            status_code=409,
+            headers={"Retry-After": "1"}
+        )
+
+    dispatched_room = None
+
+    def on_dispatch(room_name: str):
+        nonlocal dispatched_room
+        dispatched_room = room_name
+
     try:
-        room_name = f"call-{user['id']}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        response = await initiate_call(payload, user, on_dispatch=on_dispatch)
+    except BaseException as e:  # ✅ also cancellation - never leave the key in progress
+        if dispatched_room is None:
+            db.release_idempotency_key(user["id"], idempotency_key)
+        else:
+            # LiveKit may already be dialing: replay this outcome instead of dialing again
+            db.complete_idempotency_key(user["id"], idempotency_key, 500, json.dumps({
+                "error": "Call dispatch outcome unknown, check the call status before retrying",
+                "call_id": dispatched_room,
+                "detail": e.detail if isinstance(e, HTTPException) else "Request interrupted",
+            }))
+        raise
+
+    if response.status_code < 400:
+        db.complete_idempotency_key(user["id"], idempotency_key, response.status_code, response.body.decode("utf-8"))
+    else:
+        # Rejected before dispatch (unknown contact, do-not-call, ...): allow a corrected retry
+        db.release_idempotency_key(user["id"], idempotency_key)
+    return response
+
+
+async def initiate_call(payload: Assistant_Payload, user: dict, on_dispatch=None):
+    """`on_dispatch(room_name)` is called right before the agent dispatch is sent"""
+    try:
+        room_name = new_call_id(user["id"])
         
         # ✅ Get voice_id from payload.voice name
         voice_name = getattr(payload, "voice", "david").lower()  # Default to 'david'
@@ -144,10 +280,41 @@ async def make_call_with_livekit(payload: Assistant_Payload, user=Depends(get_cu
         
         logging.info(f"🎤 Using voice: {voice_name} (ID: {voice_id}), Language: {language}")
         
+        # ✅ Resolve the number to dial: an imported contact or a raw number
+        contact = None
+        if payload.contact_id is not None:
+            contact = db.get_contact(user["id"], payload.contact_id)
+            if not contact:
+                return error_response("Contact not found", status_code=404)
+            outbound_number = contact["phone_number"]
+        elif payload.outbound_number:
+            outbound_number = payload.outbound_number
+        else:
+            return error_response("Either outbound_number or contact_id is required", status_code=400)
+
+        normalized_number = normalize_phone(outbound_number)
+        if (contact and contact["on_do_not_call"]) or (
+            normalized_number and db.is_do_not_call(user["id"], normalized_number)
+        ):
+            return error_response("Number is on the do-not-call list", status_code=403)
+
+        # ✅ Admission control: reserve a live-call slot (waits briefly, else 429)
+        try:
+            ticket = await admission.acquire(user["id"])
+        except AdmissionRejected as rejected:
+            logging.warning(f"⚠️ Call rejected for user {user['id']}: {rejected}")
+            metrics.inc("admission_rejected_total", scope=rejected.scope)
+            return JSONResponse(
+                {"error": str(rejected), "scope": rejected.scope, "retry_after": rejected.retry_after},
+                status_code=429,
+                headers={"Retry-After": str(rejected.retry_after)}
+            )
+
         # ✅ STEP 1: Get user's custom prompt from DB
         user_prompt_data = db.get_user_prompt(user["id"])
         
         if not user_prompt_data:
+            await admission.cancel(ticket)
             return error_response("User prompt not found", status_code=404)
         
         base_prompt = user_prompt_data["system_prompt"]
@@ -168,7 +335,7 @@ async def make_call_with_livekit(payload: Assistant_Payload, user=Depends(get_cu
         
         # ✅ STEP 3: Prepare metadata with complete prompt + voice + language
         metadata = {
-            "phone_number": payload.outbound_number,
+            "phone_number": outbound_number,
             "call_context": payload.context,
             "user_id": user["id"],
             "caller_name": payload.caller_name,
@@ -185,14 +352,21 @@ async def make_call_with_livekit(payload: Assistant_Payload, user=Depends(get_cu
             user_id=user["id"],
             call_id=room_name,
             status="initiated",
-            to_number=payload.outbound_number,
+            to_number=outbound_number,
             voice_name=voice_name,  # ✅ Store voice name
+            language=language,
+            contact_id=contact["id"] if contact else None,
         )
+        admission.activate(ticket, room_name)
         logging.info(f"✅ Created call record: {room_name}")
 
         add_call_event(room_name, "call_initiated", {"user_id": user["id"]})
 
         # ✅ STEP 5: Dispatch agent
+        from livekit import api
+
+        if on_dispatch:
+            on_dispatch(room_name)
         async with api.LiveKitAPI(
             url=os.getenv("LIVEKIT_URL", "").replace("wss://", "https://"),
             api_key=os.getenv("LIVEKIT_API_KEY"),
@@ -221,6 +395,9 @@ async def make_call_with_livekit(payload: Assistant_Payload, user=Depends(get_cu
         logging.error(f"Error initiating LiveKit call: {e}")
         traceback.print_exc()
         
+        if 'ticket' in locals():
+            await admission.cancel(ticket)
+
         if 'room_name' in locals():
             try:
                 db.update_call_history(
@@ -250,6 +427,12 @@ async def livekit_webhook(request: Request):
 
         # ✅ Always log event
         add_call_event(call_id, event, data)
+
+        # ✅ Answer detection happens as events arrive, not by rescanning the log at room end
+        answered_at = answered_signal(event, data)
+        if answered_at and db.mark_call_answered(call_id, answered_at):
+            # Late/out-of-order evidence: re-settle if the call already ended (no-op otherwise)
+            db.settle_call(call_id)
         
         # ✅ Ignore non-critical events
         if event in ["room_started", "participant_joined", "egress_started", 
@@ -258,52 +441,14 @@ async def livekit_webhook(request: Request):
 
         # ✅ Handle room end
         if event in ["room_finished", "participant_left"]:
-            await asyncio.sleep(0.5)
-            
-            conn = db.get_connection()
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute("""
-                        SELECT status, events_log, started_at, created_at
-                        FROM call_history WHERE call_id = %s
-                    """, (call_id,))
-                    row = cursor.fetchone()
-            finally:
-                db.release_connection(conn)  # ✅ FIXED: Changed from conn.close()
-
-            if not row:
+            # ✅ Duration from LiveKit's event timestamps (answered_at -> earliest end
+            # signal), so webhook delivery lag never counts; repeats only correct it
+            final_status = db.settle_call(call_id, webhook_event_time(data))
+            if final_status is None:
                 return JSONResponse({"message": "Call not found"})
 
-            current_status, events_log, db_started_at, created_at = row
-            
-            # ✅ Skip if already final
-            if current_status in {"completed", "unanswered"}:
-                # Just update duration
-                started = db_started_at or created_at
-                ended = datetime.now(timezone.utc)
-                duration = (ended - started).total_seconds() if started else 0
-                
-                db.update_call_history(call_id, {
-                    "duration": max(0, duration),
-                    "ended_at": ended
-                })
-                return JSONResponse({"message": "Duration updated"})
-
-            # ✅ Determine final status
-            answered = check_if_answered(events_log)
-            final_status = "completed" if answered else "unanswered"
-            
-            started = db_started_at or created_at
-            ended = datetime.now(timezone.utc)
-            duration = (ended - started).total_seconds() if (answered and started) else 0
-
-            db.update_call_history(call_id, {
-                "status": final_status,
-                "duration": max(0, duration),
-                "ended_at": ended,
-                "started_at": started
-            })
-            
+            await admission.release(call_id)  # ✅ frees the live-call slot
+            agent_events.end_call(call_id)      # ✅ drops this worker's telemetry dedupe state
             return JSONResponse({"message": f"Call ended: {final_status}"})
 
         # ✅ Handle recording
@@ -415,14 +560,15 @@ async def livekit_egress_webhook(request: Request):
 async def get_call_status(call_id: str):
     """Optimized status check with proper connection handling"""
     try:
+        where, params = call_id_filter(call_id)
         conn = db.get_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
+                cursor.execute(f"""
                     SELECT status, created_at, ended_at, duration, started_at
                     FROM call_history 
-                    WHERE call_id = %s
-                """, (call_id,))
+                    WHERE {where}
+                """, params)
                 row = cursor.fetchone()
         finally:
             db.release_connection(conn)  # ✅ FIXED: Was conn.close()
@@ -498,25 +644,13 @@ async def get_user_call_history(
         for call in history.get("calls", []):
             call_data = {**call}
             
-            # ✅ FIX 1: Ensure timestamps are included and properly formatted
-            # Convert datetime objects to ISO strings if they exist
-            if call.get("created_at"):
-                call_data["created_at"] = call["created_at"].isoformat() if hasattr(call["created_at"], 'isoformat') else str(call["created_at"])
-            
-            if call.get("started_at"):
-                call_data["started_at"] = call["started_at"].isoformat() if hasattr(call["started_at"], 'isoformat') else str(call["started_at"])
-            
-            if call.get("ended_at"):
-                call_data["ended_at"] = call["ended_at"].isoformat() if hasattr(call["ended_at"], 'isoformat') else str(call["ended_at"])
-            
-            # ✅ FIX 2: Calculate display duration if not available
+            # ✅ Timestamps stay datetime objects - ORJSONResponse serializes them natively
+
+            # ✅ Calculate display duration if not available
             if not call_data.get("duration") and call.get("started_at") and call.get("ended_at"):
                 try:
-                    from datetime import datetime
-                    start = call["started_at"] if isinstance(call["started_at"], datetime) else datetime.fromisoformat(str(call["started_at"]))
-                    end = call["ended_at"] if isinstance(call["ended_at"], datetime) else datetime.fromisoformat(str(call["ended_at"]))
-                    call_data["duration"] = round((end - start).total_seconds(), 1)
-                except:
+                    call_data["duration"] = round((call["ended_at"] - call["started_at"]).total_seconds(), 1)
+                except Exception:
                     call_data["duration"] = 0
             
             # Parse transcript text
@@ -540,7 +674,7 @@ async def get_user_call_history(
             call_data["transcript_text"] = transcript_text
             
             # ✅ FIX 3: Add recording availability flag
-            call_data["has_recording"] = bool(call.get("recording_url") or call.get("recording_blob_data"))
+            call_data["has_recording"] = bool(call.get("recording_url") or call_data.pop("has_recording_data", False))
             
             calls.append(call_data)
 
@@ -553,13 +687,11 @@ async def get_user_call_history(
             "not_completed_calls": history.get("not_completed_calls", 0),
         }
 
-        from fastapi.encoders import jsonable_encoder
-
-        return JSONResponse(content=jsonable_encoder({
+        return ORJSONResponse({
             "user_id": user["id"],
             "pagination": pagination,
             "calls": calls
-        }))
+        })
 
     except Exception as e:
         logging.error(f"Error fetching history: {e}")
@@ -567,30 +699,161 @@ async def get_user_call_history(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+EXPORT_BATCH_ROWS = 500  # rows per streamed chunk
+
+
+@router.get("/call-history/export")
+async def export_call_history(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    from_date: Optional[str] = Query(None, description="YYYY-MM-DD (inclusive)"),
+    to_date: Optional[str] = Query(None, description="YYYY-MM-DD (inclusive)"),
+    status: Optional[str] = None,
+    voice: Optional[str] = None,
+    user=Depends(get_current_user)
+):
+    """
+    Stream the user's call history as CSV or NDJSON (oldest first).
+    Rows come from a server-side cursor and are written out in small chunks,
+    so memory use is constant regardless of the export size.
+    """
+    try:
+        for value in (from_date, to_date):
+            if value:
+                datetime.strptime(value, "%Y-%m-%d")  # ValueError -> 400
+    except ValueError as ve:
+        return error_response(str(ve), status_code=400)
+
+    rows = db.iter_call_history_export(
+        user["id"], from_date=from_date, to_date=to_date, status=status, voice_name=voice
+    )
+    columns = PGDB.EXPORT_COLUMNS
+
+    # Sync generators: StreamingResponse iterates them in the threadpool,
+    # so the blocking cursor fetches never run on the event loop
+    def ndjson_chunks():
+        import orjson
+
+        chunk = []
+        for row in rows:
+            chunk.append(orjson.dumps(row))
+            if len(chunk) >= EXPORT_BATCH_ROWS:
+                yield b"\n".join(chunk) + b"\n"
+                chunk = []
+        if chunk:
+            yield b"\n".join(chunk) + b"\n"
+
+    def csv_chunks():
+        import csv
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        count = 0
+        for row in rows:
+            writer.writerow([
+                value.isoformat() if isinstance(value, datetime) else value
+                for value in (row[c] for c in columns)
+            ])
+            count += 1
+            if count % EXPORT_BATCH_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    filename = f"call-history-{datetime.now(timezone.utc):%Y%m%d%H%M%S}.{format}"
+    return StreamingResponse(
+        csv_chunks() if format == "csv" else ndjson_chunks(),
+        media_type="text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@router.post("/agent/rpc")
+async def agent_rpc_batch(request: Request):
+    """
+    Several agent operations in one request and one DB transaction
+    (see src/api/agent_rpc.py for the payload format)
+    """
+    try:
+        payload = await request.json()
+    except Exception:
+        return JSONResponse(status_code=400, content={"success": False, "error": "Invalid JSON"})
+    status_code, body = await agent_rpc.handle_batch(payload)
+    return JSONResponse(status_code=status_code, content=jsonable_encoder(body))
+
+
+@router.websocket("/agent/ws")
+async def agent_rpc_socket(websocket: WebSocket):
+    """
+    Persistent agent channel: each message is a batch (same format as
+    /agent/rpc, optional "id" echoed back), answered in order.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                payload = await websocket.receive_json()
+            except ValueError:
+                await websocket.send_json({"success": False, "error": "Invalid JSON"})
+                continue
+            status_code, body = await agent_rpc.handle_batch(payload)
+            body["status"] = status_code
+            if isinstance(payload, dict) and "id" in payload:
+                body["id"] = payload["id"]
+            await websocket.send_json(jsonable_encoder(body))
+    except WebSocketDisconnect:
+        logging.info("Agent WebSocket disconnected")
+
+
+@router.post("/agent/events")
+async def ingest_agent_events(request: Request):
+    """Batch of agent telemetry events: {"events": [{"call_id", "event_type", "event_data", "timestamp"}]}"""
+    try:
+        data = await request.json()
+    except Exception:
+        return JSONResponse({"error": "Invalid JSON"}, status_code=400)
+    events = data.get("events") if isinstance(data, dict) else None
+    if not isinstance(events, list):
+        return JSONResponse({"error": "'events' must be a list"}, status_code=400)
+    accepted, duplicates, invalid = agent_events.add_many(events)
+    return JSONResponse({"accepted": accepted, "duplicates": duplicates, "invalid": invalid})
+
+
+@router.websocket("/agent/events/ws")
+async def agent_events_socket(websocket: WebSocket):
+    """
+    Telemetry stream from the agent. Each message is one event object or
+    {"events": [...]}; events are buffered and written in batches. Messages
+    carrying an "id" get an ack with accepted/duplicate counts.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except ValueError:
+                await websocket.send_json({"error": "Invalid JSON"})
+                continue
+            if isinstance(message, dict) and isinstance(message.get("events"), list):
+                events = message["events"]
+            else:
+                events = [message]
+            accepted, duplicates, invalid = agent_events.add_many(events)
+            if isinstance(message, dict) and "id" in message:
+                await websocket.send_json({
+                    "id": message["id"], "accepted": accepted, "duplicates": duplicates, "invalid": invalid
+                })
+    except WebSocketDisconnect:
+        logging.info("Agent telemetry WebSocket disconnected")
+
+
 @router.get("/agent/get-appointments/{user_id}")
 async def get_appointments(user_id: int, from_date: str = None):
     """API for LiveKit agent to get all appointments for checking conflicts"""
     try:
-        appointments = db.get_user_appointments(user_id, from_date)
-        
-        return JSONResponse({
-            "success": True,
-            "user_id": user_id,
-            "appointments": [
-                {
-                    "id": apt["id"],
-                    "date": str(apt["appointment_date"]),
-                    "start_time": str(apt["start_time"]),
-                    "end_time": str(apt["end_time"]),
-                    "attendee_email": apt["attendee_email"],
-                    "attendee_name": apt["attendee_name"],
-                    "title": apt["title"],
-                    "description": apt["description"],
-                    "status": apt["status"]
-                }
-                for apt in appointments
-            ]
-        })
+        result = await agent_rpc.run_single("get_appointments", {"user_id": user_id, "from_date": from_date})
+        return JSONResponse(jsonable_encoder(result))
         
     except Exception as e:
         logging.error(f"Error fetching appointments: {e}")
@@ -639,56 +902,9 @@ async def book_appointment(request: Request):
     """
     try:
         data = await request.json()
-        
-        user_id = data.get("user_id")
-        appointment_date = data.get("appointment_date") 
-        start_time = data.get("start_time")
-        end_time = data.get("end_time")
-        attendee_name = data.get("attendee_name", "Valued Customer")
-        title = data.get("title", "Appointment")
-        description = data.get("description", "")
-        organizer_name = data.get("organizer_name")
-        organizer_email = data.get("organizer_email")
-        
-        if not all([user_id, appointment_date, start_time, end_time, organizer_email]):
-            return error_response("Missing required fields", status_code=400)
-        
-        # ✅ REMOVED: Conflict checking
-        # Just book directly
-        
-        appointment_id = db.create_appointment(
-            user_id=user_id,
-            appointment_date=appointment_date,
-            start_time=start_time,
-            end_time=end_time,
-            attendee_name=attendee_name,
-            attendee_email=organizer_email,
-            title=title,
-            description=description
-        )
-        
-        # Send calendar invite email
-        email_sent = await mail_obj.send_email_with_calendar_event(
-            attendee_email=organizer_email,
-            attendee_name=organizer_name,
-            appointment_date=appointment_date,
-            start_time=start_time,
-            end_time=end_time,
-            title=title,
-            description=description,
-            organizer_name=organizer_name,
-            organizer_email=organizer_email
-        )
-        
-        logging.info(f"✅ Appointment booked successfully: {appointment_id}")
-        
-        return JSONResponse({
-            "success": True,
-            "appointment_id": appointment_id,
-            "email_sent": email_sent,
-            "message": "Appointment booked successfully"
-        })
-        
+        return JSONResponse(await agent_rpc.run_single("book_appointment", data))
+    except agent_rpc.AgentRPCError as e:
+        return error_response(str(e), status_code=e.status_code)
     except Exception as e:
         logging.error(f"❌ Error booking appointment: {e}")
         traceback.print_exc()
@@ -700,37 +916,9 @@ async def book_appointment(request: Request):
 async def save_call_data(request: Request):
     try:
         data = await request.json()
-        
-        call_id = data.get("call_id")
-        transcript_blob = data.get("transcript_blob")
-        recording_blob = data.get("recording_blob")
-        
-        # Save metadata
-        updates = {
-            "transcript_blob": transcript_blob,
-            "recording_blob": recording_blob
-        }
-        
-        db.update_call_history(call_id, updates)
-        
-        # ✅ DELAYED transcript (5s)
-        if transcript_blob:
-            async def delayed_transcript():
-                await asyncio.sleep(5)
-                logging.info(f"📄 Downloading transcript for {call_id}")
-                await fetch_and_store_transcript(call_id, None, transcript_blob)
-            asyncio.create_task(delayed_transcript())
-        
-        # ✅ DELAYED recording (15s)
-        if recording_blob:
-            async def delayed_recording():
-                await asyncio.sleep(15)
-                logging.info(f"🎵 Downloading recording for {call_id}")
-                await fetch_and_store_recording(call_id, None, recording_blob)
-            asyncio.create_task(delayed_recording())
-        
-        return JSONResponse({"success": True})
-        
+        return JSONResponse(await agent_rpc.run_single("save_call_data", data))
+    except agent_rpc.AgentRPCError as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
     except Exception as e:
         logging.error(f"❌ save_call_data error: {e}")
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -742,45 +930,9 @@ async def save_call_data(request: Request):
 async def receive_agent_event(request: Request):
     try:
         data = await request.json()
-        
-        call_id = data.get("call_id")
-        status = data.get("status")
-        timestamp = data.get("timestamp")
-        
-        if not call_id or not status:
-            return JSONResponse({"error": "Missing data"}, status_code=400)
-        
-        if status not in {"initialized", "dialing", "connected", "unanswered"}:
-            return JSONResponse({"error": "Invalid status"}, status_code=400)
-        
-        # ✅ Build updates
-        updates = {"status": status}
-        now = datetime.now(timezone.utc)
-        
-        # ✅ Set started_at on dialing or connected
-        if status in {"dialing", "connected"}:
-            conn = db.get_connection()
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute(
-                        "SELECT started_at FROM call_history WHERE call_id = %s",
-                        (call_id,)
-                    )
-                    row = cursor.fetchone()
-                    if row and not row[0]:
-                        updates["started_at"] = now
-            finally:
-                conn.close()
-        
-        # ✅ Handle unanswered
-        if status == "unanswered":
-            updates["ended_at"] = now
-            updates["duration"] = 0
-        
-        db.update_call_history(call_id, updates)
-        
-        return JSONResponse({"success": True})
-        
+        return JSONResponse(await agent_rpc.run_single("report_event", data))
+    except agent_rpc.AgentRPCError as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
     except Exception as e:
         logging.error(f"report-event error: {e}")
         return JSONResponse({"error": str(e)}, status_code=500)
@@ -891,7 +1043,7 @@ async def stream_call_recording_options(call_id: str):
         headers={
             "Access-Control-Allow-Origin": "*",  # Or specific domain
             "Access-Control-Allow-Methods": "GET, OPTIONS",
-            "Access-Control-Allow-Headers": "Range, Content-Type, Authorization, Accept",
+            "Access-Control-Allow-Headers": "Range, Content-Type, Authorization, Accept, If-None-Match, If-Modified-Since, If-Range",
             "Access-Control-Max-Age": "3600"
         }
     )
@@ -900,22 +1052,91 @@ async def stream_call_recording_options(call_id: str):
 async def stream_call_recording(
     call_id: str, 
     user=Depends(get_current_user),
-    request: Request = None
+    request: Request = None,
+    rendition: Optional[str] = Query(None, description="original, voice or mp3 (default: by Accept)")
 ):
     try:
-        recording_data, content_type, size = db.get_recording_blob(call_id, user["id"])
-        
+        cors_headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, OPTIONS",
+            "Access-Control-Allow-Headers": "Range, Content-Type, Authorization, Accept, If-None-Match, If-Modified-Since, If-Range",
+            "Access-Control-Expose-Headers": "Content-Range, Content-Length, Accept-Ranges, ETag, Last-Modified, X-Recording-Rendition",
+        }
+
+        # ✅ Validators first: a repeat view is one indexed lookup and a 304
+        meta = db.get_call_artifact_meta(call_id, user["id"])
+        if not meta:
+            raise HTTPException(status_code=404, detail="Recording not found")
+
+        request_headers = request.headers if request else {}
+
+        # ✅ Compact transcoded rendition when there is one the client can play
+        renditions = meta["renditions"] or {}
+        chosen = choose_rendition(request_headers.get("accept", ""), renditions.keys(), rendition)
+        if chosen != ORIGINAL:
+            etag = make_etag(renditions[chosen]["checksum"], chosen)
+        else:
+            etag = make_etag(meta["recording_checksum"]) if meta["recording_checksum"] else None
+        validator_headers = {
+            **cache_headers(etag, meta["updated_at"], meta["status"]),
+            "Vary": "Accept",
+            "X-Recording-Rendition": chosen,
+        }
+
+        if etag and is_not_modified(request_headers, etag, meta["updated_at"]):
+            return not_modified_response({**cors_headers, **validator_headers})
+
+        def cache_entry(name: str):
+            if name != ORIGINAL:
+                token = renditions[name]["checksum"]
+            else:
+                token = meta["recording_checksum"] or (meta["recording_blob"] and archived_token(meta["recording_blob"]))
+            return token, recording_cache.lookup(call_id, name, token)
+
+        # ✅ Hot recordings come from the local disk cache, not Postgres/GCS
+        served = chosen
+        cache_token, cached = cache_entry(served)
+        recording_data = None
+        if not cached and served != ORIGINAL:
+            recording_data, content_type, size = db.get_recording_rendition(call_id, served, user["id"])
+            if not recording_data:
+                # Rendition vanished between the two lookups (retention) - serve the original
+                served = ORIGINAL
+                etag = make_etag(meta["recording_checksum"]) if meta["recording_checksum"] else None
+                validator_headers.update(cache_headers(etag, meta["updated_at"], meta["status"]))
+                validator_headers["X-Recording-Rendition"] = ORIGINAL
+                cache_token, cached = cache_entry(served)
+
+        if cached:
+            cached_path, cached_stat = cached
+            size = cached_stat.st_size
+            if served != ORIGINAL:
+                content_type = renditions[served]["content_type"]
+            else:
+                content_type = meta["recording_content_type"] or "audio/ogg"
+        elif not recording_data:
+            recording_data, content_type, size = db.get_recording_blob(call_id, user["id"])
+
+            if not recording_data and meta["recording_blob"]:
+                # ✅ Archived by retention (or never copied inline): serve from the bucket
+                recording_data = await _fetch_from_gcs_blob(meta["recording_blob"])
+                if recording_data:
+                    content_type = meta["recording_content_type"] or "audio/ogg"
+                    size = len(recording_data)
+
         if recording_data:
-            logging.info(f"✅ Streaming {size} bytes for {call_id}")
-            
-            cors_headers = {
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, OPTIONS",
-                "Access-Control-Allow-Headers": "Range, Content-Type, Authorization",
-                "Access-Control-Expose-Headers": "Content-Range, Content-Length, Accept-Ranges",
-            }
+            recording_data = bytes(recording_data)
+            spawn_background_task(
+                asyncio.to_thread(recording_cache.put, call_id, served, cache_token, recording_data),
+                name=f"recording-cache-{call_id}"
+            )
+
+        if cached or recording_data:
+            logging.info(f"✅ Streaming {size} bytes for {call_id}{' (cached)' if cached else ''}")
             
-            range_header = request.headers.get("range") if request else None
+            range_header = request_headers.get("range")
+            if range_header and not if_range_allows_partial(request_headers, etag, meta["updated_at"]):
+                range_header = None  # validator changed - send the full, current file
             
             if range_header:
                 try:
@@ -927,7 +1148,10 @@ async def stream_call_recording(
                     start = max(0, start)
                     end = min(end, size - 1)
                     
-                    chunk = recording_data[start:end + 1]
+                    if cached:
+                        chunk = await asyncio.to_thread(recording_cache.read_range, cached_path, start, end)
+                    else:
+                        chunk = recording_data[start:end + 1]
                     
                     return Response(
                         content=chunk,
@@ -935,6 +1159,7 @@ async def stream_call_recording(
                         media_type=content_type or "audio/ogg",
                         headers={
                             **cors_headers,
+                            **validator_headers,
                             "Content-Range": f"bytes {start}-{end}/{size}",
                             "Content-Length": str(len(chunk)),
                             "Accept-Ranges": "bytes",
@@ -943,12 +1168,29 @@ async def stream_call_recording(
                 except Exception as e:
                     logging.warning(f"Range parse failed: {e}")
             
+            if cached:
+                # ✅ sendfile from the page cache
+                response = FileResponse(
+                    cached_path,
+                    media_type=content_type,
+                    stat_result=cached_stat,
+                    headers={**cors_headers, **validator_headers},
+                )
+                # Starlette derives these from the cache file's mtime (touched on every hit),
+                # which says nothing about the recording - only send real validators
+                if "ETag" not in validator_headers:
+                    del response.headers["etag"]
+                if "Last-Modified" not in validator_headers:
+                    del response.headers["last-modified"]
+                return response
+
             # Full file stream
             return StreamingResponse(
                 io.BytesIO(recording_data),
                 media_type=content_type or "audio/ogg",
                 headers={
                     **cors_headers,
+                    **validator_headers,
                     "Content-Length": str(size),
                     "Accept-Ranges": "bytes",
                 }
@@ -957,34 +1199,340 @@ async def stream_call_recording(
         # URL fallback...
         raise HTTPException(status_code=404, detail="Recording not found")
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"❌ Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/calls/{call_id}/recording/renditions")
+async def get_recording_renditions(call_id: str, user=Depends(get_current_user)):
+    """Stored renditions of a call's recording with their sizes"""
+    meta = db.get_call_artifact_meta(call_id, user["id"])
+    if not meta or not (meta["recording_checksum"] or meta["recording_blob"]):
+        return error_response("Recording not found", status_code=404)
+
+    renditions = {}
+    if meta["recording_checksum"]:
+        renditions[ORIGINAL] = {"size": meta["recording_size"], "content_type": meta["recording_content_type"]}
+    for name, info in (meta["renditions"] or {}).items():
+        renditions[name] = {
+            "size": info["size"],
+            "content_type": info["content_type"],
+            "bitrate_kbps": info["bitrate_kbps"],
+        }
+    return {"call_id": call_id, "archived": not meta["recording_checksum"], "renditions": renditions}
+
+
+@router.get("/calls/{call_id}/artifacts")
+async def get_call_artifacts(call_id: str, user=Depends(get_current_user)):
+    """
+    Readiness of a call's transcript and recording (pending / fetching / ready /
+    failed, with attempt counts) and of the derived recording renditions -
+    poll this instead of the artifact endpoints.
+    """
+    meta = db.get_call_artifact_meta(call_id, user["id"])
+    if not meta:
+        return error_response("Call not found", status_code=404)
+
+    artifacts = {}
+    for kind in ("transcript", "recording"):
+        artifacts[kind] = {
+            "status": meta[f"{kind}_status"],
+            "attempts": meta[f"{kind}_attempts"],
+            "error": meta[f"{kind}_error"],
+        }
+    artifacts["recording"]["renditions"] = sorted((meta["renditions"] or {}).keys())
+    artifacts["recording"]["waveform"] = meta["has_waveform"]
+
+    pending = any(artifacts[kind]["status"] in ("pending", "fetching") for kind in ("transcript", "recording"))
+    headers = {"Cache-Control": "no-store"}
+    if pending:
+        headers["Retry-After"] = str(max(1, int(ARTIFACT_RETRY_DELAY)))
+    return ORJSONResponse({"call_id": call_id, "call_status": meta["status"], "artifacts": artifacts}, headers=headers)
+
+
+@router.get("/calls/{call_id}/recording/preview")
+async def stream_call_recording_preview(call_id: str, request: Request, user=Depends(get_current_user)):
+    """Short MP3 preview clip (never falls back to the full recording)"""
+    meta = db.get_call_artifact_meta(call_id, user["id"])
+    if not meta or PREVIEW not in (meta["renditions"] or {}):
+        return error_response("Preview not available", status_code=404)
+    return await stream_call_recording(call_id, user=user, request=request, rendition=PREVIEW)
+
+
+@router.get("/calls/{call_id}/recording/waveform")
+async def get_recording_waveform(
+    call_id: str,
+    request: Request,
+    points: Optional[int] = Query(None, ge=1, description="Max-pool down to this many peaks"),
+    format: str = Query("binary", pattern="^(binary|json)$"),
+    user=Depends(get_current_user)
+):
+    """
+    Waveform peaks of a call's recording: one int8 (0-127) per bucket as
+    application/octet-stream, or JSON with ?format=json.
+    """
+    waveform = db.get_recording_waveforms([call_id], user["id"]).get(call_id)
+    if not waveform:
+        return error_response("Waveform not available", status_code=404)
+
+    peaks = downsample_peaks(bytes(waveform["peaks"]), points or 0)
+    etag = make_etag(waveform["checksum"], f"{len(peaks)}-{format}")
+    headers = {
+        **cache_headers(etag, waveform["updated_at"], "completed"),  # a stored waveform never changes
+        "X-Waveform-Points": str(len(peaks)),
+        "X-Waveform-Duration-Ms": str(waveform["duration_ms"]),
+        "Access-Control-Expose-Headers": "ETag, X-Waveform-Points, X-Waveform-Duration-Ms",
+    }
+    if is_not_modified(request.headers, etag, waveform["updated_at"]):
+        return not_modified_response(headers)
+
+    if format == "json":
+        return ORJSONResponse(
+            {"call_id": call_id, "duration_ms": waveform["duration_ms"], "peaks": list(peaks)},
+            headers=headers
+        )
+    return Response(content=peaks, media_type="application/octet-stream", headers=headers)
+
+
+@router.get("/calls/waveforms")
+async def get_recording_waveforms(
+    call_ids: str = Query(..., description="Comma-separated call ids"),
+    points: int = Query(100, ge=1, le=1000),
+    user=Depends(get_current_user)
+):
+    """
+    Waveforms for a page of the call history in one request: base64 int8 peaks
+    and the preview clip URL (if any) per call. Calls without a waveform are omitted.
+    """
+    ids = [call_id.strip() for call_id in call_ids.split(",") if call_id.strip()]
+    if len(ids) > 100:
+        return error_response("At most 100 call ids per request", status_code=400)
+
+    waveforms = db.get_recording_waveforms(ids, user["id"]) if ids else {}
+    return ORJSONResponse({
+        "points": points,
+        "waveforms": {
+            call_id: {
+                "duration_ms": waveform["duration_ms"],
+                "peaks": base64.b64encode(downsample_peaks(bytes(waveform["peaks"]), points)).decode("ascii"),
+                "preview_url": f"/api/calls/{call_id}/recording/preview" if waveform["has_preview"] else None,
+            }
+            for call_id, waveform in waveforms.items()
+        }
+    })
     
 
 @router.get("/calls/{call_id}/transcript")
-async def get_call_transcript(call_id: str, user=Depends(get_current_user)):
-    """Get transcript for a specific call"""
+async def get_call_transcript(call_id: str, request: Request, user=Depends(get_current_user)):
+    """
+    Get transcript for a specific call.
+    Served pre-compressed to gzip clients; conditional requests (If-None-Match /
+    If-Modified-Since) are answered with a 304 from one metadata lookup.
+    """
     try:
+        wants_gzip = accepts_encoding(request.headers.get("accept-encoding", ""), "gzip")
+        is_conditional = "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+        if is_conditional:
+            meta = db.get_call_artifact_meta(call_id, user["id"])
+            if not meta:
+                raise HTTPException(status_code=404, detail="Transcript not found")
+            # Archived by retention: the row (and its checksum) is gone, only
+            # Last-Modified validates the bucket copy
+            if meta["transcript_checksum"] or meta["transcript_blob"]:
+                etag = make_etag(meta["transcript_checksum"], "gz" if wants_gzip else None) if meta["transcript_checksum"] else None
+                headers = cache_headers(etag, meta["updated_at"], meta["status"])
+                if is_not_modified(request.headers, etag, meta["updated_at"]):
+                    return not_modified_response({**headers, "Vary": "Accept-Encoding"})
+
+        where, params = call_id_filter(call_id, "ch")
         conn = db.get_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT transcript
-                    FROM call_history
-                    WHERE call_id = %s AND user_id = %s
-                """, (call_id, user["id"]))
+                # ✅ jsonb::text - Postgres renders the JSON, we never decode/re-encode it
+                cursor.execute(f"""
+                    SELECT t.transcript::text, {"t.transcript_gzip" if wants_gzip else "NULL"},
+                        t.checksum, GREATEST(ch.updated_at, t.updated_at), ch.status, ch.transcript_blob
+                    FROM call_history ch
+                    LEFT JOIN call_transcripts t ON t.call_id = ch.call_id
+                    WHERE {where} AND ch.user_id = %s
+                """, (*params, user["id"]))
                 row = cursor.fetchone()
         finally:
             db.release_connection(conn)
         
-        if not row or not row[0]:
+        if not row:
+            raise HTTPException(status_code=404, detail="Transcript not found")
+
+        transcript_text, transcript_gzip, checksum, updated_at, call_status, transcript_blob = row
+        if (not transcript_text or transcript_text == "null") and transcript_blob:
+            # ✅ Archived by retention: the bucket copy is the original JSON text
+            archived = await _fetch_from_gcs_blob(transcript_blob)
+            transcript_text = archived.decode("utf-8") if archived else None
+            transcript_gzip = None
+        if not transcript_text or transcript_text == "null":
             raise HTTPException(status_code=404, detail="Transcript not found")
+        etag = make_etag(checksum, "gz" if wants_gzip else None) if checksum else None
+        headers = {**cache_headers(etag, updated_at, call_status), "Vary": "Accept-Encoding"}
+
+        if wants_gzip:
+            transcript_gzip = bytes(transcript_gzip) if transcript_gzip else None
+            if transcript_gzip is None:
+                # Row predates pre-compression: compress once and keep it
+                transcript_gzip = transcript_response_gzip(transcript_text)
+                if not transcript_blob:
+                    db.store_transcript_gzip(call_id, transcript_gzip)
+            return Response(
+                content=transcript_gzip,
+                media_type="application/json",
+                headers={**headers, "Content-Encoding": "gzip"}
+            )
         
-        return JSONResponse({"transcript": row[0]})
+        return Response(
+            content=b'{"transcript":' + transcript_text.encode("utf-8") + b'}',
+            media_type="application/json",
+            headers=headers
+        )
         
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error fetching transcript: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/admin/slow-queries")
+async def get_slow_queries(
+    limit: int = Query(100, ge=1, le=1000),
+    method: Optional[str] = None,
+    user=Depends(is_admin)
+):
+    """Recent PGDB calls that exceeded the slow-query threshold (newest first)"""
+    from src.utils.db import SLOW_QUERY_THRESHOLD_MS
+
+    return JSONResponse({
+        "threshold_ms": SLOW_QUERY_THRESHOLD_MS,
+        "queries": db.get_slow_queries(limit=limit, method=method)
+    })
+
+
+@router.get("/admin/metrics")
+async def get_metrics(
+    format: str = Query("json", pattern="^(json|prometheus)$"),
+    user=Depends(is_admin)
+):
+    """This worker's counters (rate limiting, admission, ...) and gauges"""
+    if format == "prometheus":
+        return Response(content=metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+    return ORJSONResponse(metrics.snapshot())
+
+
+@router.get("/analytics/calls")
+async def get_call_analytics(
+    from_date: Optional[str] = Query(None, description="YYYY-MM-DD (inclusive)"),
+    to_date: Optional[str] = Query(None, description="YYYY-MM-DD (inclusive)"),
+    group_by: Optional[str] = Query(None, pattern="^(day|voice|language)$"),
+    user=Depends(get_current_user)
+):
+    """
+    Answer rate, average duration, calls per day and bookings per call,
+    optionally broken down by day, voice or language. Served from the
+    call_stats_daily rollups, so cost does not grow with call history size.
+    """
+    try:
+        for value in (from_date, to_date):
+            if value:
+                datetime.strptime(value, "%Y-%m-%d")  # ValueError -> 400
+
+        rows = db.get_call_stats(user["id"], from_date, to_date, group_by)
+
+        def summarize(row):
+            total = row["total_calls"]
+            answered = row["answered_calls"]
+            return {
+                "total_calls": total,
+                "answered_calls": answered,
+                "answer_rate": round(answered / total, 4) if total else 0,
+                "average_duration": round(row["total_duration"] / answered, 1) if answered else 0,
+                "calls_per_day": round(total / row["active_days"], 2) if row["active_days"] else 0,
+                "bookings": row["bookings"],
+                "bookings_per_call": round(row["bookings"] / total, 4) if total else 0,
+            }
+
+        if group_by:
+            return ORJSONResponse({
+                "group_by": group_by,
+                "from_date": from_date,
+                "to_date": to_date,
+                "buckets": [{"key": row["bucket"], **summarize(row)} for row in rows]
+            })
+
+        return ORJSONResponse({
+            "from_date": from_date,
+            "to_date": to_date,
+            **summarize(rows[0])
+        })
+
+    except ValueError as ve:
+        return error_response(str(ve), status_code=400)
+    except Exception as e:
+        logging.error(f"Error fetching call analytics: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/contacts/import")
+async def import_contacts(file: UploadFile = File(...), user=Depends(get_current_user)):
+    """
+    Bulk import contacts/leads from a CSV upload (needs a phone column; name and
+    email are optional). Numbers are normalized to E.164 and streamed into
+    Postgres with COPY; numbers already in contacts or on the do-not-call list
+    are skipped.
+    """
+    from src.utils.contacts import ContactCSVReader, CopyStream
+
+    def run_import():
+        text = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+        try:
+            reader = ContactCSVReader(text)
+            counts = db.import_contacts(user["id"], CopyStream(reader.rows()))
+            return reader, counts
+        finally:
+            text.detach()  # leave the upload's file open for UploadFile to close
+
+    try:
+        reader, counts = await asyncio.to_thread(run_import)
+        return JSONResponse({
+            "success": True,
+            "total_rows": reader.total,
+            "invalid": reader.invalid,
+            **counts,
+            "errors": reader.errors,
+        })
+    except (ValueError, UnicodeDecodeError) as ve:
+        return error_response(f"Invalid CSV: {ve}", status_code=400)
+    except Exception as e:
+        logging.error(f"Error importing contacts: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/contacts")
+async def list_contacts(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=500),
+    user=Depends(get_current_user)
+):
+    return ORJSONResponse(db.get_contacts_paginated(user["id"], page, page_size))
+
+
+@router.post("/contacts/do-not-call")
+async def add_do_not_call(payload: DoNotCallPayload, user=Depends(get_current_user)):
+    phone_number = normalize_phone(payload.phone_number)
+    if not phone_number:
+        return error_response("Invalid phone number", status_code=400)
+    added = db.add_do_not_call(user["id"], phone_number, payload.reason)
+    return JSONResponse({"success": True, "phone_number": phone_number, "added": added})
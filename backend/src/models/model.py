@@ -1,27 +1,33 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
-from src.models.prompt import summary_prompt
+from functools import lru_cache
 
 
 
-llm = ChatOpenAI(
-    model="gpt-4o",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    # api_key="...",  # if you prefer to pass api key in directly instaed of using env vars
-    # base_url="...",
-    # organization="...",
-    # other params...
-)
+@lru_cache(maxsize=1)
+def get_llm():
+    """Build the chat model on first use (langchain/openai are slow to import)"""
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model="gpt-4o",
+        temperature=0,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+        # api_key="...",  # if you prefer to pass api key in directly instaed of using env vars
+        # base_url="...",
+        # organization="...",
+        # other params...
+    )
 
 
 def generate_summary(conversation) -> str:
     """
     Takes a conversation string and returns a short summary string.
     """
-    chain = summary_prompt | llm | StrOutputParser()
+    from langchain_core.output_parsers import StrOutputParser
+    from src.models.prompt import summary_prompt
+
+    chain = summary_prompt | get_llm() | StrOutputParser()
     # Run the chain with the conversation
 
     summary = chain.invoke({"conversation": conversation})
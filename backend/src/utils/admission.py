@@ -0,0 +1,214 @@
+"""
+Admission control for live calls.
+
+Every call is an LLM + TTS + STT session on the agent fleet, so the number of
+simultaneously active calls is capped per user and globally:
+
+    MAX_ACTIVE_CALLS_PER_USER   (default 5)
+    MAX_ACTIVE_CALLS            (default 50, whole deployment)
+    ADMISSION_QUEUE_TIMEOUT     seconds a request may wait for a slot (default 10, 0 = reject at once)
+    ADMISSION_MAX_QUEUE         waiting requests per worker before rejecting outright (default 100)
+    ADMISSION_RECONCILE_INTERVAL  seconds between reconciliations (default 15)
+
+Active calls are tracked in memory and periodically reconciled against the
+non-final rows of call_history, which also accounts for calls started by other
+workers and calls whose final webhook never arrived (rows older than
+ADMISSION_STALE_CALL_MINUTES are not counted).
+"""
+import asyncio
+import logging
+import os
+import time
+
+from src.utils.db import PGDB
+from src.utils.metrics import metrics
+
+db = PGDB()
+
+
+class AdmissionRejected(Exception):
+    """Over the limit and no slot freed up in time"""
+
+    def __init__(self, scope: str, limit: int, retry_after: int):
+        self.scope = scope  # "user" or "global"
+        self.limit = limit
+        self.retry_after = retry_after
+        super().__init__(f"Too many active calls ({scope} limit {limit})")
+
+
+class AdmissionTicket:
+    """A reserved slot; bound to a call_id once the call row exists"""
+
+    __slots__ = ("user_id", "call_id")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.call_id = None
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        per_user_limit: int,
+        global_limit: int,
+        queue_timeout: float,
+        max_queue: int,
+        reconcile_interval: float,
+        stale_call_minutes: int,
+        retry_after: int,
+    ):
+        self.per_user_limit = per_user_limit
+        self.global_limit = global_limit
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.reconcile_interval = reconcile_interval
+        self.stale_call_minutes = stale_call_minutes
+        self.retry_after = retry_after
+
+        self._active = {}        # call_id -> user_id (from the DB + calls started here)
+        self._recent = {}        # call_id -> (user_id | None if released, monotonic time)
+        self._pending = []       # tickets reserved but not yet bound to a call_id
+        self._waiting = 0
+        self._condition = None   # created lazily on the running loop
+        self._last_reconcile = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            per_user_limit=int(os.getenv("MAX_ACTIVE_CALLS_PER_USER", "5")),
+            global_limit=int(os.getenv("MAX_ACTIVE_CALLS", "50")),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "100")),
+            reconcile_interval=float(os.getenv("ADMISSION_RECONCILE_INTERVAL", "15")),
+            stale_call_minutes=int(os.getenv("ADMISSION_STALE_CALL_MINUTES", "120")),
+            retry_after=int(os.getenv("ADMISSION_RETRY_AFTER", "15")),
+        )
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    # ---------- counting ----------
+
+    def active_count(self, user_id: int = None) -> int:
+        if user_id is None:
+            return len(self._active) + len(self._pending)
+        return (
+            sum(1 for owner in self._active.values() if owner == user_id)
+            + sum(1 for ticket in self._pending if ticket.user_id == user_id)
+        )
+
+    def _blocking_scope(self, user_id: int):
+        if self.active_count(user_id) >= self.per_user_limit:
+            return "user", self.per_user_limit
+        if self.active_count() >= self.global_limit:
+            return "global", self.global_limit
+        return None
+
+    def snapshot(self) -> dict:
+        return {
+            "active": len(self._active),
+            "pending": len(self._pending),
+            "waiting": self._waiting,
+            "per_user_limit": self.per_user_limit,
+            "global_limit": self.global_limit,
+        }
+
+    # ---------- admission ----------
+
+    async def acquire(self, user_id: int) -> AdmissionTicket:
+        """
+        Reserve a slot for a new call, waiting up to queue_timeout for one to
+        free up. Raises AdmissionRejected with a Retry-After hint otherwise.
+        """
+        if time.monotonic() - self._last_reconcile > self.reconcile_interval:
+            await self.reconcile()
+
+        condition = self._get_condition()
+        async with condition:
+            blocked = self._blocking_scope(user_id)
+            if blocked and (self.queue_timeout <= 0 or self._waiting >= self.max_queue):
+                raise AdmissionRejected(*blocked, self.retry_after)
+
+            if blocked:
+                self._waiting += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while blocked:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise AdmissionRejected(*blocked, self.retry_after)
+                        try:
+                            await asyncio.wait_for(condition.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                        blocked = self._blocking_scope(user_id)
+                finally:
+                    self._waiting -= 1
+
+            ticket = AdmissionTicket(user_id)
+            self._pending.append(ticket)
+            return ticket
+
+    def activate(self, ticket: AdmissionTicket, call_id: str):
+        """The call row exists: count it by call_id from now on"""
+        if ticket in self._pending:
+            self._pending.remove(ticket)
+        ticket.call_id = call_id
+        self._active[call_id] = ticket.user_id
+        self._recent[call_id] = (ticket.user_id, time.monotonic())
+
+    async def cancel(self, ticket: AdmissionTicket):
+        """The call never started (validation/dispatch failure)"""
+        if ticket in self._pending:
+            self._pending.remove(ticket)
+        if ticket.call_id:
+            self._active.pop(ticket.call_id, None)
+            self._recent[ticket.call_id] = (None, time.monotonic())
+        await self._notify()
+
+    async def release(self, call_id: str):
+        """The call reached a final status"""
+        self._recent[call_id] = (None, time.monotonic())
+        if self._active.pop(call_id, None) is not None:
+            await self._notify()
+
+    async def _notify(self):
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+
+    # ---------- reconciliation ----------
+
+    async def reconcile(self):
+        """Replace the active set with the non-final calls in call_history"""
+        started = time.monotonic()
+        self._last_reconcile = started
+        try:
+            rows = await asyncio.to_thread(db.get_active_calls, self.stale_call_minutes)
+        except Exception as e:
+            logging.error(f"Admission reconcile failed: {e}")
+            return
+
+        active = {row["call_id"]: row["user_id"] for row in rows}
+        # Local changes made while the query ran win over the snapshot
+        for call_id, (user_id, changed_at) in list(self._recent.items()):
+            if changed_at < started:
+                del self._recent[call_id]
+            elif user_id is None:
+                active.pop(call_id, None)
+            else:
+                active[call_id] = user_id
+        self._active = active
+        await self._notify()
+
+    async def run_reconcile_loop(self):
+        """Background loop started from the app lifespan"""
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            await self.reconcile()
+
+
+admission = AdmissionController.from_env()
+metrics.register_gauge("admission", admission.snapshot)
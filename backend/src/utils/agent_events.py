@@ -0,0 +1,157 @@
+"""
+Buffered ingestion of agent telemetry into call_agent_events.
+
+The agent streams events over /api/agent/events/ws (or POSTs them in batches
+to /api/agent/events). Each event is deduplicated in memory and buffered;
+buffers are written with one multi-row INSERT per flush:
+
+    AGENT_EVENT_DEDUPE_SECONDS   same event_type for the same call within this
+                                 window is dropped (default 5)
+    AGENT_EVENT_FLUSH_INTERVAL   seconds between flushes (default 1)
+    AGENT_EVENT_FLUSH_SIZE       flush early once this many events are buffered (default 500)
+    AGENT_EVENT_MAX_BUFFERED     hard cap; the oldest events are dropped beyond it (default 20000)
+
+Dedupe state is per worker and per call, so it costs O(1) per event no matter
+how long the call runs; calls idle for AGENT_EVENT_CALL_IDLE_SECONDS (default
+900) are forgotten. The buffer is flushed on shutdown.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from src.utils.db import PGDB
+from src.utils.metrics import metrics
+
+db = PGDB()
+
+
+class AgentEventBuffer:
+    def __init__(
+        self,
+        dedupe_seconds: float,
+        flush_interval: float,
+        flush_size: int,
+        max_buffered: int,
+        call_idle_seconds: float,
+    ):
+        self.dedupe_seconds = dedupe_seconds
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_buffered = max_buffered
+        self.call_idle_seconds = call_idle_seconds
+
+        self._pending = deque()   # (call_id, event_type, event_data, timestamp)
+        self._last_seen = {}      # call_id -> {event_type: monotonic time accepted}
+        self._call_touched = {}   # call_id -> monotonic time of the last event
+        self._flush_lock = None   # created lazily on the running loop
+        self._flush_requested = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            dedupe_seconds=float(os.getenv("AGENT_EVENT_DEDUPE_SECONDS", "5")),
+            flush_interval=float(os.getenv("AGENT_EVENT_FLUSH_INTERVAL", "1")),
+            flush_size=int(os.getenv("AGENT_EVENT_FLUSH_SIZE", "500")),
+            max_buffered=int(os.getenv("AGENT_EVENT_MAX_BUFFERED", "20000")),
+            call_idle_seconds=float(os.getenv("AGENT_EVENT_CALL_IDLE_SECONDS", "900")),
+        )
+
+    def _get_flush_lock(self) -> asyncio.Lock:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+            self._flush_requested = asyncio.Event()
+        return self._flush_lock
+
+    def snapshot(self) -> dict:
+        return {"buffered": len(self._pending), "tracked_calls": len(self._last_seen)}
+
+    # ---------- ingestion ----------
+
+    def add(self, call_id: str, event_type: str, event_data: dict = None, timestamp: str = None) -> bool:
+        """Buffer one event; False if it is a duplicate within the dedupe window"""
+        now = time.monotonic()
+        seen = self._last_seen.setdefault(call_id, {})
+        self._call_touched[call_id] = now
+
+        last = seen.get(event_type)
+        if last is not None and now - last < self.dedupe_seconds:
+            metrics.inc("agent_events_duplicate_total")
+            return False
+        seen[event_type] = now
+
+        self._pending.append((call_id, event_type, event_data or {}, timestamp))
+        metrics.inc("agent_events_received_total")
+        if len(self._pending) > self.max_buffered:
+            self._pending.popleft()
+            metrics.inc("agent_events_dropped_total")
+        if len(self._pending) >= self.flush_size and self._flush_requested is not None:
+            self._flush_requested.set()
+        return True
+
+    def add_many(self, events: list) -> tuple:
+        """Buffer a list of event dicts; returns (accepted, duplicates, invalid)"""
+        accepted = duplicates = invalid = 0
+        for event in events:
+            if not isinstance(event, dict) or not event.get("call_id") or not event.get("event_type"):
+                invalid += 1
+                continue
+            event_data = event.get("event_data")
+            if self.add(event["call_id"], str(event["event_type"]),
+                        event_data if isinstance(event_data, dict) else {}, event.get("timestamp")):
+                accepted += 1
+            else:
+                duplicates += 1
+        return accepted, duplicates, invalid
+
+    def end_call(self, call_id: str):
+        """
+        Forget a finished call's dedupe state (its buffered events still flush).
+        Called when the call is finalized; on other workers the idle sweep does it.
+        """
+        self._last_seen.pop(call_id, None)
+        self._call_touched.pop(call_id, None)
+
+    def _forget_idle_calls(self):
+        cutoff = time.monotonic() - self.call_idle_seconds
+        for call_id, touched in list(self._call_touched.items()):
+            if touched < cutoff:
+                self.end_call(call_id)
+
+    # ---------- flushing ----------
+
+    async def flush(self) -> int:
+        """Write everything buffered so far; on failure the events are put back"""
+        async with self._get_flush_lock():
+            if not self._pending:
+                return 0
+            rows = list(self._pending)
+            self._pending.clear()
+            try:
+                inserted = await asyncio.to_thread(db.insert_agent_events, rows)
+            except Exception as e:
+                logging.error(f"❌ Agent event flush failed ({len(rows)} events re-queued): {e}")
+                self._pending.extendleft(reversed(rows))
+                while len(self._pending) > self.max_buffered:
+                    self._pending.popleft()
+                    metrics.inc("agent_events_dropped_total")
+                return 0
+            metrics.inc("agent_events_flushed_total", inserted)
+            return inserted
+
+    async def run_flush_loop(self):
+        """Background loop started from the app lifespan"""
+        self._get_flush_lock()
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+            self._forget_idle_calls()
+
+
+agent_events = AgentEventBuffer.from_env()
+metrics.register_gauge("agent_events", agent_events.snapshot)
@@ -0,0 +1,127 @@
+"""
+Contact/lead CSV parsing for bulk import.
+
+Rows are validated and normalized one at a time and handed to PGDB.import_contacts
+as a CSV text stream for COPY FROM STDIN, so an upload is never fully
+materialized in Python.
+"""
+import csv
+import io
+import os
+import re
+
+# Country code assumed for national-format numbers without a leading + / 00
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "1")
+
+PHONE_COLUMNS = ("phone", "phone_number", "number", "mobile", "telephone")
+NAME_COLUMNS = ("name", "full_name", "contact_name")
+EMAIL_COLUMNS = ("email", "email_address")
+
+MAX_REPORTED_ERRORS = 20
+
+_NON_DIGITS = re.compile(r"[^\d]")
+_EXTENSION = re.compile(r"\s*(?:ext\.?|x|#)\s*\d+\s*$", re.IGNORECASE)
+
+
+def normalize_phone(raw: str, default_country_code: str = DEFAULT_COUNTRY_CODE):
+    """
+    Normalize a phone number to E.164 (+<country><number>).
+    Returns None if it cannot be a valid number (E.164 allows 8-15 digits).
+    """
+    if not raw:
+        return None
+    value = _EXTENSION.sub("", raw.strip())
+    international = value.startswith("+") or value.startswith("00")
+    digits = _NON_DIGITS.sub("", value)
+    if value.startswith("00"):
+        digits = digits[2:]
+
+    if not international:
+        nanp_with_country_code = default_country_code == "1" and len(digits) == 11 and digits.startswith("1")
+        if not nanp_with_country_code:
+            # National format: drop the trunk prefix (e.g. UK 07...) and add the country code
+            digits = default_country_code + digits.lstrip("0")
+
+    if not 8 <= len(digits) <= 15 or digits.startswith("0"):
+        return None
+    return f"+{digits}"
+
+
+def _pick_column(fieldnames, candidates):
+    normalized = {name.strip().lower(): name for name in fieldnames if name}
+    for candidate in candidates:
+        if candidate in normalized:
+            return normalized[candidate]
+    return None
+
+
+class ContactCSVReader:
+    """
+    Iterate a contacts CSV as validated rows.
+
+    `rows()` yields (line_no, phone_e164, name, email); invalid lines are
+    counted in `invalid` and the first few recorded in `errors`.
+    """
+
+    def __init__(self, text_stream):
+        self.reader = csv.DictReader(text_stream)
+        fieldnames = self.reader.fieldnames or []
+        self.phone_column = _pick_column(fieldnames, PHONE_COLUMNS)
+        if not self.phone_column:
+            raise ValueError(f"CSV needs a phone column (one of: {', '.join(PHONE_COLUMNS)})")
+        self.name_column = _pick_column(fieldnames, NAME_COLUMNS)
+        self.email_column = _pick_column(fieldnames, EMAIL_COLUMNS)
+        self.total = 0
+        self.invalid = 0
+        self.errors = []
+
+    def rows(self):
+        for row in self.reader:
+            self.total += 1
+            line_no = self.reader.line_num
+            raw_phone = (row.get(self.phone_column) or "").strip()
+            phone = normalize_phone(raw_phone)
+            if not phone:
+                self.invalid += 1
+                if len(self.errors) < MAX_REPORTED_ERRORS:
+                    self.errors.append({"line": line_no, "value": raw_phone, "error": "invalid phone number"})
+                continue
+
+            name = (row.get(self.name_column) or "").strip() if self.name_column else ""
+            email = (row.get(self.email_column) or "").strip().lower() if self.email_column else ""
+            yield line_no, phone, name or None, email or None
+
+
+class CopyStream(io.RawIOBase):
+    """
+    Read-only file object over an iterator of rows, rendered as CSV for
+    `cursor.copy_expert("COPY ... FROM STDIN WITH (FORMAT csv)", stream)`.
+    Rows are rendered lazily as psycopg2 asks for more data.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = b""
+        self._text = io.StringIO()
+        self._writer = csv.writer(self._text, lineterminator="\n")
+
+    def readable(self):
+        return True
+
+    def _render(self, row) -> bytes:
+        self._text.seek(0)
+        self._text.truncate()
+        # csv writes None as an empty unquoted field, which COPY reads as NULL
+        self._writer.writerow(row)
+        return self._text.getvalue().encode("utf-8")
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += self._render(row)
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
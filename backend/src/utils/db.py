@@ -1,20 +1,231 @@
 import os
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import bcrypt
 import urllib.parse
 import json
+import re
+import time
+import gzip
+import math
+import hashlib
+import functools
+import inspect
+import contextvars
+import threading
+from collections import deque
+from contextlib import contextmanager
 import psycopg2
 from psycopg2 import pool 
+from psycopg2 import sql
 import logging
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
+from src.utils.ulid import new_ulid, ulid_timestamp
 import traceback
 
 load_dotenv()
 
+# ==================== QUERY TIMEOUTS & SLOW-QUERY LOG ====================
+
+# Defaults applied to every instrumented PGDB method (milliseconds, 0 = disabled)
+DEFAULT_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+DEFAULT_LOCK_TIMEOUT_MS = int(os.getenv("DB_LOCK_TIMEOUT_MS", "5000"))
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("DB_SLOW_QUERY_LOG_SIZE", "200"))
+
+# Per-method overrides: method name -> {"statement_timeout": ms, "lock_timeout": ms}
+# Extend/override at deploy time with DB_QUERY_TIMEOUTS='{"update_call_history": {"statement_timeout": 3000}}'
+QUERY_TIMEOUTS = {
+    "get_call_history_by_user_id": {"statement_timeout": 5000, "lock_timeout": 2000},
+    "get_call_by_id": {"statement_timeout": 3000, "lock_timeout": 2000},
+    "update_call_history": {"statement_timeout": 5000, "lock_timeout": 2000},
+    "add_call_event": {"statement_timeout": 3000, "lock_timeout": 2000},
+    "mark_call_answered": {"statement_timeout": 3000, "lock_timeout": 2000},
+    "add_agent_event": {"statement_timeout": 3000, "lock_timeout": 2000},
+    "insert_agent_events": {"statement_timeout": 5000, "lock_timeout": 2000},
+    "store_recording_blob": {"statement_timeout": 60000, "lock_timeout": 5000},
+    "get_recording_blob": {"statement_timeout": 30000, "lock_timeout": 2000},
+    "agent_rpc": {"statement_timeout": 5000, "lock_timeout": 2000},
+}
+try:
+    QUERY_TIMEOUTS.update(json.loads(os.getenv("DB_QUERY_TIMEOUTS", "{}")))
+except Exception as e:
+    logging.error(f"Invalid DB_QUERY_TIMEOUTS, using defaults: {e}")
+
+# Name of the PGDB method currently running (used by get_connection to pick timeouts)
+_current_query = contextvars.ContextVar("pgdb_current_query", default=None)
+
+_SENSITIVE_PARAMS = {"password", "password_hash", "current_password", "new_password", "token", "secret"}
+
+
+def _sanitize_param(value, key: str = None):
+    """Make a query parameter safe and small enough for the slow-query log"""
+    if key and key.lower() in _SENSITIVE_PARAMS:
+        return "***"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, dict):
+        return {k: _sanitize_param(v, k) for k, v in list(value.items())[:20]}
+    if isinstance(value, (list, tuple)):
+        return f"<{type(value).__name__} of {len(value)}>"
+    if isinstance(value, str) and len(value) > 80:
+        return value[:80] + "..."
+    if value is None or isinstance(value, (int, float, bool, str)):
+        return value
+    return str(value)[:80]
+
+
+def _count_rows(result) -> int:
+    """Best-effort row count for an instrumented method's return value"""
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict) and isinstance(result.get("calls"), list):
+        return len(result["calls"])
+    if isinstance(result, tuple):
+        return 0 if all(v is None for v in result) else 1
+    return 1
+
+
+def instrumented(method):
+    """
+    Run a PGDB method with its configured statement/lock timeouts and record
+    it in the slow-query log when it exceeds DB_SLOW_QUERY_MS.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        token = _current_query.set(method.__name__)
+        started = time.perf_counter()
+        result = None
+        try:
+            result = method(self, *args, **kwargs)
+            return result
+        finally:
+            _current_query.reset(token)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms >= SLOW_QUERY_THRESHOLD_MS:
+                PGDB.record_slow_query(method.__name__, elapsed_ms, _count_rows(result),
+                                       _bind_params(signature, self, args, kwargs))
+    return wrapper
+
+
+def _bind_params(signature, self, args: tuple, kwargs: dict) -> dict:
+    """
+    {parameter name: value} for a call, so positional arguments are redacted by
+    name like keyword ones (change_user_password(uid, current, new) must not log
+    the passwords).
+    """
+    try:
+        bound = signature.bind(self, *args, **kwargs)
+    except TypeError:
+        # Call didn't match the signature - log nothing we can't name
+        return {"args": f"<{len(args)} positional>", **kwargs}
+    return {name: value for name, value in bound.arguments.items() if name != "self"}
+
+
+FINAL_CALL_STATUSES = {"completed", "unanswered"}
+
+# Statuses after which a call no longer occupies an agent
+INACTIVE_CALL_STATUSES = FINAL_CALL_STATUSES | {"failed"}
+
+# Idempotency-Key responses are replayed for this long, then the key is free again
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+# A key still in progress after this long belongs to a crashed/killed request and may be reclaimed
+IDEMPOTENCY_IN_PROGRESS_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_IN_PROGRESS_LEASE_SECONDS", "300"))
+# A refresh token that was rotated this recently is a benign client race (two
+# tabs refreshing at once), not a replay - reject it without revoking the session
+REFRESH_REUSE_GRACE_SECONDS = int(os.getenv("REFRESH_REUSE_GRACE_SECONDS", "10"))
+
+# Ingestion state of the transcript/recording of a call (call_history.<kind>_status)
+ARTIFACT_KINDS = ("transcript", "recording")
+ARTIFACT_STATUSES = ("pending", "fetching", "ready", "failed")
+# <kind>_error of a download cancelled by shutdown - retried by the reconcile loop
+ARTIFACT_INTERRUPTED = "interrupted"
+
+# ==================== PARTITION PRUNING ====================
+
+# call_history is range-partitioned by month on created_at. Room names embed
+# their creation time - call-{user_id}-{ULID} (legacy: call-{user_id}-%Y%m%d%H%M%S) -
+# so a lookup by call_id can also bound created_at and let Postgres scan a
+# single partition.
+PARTITION_LOCK_ID = 727_002
+_PARTITION_NAME = re.compile(r"^call_history_p(\d{4})(\d{2})$")
+
+_CALL_ID_TIME_FORMAT = "%Y%m%d%H%M%S"
+_CALL_ID_TIME_SLACK = timedelta(days=1)  # covers server-local vs UTC clock differences
+_ULID_TIME_SLACK = timedelta(hours=1)    # ULIDs carry exact UTC ms; only insert latency
+
+
+def new_call_id(user_id: int) -> str:
+    """Collision-free, time-ordered call id / LiveKit room name"""
+    return f"call-{user_id}-{new_ulid()}"
+
+
+def call_id_created_at_bounds(call_id: str):
+    """(lower, upper) created_at window for a call_id, or None if it carries no timestamp"""
+    try:
+        stamp = call_id.rsplit("-", 1)[-1]
+    except AttributeError:
+        return None
+    created = ulid_timestamp(stamp)
+    if created:
+        return created - _ULID_TIME_SLACK, created + _ULID_TIME_SLACK
+    try:
+        created = datetime.strptime(stamp, _CALL_ID_TIME_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return created - _CALL_ID_TIME_SLACK, created + _CALL_ID_TIME_SLACK
+
+
+def call_id_filter(call_id: str, alias: str = None):
+    """
+    WHERE fragment + params matching one call, partition-prune friendly.
+    Usage: where, params = call_id_filter(call_id)
+           cursor.execute(f"SELECT ... FROM call_history WHERE {where}", params)
+    """
+    prefix = f"{alias}." if alias else ""
+    bounds = call_id_created_at_bounds(call_id)
+    if not bounds:
+        return f"{prefix}call_id = %s", (call_id,)
+    return (
+        f"{prefix}call_id = %s AND {prefix}created_at >= %s AND {prefix}created_at < %s",
+        (call_id, bounds[0], bounds[1]),
+    )
+
+
+def _parse_event_timestamp(value):
+    """Client-supplied ISO timestamp -> aware datetime, or None if missing/invalid"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def transcript_response_gzip(transcript_json: str) -> bytes:
+    """gzip of the exact /calls/{call_id}/transcript response body for a transcript's JSON text"""
+    body = b'{"transcript":' + transcript_json.encode("utf-8") + b'}'
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+# How long a thread waits for a free pooled connection before giving up
+# (psycopg2's pool itself raises immediately when it is exhausted)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+
 class PGDB:
     _instance = None
     _pool = None
+    _pool_slots = None  # BoundedSemaphore(max_conn): getconn waits here instead of failing
+    _pool_lock = threading.Lock()
+    _slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
     
     def __new__(cls):
         if cls._instance is None:
@@ -22,165 +233,182 @@ class PGDB:
         return cls._instance
     
     def __init__(self):
-        if PGDB._pool is not None:
-            return  # Already initialized
-            
+        # ✅ No I/O here: PGDB() is instantiated at import time, so the pool is
+        # created lazily on the first get_connection() and the schema version is
+        # checked from the app's startup hook.
         self.connection_string = os.getenv('DATABASE_URL')
-        
-        # ✅ Create pool ONCE
-        PGDB._pool = pool.SimpleConnectionPool(
-            5, 50, self.connection_string
-        )
-        
-        # ✅ Create tables ONCE (in correct order due to foreign keys)
-        self.create_users_table()
-        self.create_call_history_table()
-        self.create_appointments_table()
-        self.create_user_prompts_table()
+
+    def _ensure_pool(self):
+        """Create the connection pool ONCE, on first use"""
+        if PGDB._pool is None:
+            with PGDB._pool_lock:
+                if PGDB._pool is None:
+                    # ThreadedConnectionPool: sync routes run in the threadpool.
+                    # serve.py sizes DB_POOL_MIN/DB_POOL_MAX per worker so the
+                    # workers together stay within the database's connection budget.
+                    max_conn = int(os.getenv("DB_POOL_MAX", "50"))
+                    min_conn = min(int(os.getenv("DB_POOL_MIN", "5")), max_conn)
+                    PGDB._pool_slots = threading.BoundedSemaphore(max_conn)
+                    PGDB._pool = pool.ThreadedConnectionPool(
+                        min_conn, max_conn, self.connection_string
+                    )
+        return PGDB._pool
+
+    def _checkout(self):
+        """A pooled connection, waiting up to DB_POOL_TIMEOUT for one to be released"""
+        db_pool = self._ensure_pool()
+        if not PGDB._pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+            logging.error(f"❌ No database connection free after {DB_POOL_TIMEOUT}s")
+            raise pool.PoolError(f"connection pool exhausted (waited {DB_POOL_TIMEOUT}s)")
+        try:
+            return db_pool.getconn()
+        except Exception:
+            PGDB._pool_slots.release()
+            raise
+
+    def _checkin(self, conn):
+        PGDB._pool.putconn(conn)
+        PGDB._pool_slots.release()  # only after a successful putconn - never twice per connection
+
+    def close_pool(self):
+        """Close every pooled connection (called on graceful shutdown)"""
+        with PGDB._pool_lock:
+            if PGDB._pool is not None:
+                PGDB._pool.closeall()
+                PGDB._pool = None
+                logging.info("✅ Database pool closed")
 
     def get_connection(self):
-        """Get connection from pool"""
-        return PGDB._pool.getconn()
+        """Get connection from pool (with per-method timeouts when called from an instrumented method)"""
+        conn = self._checkout()
+        method_name = _current_query.get()
+        if method_name:
+            try:
+                self.apply_query_timeouts(conn, method_name)
+            except Exception as e:
+                logging.error(f"Error applying query timeouts for {method_name}: {e}")
+                conn.rollback()
+        return conn
     
     def release_connection(self, conn):
         """Return connection to pool"""
-        PGDB._pool.putconn(conn)
+        self._checkin(conn)
 
-    # ==================== TABLE CREATION METHODS ====================
-    
-    def create_users_table(self):
+    @contextmanager
+    def transaction(self, name: str = None):
         """
-        Create users table with ALL columns from production schema
+        One connection + one transaction for several PGDB calls:
+
+            with db.transaction("agent_rpc") as conn:
+                db.update_call_history(call_id, updates, conn=conn)
+                db.create_appointment(..., conn=conn)
+
+        Methods that accept `conn` run on it without committing; everything is
+        committed when the block exits, or rolled back if it raises.
         """
         conn = self.get_connection()
         try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id SERIAL PRIMARY KEY,
-                        username VARCHAR(100),
-                        email VARCHAR(100) UNIQUE NOT NULL,
-                        password_hash TEXT NOT NULL,
-                        first_name VARCHAR(100),
-                        last_name VARCHAR(100),
-                        is_admin BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
+            if name:
+                self.apply_query_timeouts(conn, name)
+            yield conn
             conn.commit()
-            logging.info("✅ users table created")
-        except Exception as e:
-            logging.error(f"Error creating users table: {e}")
+        except Exception:
             conn.rollback()
+            raise
         finally:
             self.release_connection(conn)
 
-    def create_call_history_table(self):
+    @contextmanager
+    def _write_cursor(self, conn=None, cursor_factory=None):
         """
-        Create call_history table with ALL columns from production schema
+        Cursor for a method that can join a caller's transaction: on `conn` when
+        given (the caller commits), otherwise on a pooled connection committed here.
         """
+        if conn is not None:
+            with conn.cursor(cursor_factory=cursor_factory) as cursor:
+                yield cursor
+            return
         conn = self.get_connection()
         try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS call_history (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        call_id TEXT NOT NULL UNIQUE,
-                        status TEXT,
-                        duration DOUBLE PRECISION,
-                        transcript JSONB,
-                        summary TEXT,
-                        recording_url TEXT,
-                        created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-                        started_at TIMESTAMPTZ NULL,
-                        ended_at TIMESTAMPTZ NULL,
-                        voice_id TEXT,
-                        voice_name TEXT,
-                        from_number TEXT NULL,
-                        to_number TEXT NULL,
-                        transcript_url TEXT,
-                        transcript_blob TEXT,
-                        recording_blob TEXT,
-                        events_log JSONB DEFAULT '[]',
-                        agent_events JSONB DEFAULT '[]',
-                        recording_blob_data BYTEA NULL,
-                        recording_size INTEGER NULL,
-                        recording_content_type VARCHAR(100) DEFAULT 'audio/ogg'
-                    );
-                """)
-                
-                # Only essential indexes for performance
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_call_history_events_log ON call_history USING GIN (events_log);")
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_call_history_agent_events ON call_history USING GIN (agent_events);")
-                
+            with conn.cursor(cursor_factory=cursor_factory) as cursor:
+                yield cursor
             conn.commit()
-            logging.info("✅ call_history table created")
-        except Exception as e:
-            logging.error(f"Error creating call_history table: {e}")
+        except Exception:
             conn.rollback()
+            raise
         finally:
             self.release_connection(conn)
 
-    def create_appointments_table(self):
+    # ==================== QUERY TIMEOUT / SLOW-QUERY METHODS ====================
+
+    def apply_query_timeouts(self, conn, method_name: str):
         """
-        Create appointments table with ALL columns from production schema
+        Set statement_timeout / lock_timeout for the current transaction only.
+        set_config(..., true) is transaction-scoped, so the values are reset on
+        commit/rollback and never leak to the next user of the pooled connection.
         """
-        conn = self.get_connection()
-        try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS appointments (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        appointment_date DATE NOT NULL,
-                        start_time TIME NOT NULL,
-                        end_time TIME NOT NULL,
-                        attendee_email VARCHAR(255) NOT NULL,
-                        attendee_name VARCHAR(255),
-                        title TEXT NOT NULL,
-                        description TEXT,
-                        notes TEXT,
-                        status VARCHAR(50) DEFAULT 'scheduled',
-                        created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
-            conn.commit()
-            logging.info("✅ appointments table created")
-        except Exception as e:
-            logging.error(f"Error creating appointments table: {e}")
-            conn.rollback()
-        finally:
-            self.release_connection(conn)
+        config = QUERY_TIMEOUTS.get(method_name, {})
+        statement_timeout = config.get("statement_timeout", DEFAULT_STATEMENT_TIMEOUT_MS)
+        lock_timeout = config.get("lock_timeout", DEFAULT_LOCK_TIMEOUT_MS)
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('statement_timeout', %s, true), set_config('lock_timeout', %s, true)",
+                (f"{int(statement_timeout)}ms", f"{int(lock_timeout)}ms")
+            )
+
+    @classmethod
+    def record_slow_query(cls, method_name: str, duration_ms: float, rows: int, params: dict):
+        """Append an entry to the in-memory slow-query log (`params` keyed by parameter name)"""
+        entry = {
+            "method": method_name,
+            "duration_ms": round(duration_ms, 1),
+            "rows": rows,
+            "params": {k: _sanitize_param(v, k) for k, v in params.items()},
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+        }
+        cls._slow_queries.append(entry)
+        logging.warning(f"🐢 Slow query: {method_name} took {entry['duration_ms']}ms ({rows} rows) params={entry['params']}")
 
-    def create_user_prompts_table(self):
+    def get_slow_queries(self, limit: int = 100, method: str = None):
+        """Most recent slow-query log entries, newest first"""
+        entries = [q for q in reversed(PGDB._slow_queries) if not method or q["method"] == method]
+        return entries[:limit]
+
+    # ==================== SCHEMA VERSION METHODS ====================
+
+    def check_schema_version(self):
         """
-        Create table to store per-user system prompt customizations.
-        Each user has ONE active prompt stored as plain text.
+        Verify the database schema is at the version this code expects.
+        DDL lives in src/utils/migrations.py and runs once per deploy
+        (`python -m src.utils.migrations upgrade`), never on app startup.
+        Set DB_AUTO_MIGRATE=1 for local development to upgrade here instead.
         """
-        conn = self.get_connection()
+        from src.utils import migrations
+
+        conn = self._checkout()
         try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS user_prompts (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER NOT NULL UNIQUE REFERENCES users(id) ON DELETE CASCADE,
-                        system_prompt TEXT NOT NULL DEFAULT 'You are SUMA, a helpful AI assistant. Be professional and courteous in all interactions.',
-                        created_at TIMESTAMP DEFAULT NOW(),
-                        updated_at TIMESTAMP DEFAULT NOW()
-                    );
-                """)
-            conn.commit()
-            logging.info("✅ user_prompts table created")
+            if os.getenv("DB_AUTO_MIGRATE", "").lower() in {"1", "true", "yes"}:
+                migrations.upgrade(conn)
+
+            current = migrations.get_current_version(conn)
+            if current < migrations.SCHEMA_VERSION:
+                logging.error(
+                    f"❌ Database schema is at version {current}, code expects {migrations.SCHEMA_VERSION}. "
+                    f"Run `python -m src.utils.migrations upgrade`."
+                )
+            elif current > migrations.SCHEMA_VERSION:
+                logging.warning(f"⚠️ Database schema version {current} is newer than code ({migrations.SCHEMA_VERSION})")
+            return current
         except Exception as e:
-            logging.error(f"Error creating user_prompts table: {e}")
             conn.rollback()
+            logging.error(f"Error checking schema version: {e}")
+            return None
         finally:
-            self.release_connection(conn)
+            self._checkin(conn)
 
     # ==================== USER PROMPTS METHODS ====================
 
+    @instrumented
     def create_default_user_prompt(self, user_id: int):
         """
         Create default prompt for a new user.
@@ -249,6 +477,7 @@ class PGDB:
         finally:
             self.release_connection(conn)
 
+    @instrumented
     def get_user_prompt(self, user_id: int) -> dict:
         """
         Get the user's current system prompt.
@@ -288,6 +517,7 @@ class PGDB:
         finally:
             self.release_connection(conn)
 
+    @instrumented
     def update_user_system_prompt(self, user_id: int, system_prompt: str):
         """
         Update user's system prompt.
@@ -365,18 +595,28 @@ Tone: Professional and friendly"""
 
     # ==================== RECORDING METHODS ====================
 
+    @instrumented
     def store_recording_blob(self, call_id: str, recording_data: bytes, content_type: str = "audio/ogg"):
-        """Store actual recording bytes"""
+        """Store actual recording bytes (call_recordings side table)"""
+        where, params = call_id_filter(call_id)
         conn = self.get_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    UPDATE call_history
-                    SET recording_blob_data = %s,
-                        recording_size = %s,
-                        recording_content_type = %s
-                    WHERE call_id = %s;
-                """, (psycopg2.Binary(recording_data), len(recording_data), content_type, call_id))
+                cursor.execute(f"""
+                    INSERT INTO call_recordings (call_id, user_id, data, size, content_type, checksum)
+                    SELECT call_id, user_id, %s, %s, %s, %s
+                    FROM call_history
+                    WHERE {where}
+                    ON CONFLICT (call_id) DO UPDATE
+                    SET data = EXCLUDED.data,
+                        size = EXCLUDED.size,
+                        content_type = EXCLUDED.content_type,
+                        checksum = EXCLUDED.checksum,
+                        updated_at = CURRENT_TIMESTAMP;
+                """, (
+                    psycopg2.Binary(recording_data), len(recording_data), content_type,
+                    hashlib.sha256(recording_data).hexdigest(), *params
+                ))
             conn.commit()
             logging.info(f"✅ Stored {len(recording_data)} bytes for {call_id}")
         except Exception as e:
@@ -386,6 +626,7 @@ Tone: Professional and friendly"""
         finally:
             self.release_connection(conn)
 
+    @instrumented
     def get_recording_blob(self, call_id: str, user_id: int = None):
         """
         Retrieve recording bytes from database.
@@ -401,15 +642,15 @@ Tone: Professional and friendly"""
                 if user_id is not None:
                     # Normal query with user_id check
                     cursor.execute("""
-                        SELECT recording_blob_data, recording_content_type, recording_size
-                        FROM call_history
+                        SELECT data, content_type, size
+                        FROM call_recordings
                         WHERE call_id = %s AND user_id = %s;
                     """, (call_id, user_id))
                 else:
                     # Verification query without user_id check
                     cursor.execute("""
-                        SELECT recording_blob_data, recording_content_type, recording_size
-                        FROM call_history
+                        SELECT data, content_type, size
+                        FROM call_recordings
                         WHERE call_id = %s;
                     """, (call_id,))
                 
@@ -423,8 +664,148 @@ Tone: Professional and friendly"""
         finally:
             self.release_connection(conn)
 
+    @instrumented
+    def store_recording_rendition(self, call_id: str, rendition: str, data: bytes, content_type: str, bitrate_kbps: int = None):
+        """Store one transcoded rendition of a call's recording (call_recording_renditions)"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO call_recording_renditions
+                        (call_id, rendition, user_id, data, size, content_type, bitrate_kbps, checksum)
+                    SELECT call_id, %s, user_id, %s, %s, %s, %s, %s
+                    FROM call_recordings
+                    WHERE call_id = %s
+                    ON CONFLICT (call_id, rendition) DO UPDATE
+                    SET data = EXCLUDED.data,
+                        size = EXCLUDED.size,
+                        content_type = EXCLUDED.content_type,
+                        bitrate_kbps = EXCLUDED.bitrate_kbps,
+                        checksum = EXCLUDED.checksum,
+                        updated_at = CURRENT_TIMESTAMP;
+                """, (
+                    rendition, psycopg2.Binary(data), len(data), content_type, bitrate_kbps,
+                    hashlib.sha256(data).hexdigest(), call_id
+                ))
+                stored = cursor.rowcount > 0
+            conn.commit()
+            return stored
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error storing {rendition} rendition for {call_id}: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def get_recording_rendition(self, call_id: str, rendition: str, user_id: int = None):
+        """Returns: (bytes, content_type, size) or (None, None, None)"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT data, content_type, size
+                    FROM call_recording_renditions
+                    WHERE call_id = %s AND rendition = %s AND (%s::integer IS NULL OR user_id = %s)
+                """, (call_id, rendition, user_id, user_id))
+                row = cursor.fetchone()
+                if row and row[0]:
+                    return row[0], row[1], row[2]
+                return None, None, None
+        finally:
+            self.release_connection(conn)
+
+    def get_recordings_missing_renditions(self, renditions: list, limit: int = 100) -> list:
+        """call_ids with an inline recording but without every rendition in `renditions` or a waveform"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT r.call_id
+                    FROM call_recordings r
+                    WHERE (
+                        SELECT COUNT(*) FROM call_recording_renditions rr
+                        WHERE rr.call_id = r.call_id AND rr.rendition = ANY(%s)
+                    ) < %s
+                    OR NOT EXISTS (SELECT 1 FROM call_recording_waveforms w WHERE w.call_id = r.call_id)
+                    ORDER BY r.updated_at DESC
+                    LIMIT %s
+                """, (list(renditions), len(renditions), limit))
+                return [row[0] for row in cursor.fetchall()]
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def store_recording_waveform(self, call_id: str, peaks: bytes, duration_ms: int):
+        """Store the downsampled peak array of a call's recording (call_recording_waveforms)"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO call_recording_waveforms (call_id, user_id, peaks, points, duration_ms, checksum)
+                    SELECT call_id, user_id, %s, %s, %s, %s
+                    FROM call_recordings
+                    WHERE call_id = %s
+                    ON CONFLICT (call_id) DO UPDATE
+                    SET peaks = EXCLUDED.peaks,
+                        points = EXCLUDED.points,
+                        duration_ms = EXCLUDED.duration_ms,
+                        checksum = EXCLUDED.checksum,
+                        updated_at = CURRENT_TIMESTAMP;
+                """, (
+                    psycopg2.Binary(peaks), len(peaks), duration_ms,
+                    hashlib.sha256(peaks).hexdigest(), call_id
+                ))
+                stored = cursor.rowcount > 0
+            conn.commit()
+            return stored
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error storing waveform for {call_id}: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def get_recording_waveforms(self, call_ids: list, user_id: int) -> dict:
+        """{call_id: {peaks, points, duration_ms, checksum, updated_at, has_preview}} for the user's calls that have one"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT w.call_id, w.peaks, w.points, w.duration_ms, w.checksum, w.updated_at,
+                        EXISTS (
+                            SELECT 1 FROM call_recording_renditions rr
+                            WHERE rr.call_id = w.call_id AND rr.rendition = 'preview'
+                        ) AS has_preview
+                    FROM call_recording_waveforms w
+                    WHERE w.call_id = ANY(%s) AND w.user_id = %s
+                """, (list(call_ids), user_id))
+                return {row["call_id"]: row for row in cursor.fetchall()}
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def store_transcript_gzip(self, call_id: str, transcript_gzip: bytes):
+        """Backfill the pre-compressed transcript payload for rows written before it existed"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE call_transcripts
+                    SET transcript_gzip = %s
+                    WHERE call_id = %s AND transcript_gzip IS NULL;
+                """, (psycopg2.Binary(transcript_gzip), call_id))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error storing compressed transcript for {call_id}: {e}")
+        finally:
+            self.release_connection(conn)
+
     # ==================== USER MANAGEMENT METHODS ====================
 
+    @instrumented
     def register_user(self, user_data):
         conn = self.get_connection()
         try:
@@ -471,6 +852,7 @@ Tone: Professional and friendly"""
         finally:
             self.release_connection(conn)
 
+    @instrumented
     def login_user(self, user_data):
         """Verify user credentials by username or email and return user info."""
         conn = self.get_connection()
@@ -501,6 +883,7 @@ Tone: Professional and friendly"""
         finally:
             self.release_connection(conn)
 
+    @instrumented
     def get_user_by_id(self, user_id: int):
         """Get user by ID"""
         conn = self.get_connection()
@@ -515,6 +898,7 @@ Tone: Professional and friendly"""
             if conn:
                 self.release_connection(conn)
 
+    @instrumented
     def delete_user_by_id(self, user_id):
         """
         delete user by id
@@ -540,6 +924,7 @@ Tone: Professional and friendly"""
             if conn:
                 self.release_connection(conn)
 
+    @instrumented
     def update_user_name_fields(self, user_id: int, first_name: str, last_name: str):
         conn = self.get_connection()
         try:
@@ -559,6 +944,7 @@ Tone: Professional and friendly"""
         finally:
             self.release_connection(conn)
 
+    @instrumented
     def change_user_password(self, user_id: int, current_password: str, new_password: str):
         conn = self.get_connection()
         try:
@@ -590,6 +976,7 @@ Tone: Professional and friendly"""
         finally:
             self.release_connection(conn)
 
+    @instrumented
     def get_all_users(self):
         query = """
             SELECT id, first_name, last_name, username, email, is_admin, created_at
@@ -615,6 +1002,7 @@ Tone: Professional and friendly"""
         finally:
             self.release_connection(conn)
 
+    @instrumented
     def get_all_users_paginated(self, page: int = 1, page_size: int = 10):
         query_total = "SELECT COUNT(*) FROM users WHERE is_admin = FALSE"
         query_data = """
@@ -660,6 +1048,7 @@ Tone: Professional and friendly"""
 
     # ==================== CALL HISTORY METHODS ====================
 
+    @instrumented
     def insert_call_history(
         self,
         user_id: int,
@@ -667,7 +1056,9 @@ Tone: Professional and friendly"""
         status: str = None,
         voice_id: str = None,
         voice_name: str = None,
-        to_number: str = None
+        to_number: str = None,
+        language: str = None,
+        contact_id: int = None
     ):
         """
         Insert a new call history record with initial data.
@@ -678,15 +1069,15 @@ Tone: Professional and friendly"""
             with conn.cursor() as cursor:
                 values = (
                     user_id, call_id, status,
-                    voice_id, voice_name, to_number
+                    voice_id, voice_name, to_number, language, contact_id
                 )
 
                 cursor.execute("""
                     INSERT INTO call_history (
                         user_id, call_id, status,
-                        voice_id, voice_name, to_number
+                        voice_id, voice_name, to_number, language, contact_id
                     )
-                    VALUES (%s,%s,%s,%s,%s,%s)
+                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
                     RETURNING id;
                 """, values)
 
@@ -701,7 +1092,8 @@ Tone: Professional and friendly"""
         finally:
             self.release_connection(conn)
 
-    def update_call_history(self, call_id: str, updates: dict):
+    @instrumented
+    def update_call_history(self, call_id: str, updates: dict, conn=None):
         """
         Update specific fields in the call_history record based on the call_id.
 
@@ -709,14 +1101,30 @@ Tone: Professional and friendly"""
             call_id (str): The unique identifier for the call.
             updates (dict): A dictionary where keys are column names and values
                             are the new values to set. e.g., {"status": "completed", "duration": 120.5}
+
+        A "transcript" key is written to the call_transcripts side table (same
+        transaction), so status updates never rewrite the transcript.
+        Pass `conn` to run inside a PGDB.transaction().
         """
         if not updates:
             logging.warning("update_call_history called with no updates.")
             return None
 
-        conn = self.get_connection()
+        updates = dict(updates)
+        has_transcript = "transcript" in updates
+        transcript = updates.pop("transcript", None)
+
         try:
-            with conn.cursor() as cursor:
+            with self._write_cursor(conn) as cursor:
+                where, where_params = call_id_filter(call_id)
+                row = None
+
+                if has_transcript:
+                    if transcript is None:
+                        cursor.execute("DELETE FROM call_transcripts WHERE call_id = %s", (call_id,))
+                    else:
+                        self._upsert_transcript(cursor, call_id, transcript)
+
                 # Build the SET part of the SQL query dynamically
                 set_clauses = []
                 param_values = []
@@ -726,41 +1134,59 @@ Tone: Professional and friendly"""
                         logging.error(f"Invalid column name detected: {key}")
                         raise ValueError(f"Invalid column name: {key}")
 
-                    # Handle JSON data specifically
-                    if key == 'transcript' and value is not None:
-                        set_clauses.append(f"{key} = %s")
-                        param_values.append(json.dumps(value))
-                    else:
-                        set_clauses.append(f"{key} = %s")
-                        param_values.append(value)
+                    set_clauses.append(f"{key} = %s")
+                    param_values.append(value)
 
-                if not set_clauses:
-                    logging.warning("No valid fields to update.")
-                    return None
+                if set_clauses:
+                    if "updated_at" not in updates:
+                        set_clauses.append("updated_at = CURRENT_TIMESTAMP")
 
-                set_sql = ", ".join(set_clauses)
-                sql = f"UPDATE call_history SET {set_sql} WHERE call_id = %s RETURNING id;"
-                
-                # Add call_id to the parameters list
-                param_values.append(call_id)
+                    set_sql = ", ".join(set_clauses)
+                    sql = f"UPDATE call_history SET {set_sql} WHERE {where} RETURNING id;"
+                    
+                    # Add call_id (+ created_at window for partition pruning) to the parameters list
+                    param_values.extend(where_params)
 
-                logging.debug(f"Executing SQL: {sql} with params: {param_values}")
+                    logging.debug(f"Executing SQL: {sql} with params: {param_values}")
 
-                cursor.execute(sql, tuple(param_values))
+                    cursor.execute(sql, tuple(param_values))
+                    row = cursor.fetchone()
+                elif not has_transcript:
+                    logging.warning("No valid fields to update.")
+                    return None
 
-                row = cursor.fetchone()
-                conn.commit()
-                logging.info(f"Updated call_history for call_id {call_id}. Updated fields: {list(updates.keys())}")
-                return row[0] if row else None
+            logging.info(f"Updated call_history for call_id {call_id}. Updated fields: {list(updates.keys()) + (['transcript'] if has_transcript else [])}")
+            return row[0] if row else None
 
         except Exception as e:
-            conn.rollback()
             logging.error(f"Error updating call history for call_id={call_id}: {e}")
             traceback.print_exc()
             raise
-        finally:
-            self.release_connection(conn)
 
+    def _upsert_transcript(self, cursor, call_id: str, transcript):
+        """Write a transcript (+ its pre-compressed body and checksum) to call_transcripts"""
+        transcript_json = json.dumps(transcript)
+        where, params = call_id_filter(call_id)
+        cursor.execute(f"""
+            INSERT INTO call_transcripts (call_id, user_id, transcript, transcript_gzip, checksum)
+            SELECT call_id, user_id, %s, %s, %s
+            FROM call_history
+            WHERE {where}
+            ON CONFLICT (call_id) DO UPDATE
+            SET transcript = EXCLUDED.transcript,
+                transcript_gzip = EXCLUDED.transcript_gzip,
+                checksum = EXCLUDED.checksum,
+                updated_at = CURRENT_TIMESTAMP;
+        """, (
+            transcript_json,
+            # ✅ Compress once at write time, not on every transcript request
+            psycopg2.Binary(transcript_response_gzip(transcript_json)),
+            # ✅ Checksum backs the transcript ETag
+            hashlib.sha256(transcript_json.encode("utf-8")).hexdigest(),
+            *params
+        ))
+
+    @instrumented
     def get_call_history_by_user_id(self, user_id: int, page: int = 1, page_size: int = 10):
         conn = self.get_connection()
         try:
@@ -781,12 +1207,17 @@ Tone: Professional and friendly"""
                 # Paginated query
                 offset = (page - 1) * page_size
                 cursor.execute("""
-                    SELECT ch.id, ch.call_id, ch.status, ch.duration, ch.transcript,
+                    SELECT ch.id, ch.call_id, ch.status, ch.duration, t.transcript,
                         ch.summary, ch.recording_url, ch.created_at, ch.started_at, ch.ended_at,
                         ch.voice_id, ch.voice_name, ch.from_number, ch.to_number,
+                        ch.answered, ch.answered_at, ch.billable_seconds,
+                        ch.transcript_status, ch.transcript_attempts, ch.transcript_error,
+                        ch.recording_status, ch.recording_attempts, ch.recording_error,
+                        EXISTS (SELECT 1 FROM call_recordings r WHERE r.call_id = ch.call_id) AS has_recording_data,
                         u.id AS user_id, u.username, u.email
                     FROM call_history ch
                     JOIN users u ON ch.user_id = u.id
+                    LEFT JOIN call_transcripts t ON t.call_id = ch.call_id
                     WHERE ch.user_id = %s
                     ORDER BY ch.created_at DESC
                     LIMIT %s OFFSET %s
@@ -816,20 +1247,82 @@ Tone: Professional and friendly"""
         finally:
             self.release_connection(conn)
 
+    EXPORT_COLUMNS = (
+        "call_id", "status", "duration", "created_at", "started_at", "ended_at",
+        "voice_name", "language", "from_number", "to_number", "summary", "recording_url",
+    )
+
+    def iter_call_history_export(
+        self,
+        user_id: int,
+        from_date: str = None,
+        to_date: str = None,
+        status: str = None,
+        voice_name: str = None,
+        batch_size: int = 2000
+    ):
+        """
+        Yield a user's call history rows (EXPORT_COLUMNS, oldest first) for export.
+
+        Uses a named (server-side) cursor, so only `batch_size` rows are held in
+        memory at a time however large the export is. The pooled connection is
+        held until the generator is exhausted or closed.
+        """
+        conditions = ["user_id = %s"]
+        params = [user_id]
+        if from_date:
+            conditions.append("created_at >= %s::date")
+            params.append(from_date)
+        if to_date:
+            conditions.append("created_at < %s::date + 1")
+            params.append(to_date)
+        if status:
+            conditions.append("status = %s")
+            params.append(status)
+        if voice_name:
+            conditions.append("voice_name = %s")
+            params.append(voice_name)
+
+        conn = self.get_connection()
+        try:
+            with conn.cursor(name=f"call_export_{user_id}_{time.monotonic_ns()}", cursor_factory=RealDictCursor) as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(f"""
+                    SELECT {", ".join(self.EXPORT_COLUMNS)}
+                    FROM call_history
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY created_at, id
+                """, params)
+                for row in cursor:
+                    yield row
+            conn.commit()
+        except GeneratorExit:
+            conn.rollback()
+            raise
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error exporting call history for user_id={user_id}: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
     def get_call_by_id(self, call_id: str, user_id: int):
         """Get a specific call by ID for a user"""
-        query = """
-            SELECT id, call_id, status, duration, transcript, recording_url, 
-                transcript_url, transcript_blob, recording_blob,
-                created_at, started_at, ended_at, 
-                from_number, to_number, voice_name
-            FROM call_history
-            WHERE call_id = %s AND user_id = %s
+        where, params = call_id_filter(call_id, "ch")
+        query = f"""
+            SELECT ch.id, ch.call_id, ch.status, ch.duration, t.transcript, ch.recording_url, 
+                ch.transcript_url, ch.transcript_blob, ch.recording_blob,
+                ch.created_at, ch.started_at, ch.ended_at, 
+                ch.from_number, ch.to_number, ch.voice_name
+            FROM call_history ch
+            LEFT JOIN call_transcripts t ON t.call_id = ch.call_id
+            WHERE {where} AND ch.user_id = %s
         """
         conn = self.get_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(query, (call_id, user_id))
+                cursor.execute(query, (*params, user_id))
                 result = cursor.fetchone()
                 
                 if result and isinstance(result.get("transcript"), str):
@@ -845,45 +1338,190 @@ Tone: Professional and friendly"""
         finally:
             self.release_connection(conn)
 
+    @instrumented
+    def get_active_calls(self, stale_after_minutes: int = 120) -> list:
+        """
+        Calls that have not reached a final status, as [{"call_id", "user_id"}].
+        Rows older than `stale_after_minutes` are ignored (their final webhook
+        was lost), which also keeps the scan on the newest partition(s).
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT call_id, user_id
+                    FROM call_history
+                    WHERE created_at >= CURRENT_TIMESTAMP - make_interval(mins => %s)
+                      AND (status IS NULL OR status <> ALL(%s))
+                """, (stale_after_minutes, list(INACTIVE_CALL_STATUSES)))
+                return cursor.fetchall()
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def set_artifact_status(self, call_id: str, kind: str, status: str, error: str = None, attempt: bool = False):
+        """
+        Record the ingestion state of a call's transcript or recording
+        (pending / fetching / ready / failed). `attempt` counts one more try.
+        """
+        if kind not in ARTIFACT_KINDS or status not in ARTIFACT_STATUSES:
+            raise ValueError(f"Invalid artifact status: {kind}={status}")
+        where, params = call_id_filter(call_id)
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL("""
+                    UPDATE call_history
+                    SET {status} = %s, {error} = %s, {attempts} = {attempts} + %s,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE {where}
+                """).format(
+                    status=sql.Identifier(f"{kind}_status"),
+                    error=sql.Identifier(f"{kind}_error"),
+                    attempts=sql.Identifier(f"{kind}_attempts"),
+                    where=sql.SQL(where),
+                ), (status, error, 1 if attempt else 0, *params))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error setting {kind} status for {call_id}: {e}")
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def claim_stale_artifacts(
+        self, kind: str, stale_seconds: float, max_attempts: int, max_age_hours: float, limit: int = 50
+    ) -> list:
+        """
+        Downloads whose task is gone: <kind>_status pending/fetching with no
+        update for `stale_seconds` (worker crashed or was killed), or failed
+        with ARTIFACT_INTERRUPTED (cancelled by a shutdown). Rows out of
+        attempts are marked failed; the rest are set back to pending with a
+        fresh updated_at - so other workers skip them - and returned as
+        [{call_id, blob, attempts}] for the caller to re-spawn.
+        Only calls created in the last `max_age_hours` are scanned.
+        """
+        if kind not in ARTIFACT_KINDS:
+            raise ValueError(f"Invalid artifact kind: {kind}")
+        identifiers = {
+            "status": sql.Identifier(f"{kind}_status"),
+            "error": sql.Identifier(f"{kind}_error"),
+            "attempts": sql.Identifier(f"{kind}_attempts"),
+            "blob": sql.Identifier(f"{kind}_blob"),
+        }
+        stuck = sql.SQL("""
+            created_at >= CURRENT_TIMESTAMP - make_interval(secs => %(max_age)s)
+            AND {blob} IS NOT NULL
+            AND (
+                ({status} IN ('pending', 'fetching')
+                 AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %(stale)s))
+                OR ({status} = 'failed' AND {error} = %(interrupted)s)
+            )
+        """).format(**identifiers)
+        params = {
+            "max_age": max_age_hours * 3600, "stale": stale_seconds, "interrupted": ARTIFACT_INTERRUPTED,
+            "max_attempts": max_attempts, "limit": limit,
+        }
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(sql.SQL("""
+                    UPDATE call_history
+                    SET {status} = 'failed', updated_at = CURRENT_TIMESTAMP,
+                        {error} = COALESCE({error}, 'download task lost')
+                    WHERE {stuck} AND {attempts} >= %(max_attempts)s
+                """).format(stuck=stuck, **identifiers), params)
+                given_up = cursor.rowcount
+
+                # SKIP LOCKED + the re-checked WHERE: concurrent workers never claim the same row
+                cursor.execute(sql.SQL("""
+                    UPDATE call_history ch
+                    SET {status} = 'pending', updated_at = CURRENT_TIMESTAMP
+                    FROM (
+                        SELECT call_id, created_at FROM call_history
+                        WHERE {stuck} AND {attempts} < %(max_attempts)s
+                        ORDER BY updated_at
+                        LIMIT %(limit)s
+                        FOR UPDATE SKIP LOCKED
+                    ) stale
+                    WHERE ch.call_id = stale.call_id AND ch.created_at = stale.created_at
+                    RETURNING ch.call_id, ch.{blob} AS blob, ch.{attempts} AS attempts
+                """).format(stuck=stuck, **identifiers), params)
+                claimed = cursor.fetchall()
+            conn.commit()
+            if given_up:
+                logging.warning(f"⚠️ Marked {given_up} stuck {kind} downloads failed (out of attempts)")
+            return claimed
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error reconciling {kind} downloads: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def get_call_artifact_meta(self, call_id: str, user_id: int):
+        """
+        Validators for a call's artifacts (no payload columns) - lets the
+        transcript/recording endpoints answer conditional requests with one
+        indexed lookup.
+        """
+        where, params = call_id_filter(call_id, "ch")
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"""
+                    SELECT ch.status,
+                        GREATEST(ch.updated_at, t.updated_at, r.updated_at) AS updated_at,
+                        t.checksum AS transcript_checksum, r.checksum AS recording_checksum,
+                        r.size AS recording_size, r.content_type AS recording_content_type,
+                        ch.recording_blob, ch.transcript_blob,
+                        ch.transcript_status, ch.transcript_attempts, ch.transcript_error,
+                        ch.recording_status, ch.recording_attempts, ch.recording_error,
+                        EXISTS (SELECT 1 FROM call_recording_waveforms w WHERE w.call_id = ch.call_id) AS has_waveform,
+                        (SELECT json_object_agg(rr.rendition, json_build_object(
+                                    'size', rr.size, 'content_type', rr.content_type,
+                                    'bitrate_kbps', rr.bitrate_kbps, 'checksum', rr.checksum))
+                         FROM call_recording_renditions rr WHERE rr.call_id = ch.call_id) AS renditions
+                    FROM call_history ch
+                    LEFT JOIN call_transcripts t ON t.call_id = ch.call_id
+                    LEFT JOIN call_recordings r ON r.call_id = ch.call_id
+                    WHERE {where} AND ch.user_id = %s
+                """, (*params, user_id))
+                return cursor.fetchone()
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
     def add_call_event(self, call_id: str, event_type: str, event_data: dict = None):
-        """Add a unique event entry into call_history.events_log"""
+        """Add a unique event entry into call_events.events_log"""
+        event = {
+            "event": event_type,
+            "timestamp": datetime.utcnow().isoformat(),
+            "data": event_data or {}
+        }
+        where, params = call_id_filter(call_id)
         conn = self.get_connection()
         try:
             with conn.cursor() as cursor:
-                # Fetch existing events
-                cursor.execute("SELECT events_log FROM call_history WHERE call_id = %s", (call_id,))
-                row = cursor.fetchone()
-                if not row:
-                    logging.warning(f"Call {call_id} not found for event {event_type}")
-                    return
-                
-                events_log = row[0] or []
-                if isinstance(events_log, str):
-                    try:
-                        events_log = json.loads(events_log)
-                    except Exception:
-                        events_log = []
-
-                # Check for duplicate event
-                if any(ev.get("event") == event_type for ev in events_log):
-                    logging.info(f"Duplicate event {event_type} ignored for {call_id}")
-                    return
-
-                # Append event
-                events_log.append({
-                    "event": event_type,
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "data": event_data or {}
-                })
-
-                # Update DB
-                cursor.execute(
-                    "UPDATE call_history SET events_log = %s WHERE call_id = %s",
-                    (json.dumps(events_log), call_id)
-                )
+                # ✅ Append + dedupe in one statement - no read-modify-write of the whole log
+                cursor.execute(f"""
+                    INSERT INTO call_events (call_id, user_id, events_log)
+                    SELECT call_id, user_id, jsonb_build_array(%s::jsonb)
+                    FROM call_history
+                    WHERE {where}
+                    ON CONFLICT (call_id) DO UPDATE
+                    SET events_log = call_events.events_log || EXCLUDED.events_log,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE NOT call_events.events_log @> jsonb_build_array(jsonb_build_object('event', %s::text))
+                """, (json.dumps(event), *params, event_type))
+                added = cursor.rowcount
 
             conn.commit()
-            logging.info(f"Event '{event_type}' added to call {call_id}")
+            if added:
+                logging.info(f"Event '{event_type}' added to call {call_id}")
+            else:
+                logging.info(f"Event {event_type} ignored for {call_id} (duplicate or unknown call)")
 
         except Exception as e:
             conn.rollback()
@@ -891,61 +1529,96 @@ Tone: Professional and friendly"""
         finally:
             self.release_connection(conn)
 
-    def add_agent_event(self, call_id: str, event_type: str, event_data: dict = None, timestamp: str = None):
-        """Add a unique agent event entry into call_history.agent_events"""
-        if timestamp is None:
-            timestamp = datetime.now(timezone.utc).isoformat()
-        
+    @instrumented
+    def mark_call_answered(self, call_id: str, answered_at=None) -> bool:
+        """
+        Record that the callee picked up. The earliest signal wins, so the
+        egress_started / sip participant_joined webhooks can arrive in any order.
+        Returns True if answered/answered_at changed.
+        """
+        where, params = call_id_filter(call_id)
         conn = self.get_connection()
         try:
             with conn.cursor() as cursor:
-                # Fetch existing events
-                cursor.execute("SELECT agent_events FROM call_history WHERE call_id = %s", (call_id,))
-                row = cursor.fetchone()
-                if not row:
-                    logging.warning(f"Call {call_id} not found for agent event {event_type}")
-                    return
-                
-                events_log = row[0] or []
-                if isinstance(events_log, str):
-                    try:
-                        events_log = json.loads(events_log)
-                    except Exception:
-                        events_log = []
-
-                # Check for duplicate (within 5s timestamp tolerance)
-                now = datetime.now(timezone.utc)
-                for ev in events_log:
-                    if (ev.get("event_type") == event_type and 
-                        abs((now - datetime.fromisoformat(ev.get("timestamp").replace("Z", "+00:00"))).total_seconds()) < 5):
-                        logging.info(f"Duplicate agent event {event_type} ignored for {call_id}")
-                        return
-
-                # Append event
-                events_log.append({
-                    "event_type": event_type,
-                    "event_data": event_data or {},
-                    "timestamp": timestamp,
-                    "received_at": datetime.now(timezone.utc).isoformat()
-                })
-
-                # Update DB
-                cursor.execute(
-                    "UPDATE call_history SET agent_events = %s WHERE call_id = %s",
-                    (json.dumps(events_log), call_id)
-                )
-
+                cursor.execute(f"""
+                    UPDATE call_history
+                    SET answered = TRUE,
+                        answered_at = LEAST(answered_at, COALESCE(%s, CURRENT_TIMESTAMP)),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE {where}
+                      AND (NOT answered OR answered_at IS NULL OR answered_at > COALESCE(%s, CURRENT_TIMESTAMP))
+                """, (answered_at, *params, answered_at))
+                marked = cursor.rowcount > 0
             conn.commit()
-            logging.info(f"Agent event '{event_type}' added to call {call_id}")
+            if marked:
+                logging.info(f"📞 Call {call_id} answered at {answered_at}")
+            return marked
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error marking call {call_id} answered: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def add_agent_event(self, call_id: str, event_type: str, event_data: dict = None, timestamp: str = None):
+        """
+        Append one agent event to call_agent_events. Chatty telemetry should go
+        through src/utils/agent_events.py instead (buffered, deduped in memory,
+        flushed with insert_agent_events).
+        """
+        self.insert_agent_events([(call_id, event_type, event_data, timestamp)])
+
+    @instrumented
+    def insert_agent_events(self, rows: list) -> int:
+        """
+        Multi-row append to call_agent_events.
+        rows: [(call_id, event_type, event_data dict, event timestamp ISO string or None)]
+        Rows whose call does not exist are skipped. Returns the number inserted.
+        """
+        if not rows:
+            return 0
+        from psycopg2.extras import execute_values
 
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                # ✅ One statement per batch; user_id comes from call_history, not the client.
+                # Each row carries its call_id's created_at window (call_id_filter) so the
+                # lateral lookup is pruned to one partition at run time; ids without an
+                # embedded timestamp get an unbounded window.
+                values = []
+                for call_id, event_type, event_data, timestamp in rows:
+                    lower, upper = call_id_created_at_bounds(call_id) or ("-infinity", "infinity")
+                    values.append((
+                        call_id, event_type, json.dumps(event_data or {}),
+                        _parse_event_timestamp(timestamp), lower, upper
+                    ))
+                inserted = execute_values(cursor, """
+                    INSERT INTO call_agent_events (call_id, user_id, event_type, event_data, event_ts)
+                    SELECT v.call_id, ch.user_id, v.event_type, v.event_data::jsonb, v.event_ts::timestamptz
+                    FROM (VALUES %s) AS v(call_id, event_type, event_data, event_ts, created_from, created_to)
+                    CROSS JOIN LATERAL (
+                        SELECT user_id FROM call_history
+                        WHERE call_id = v.call_id
+                          AND created_at >= v.created_from::timestamptz
+                          AND created_at < v.created_to::timestamptz
+                        LIMIT 1
+                    ) ch
+                    RETURNING 1
+                """, values, page_size=len(rows), fetch=True)
+            conn.commit()
+            if len(inserted) < len(rows):
+                logging.warning(f"⚠️ Dropped {len(rows) - len(inserted)} agent events for unknown calls")
+            return len(inserted)
         except Exception as e:
             conn.rollback()
-            logging.error(f"Error adding agent event: {e}")
-            traceback.print_exc()
+            logging.error(f"Error inserting agent events: {e}")
             raise
         finally:
             self.release_connection(conn)
 
+    @instrumented
     def create_appointment(
         self,
         user_id: int,
@@ -955,39 +1628,803 @@ Tone: Professional and friendly"""
         attendee_name: str,
         attendee_email: str,
         title: str,
-        description: str
+        description: str,
+        call_id: str = None,
+        conn=None
     ) -> int:
         """
         Create a new appointment in the database
-        Returns the appointment ID
+        Returns the appointment ID (pass `conn` to run inside a PGDB.transaction())
         """
-        conn = self.get_connection()
         try:
-            with conn.cursor() as cursor:
+            with self._write_cursor(conn) as cursor:
                 cursor.execute("""
                     INSERT INTO appointments (
                         user_id, appointment_date, start_time, end_time,
                         attendee_name, attendee_email, title, description,
-                        status, created_at
+                        status, created_at, call_id
                     )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), %s)
                     RETURNING id
                 """, (
                     user_id, appointment_date, start_time, end_time,
                     attendee_name, attendee_email, title, description,
-                    'scheduled'
+                    'scheduled', call_id
                 ))
                 
                 appointment_id = cursor.fetchone()[0]
-                conn.commit()
-                
-                logging.info(f"✅ Created appointment {appointment_id} for user {user_id}")
-                return appointment_id
+
+                # ✅ Count the booking against the call's rollup bucket (same transaction)
+                if call_id:
+                    where, params = call_id_filter(call_id)
+                    cursor.execute(f"""
+                        INSERT INTO call_stats_daily (user_id, day, voice_name, language, bookings)
+                        SELECT user_id, (created_at AT TIME ZONE 'UTC')::date,
+                               COALESCE(voice_name, ''), COALESCE(language, ''), 1
+                        FROM call_history
+                        WHERE {where}
+                        ON CONFLICT (user_id, day, voice_name, language)
+                        DO UPDATE SET bookings = call_stats_daily.bookings + 1,
+                                      updated_at = CURRENT_TIMESTAMP
+                    """, params)
+
+            logging.info(f"✅ Created appointment {appointment_id} for user {user_id}")
+            return appointment_id
                 
         except Exception as e:
-            conn.rollback()
             logging.error(f"❌ Error creating appointment: {e}")
             raise
+
+    @instrumented
+    def get_user_appointments(self, user_id: int, from_date: str = None, conn=None):
+        """Appointments for a user from `from_date` (default today) onwards"""
+        if from_date is None:
+            from_date = datetime.now().strftime("%Y-%m-%d")
+        try:
+            with self._write_cursor(conn, cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT id, appointment_date, start_time, end_time, attendee_email,
+                        attendee_name, title, description, status, created_at
+                    FROM appointments
+                    WHERE user_id = %s AND appointment_date >= %s
+                    ORDER BY appointment_date, start_time
+                """, (user_id, from_date))
+                return cursor.fetchall()
+        except Exception as e:
+            logging.error(f"Error getting appointments: {e}")
+            raise
+
+    @instrumented
+    def set_agent_call_status(self, call_id: str, status: str, conn=None):
+        """Status reported by the agent; started_at is set once, on dialing/connected"""
+        where, params = call_id_filter(call_id)
+        with self._write_cursor(conn) as cursor:
+            cursor.execute(f"""
+                UPDATE call_history
+                SET status = %s,
+                    started_at = CASE WHEN %s THEN COALESCE(started_at, CURRENT_TIMESTAMP) ELSE started_at END,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE {where}
+                RETURNING id
+            """, (status, status in {"dialing", "connected"}, *params))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+
+    # ==================== CONTACT METHODS ====================
+
+    @instrumented
+    def import_contacts(self, user_id: int, copy_stream) -> dict:
+        """
+        Bulk-load contacts from a CSV stream of (line_no, phone_number, name, email)
+        rows (see src/utils/contacts.CopyStream).
+
+        Rows are streamed into a temp staging table with COPY FROM STDIN, then
+        inserted in one statement, skipping numbers already in the user's
+        contacts or do-not-call list. Duplicates within the file keep the first
+        occurrence. Returns counts.
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    CREATE TEMP TABLE contact_import_staging (
+                        line_no INTEGER,
+                        phone_number TEXT,
+                        name TEXT,
+                        email TEXT
+                    ) ON COMMIT DROP
+                """)
+                cursor.copy_expert(
+                    "COPY contact_import_staging (line_no, phone_number, name, email) FROM STDIN WITH (FORMAT csv)",
+                    copy_stream
+                )
+
+                cursor.execute("SELECT COUNT(*), COUNT(DISTINCT phone_number) FROM contact_import_staging")
+                staged, unique_numbers = cursor.fetchone()
+
+                cursor.execute("""
+                    SELECT COUNT(DISTINCT s.phone_number)
+                    FROM contact_import_staging s
+                    JOIN do_not_call d ON d.user_id = %s AND d.phone_number = s.phone_number
+                """, (user_id,))
+                do_not_call = cursor.fetchone()[0]
+
+                cursor.execute("""
+                    INSERT INTO contacts (user_id, phone_number, name, email)
+                    SELECT DISTINCT ON (s.phone_number) %s, s.phone_number, s.name, s.email
+                    FROM contact_import_staging s
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM do_not_call d
+                        WHERE d.user_id = %s AND d.phone_number = s.phone_number
+                    )
+                    ORDER BY s.phone_number, s.line_no
+                    ON CONFLICT (user_id, phone_number) DO NOTHING
+                """, (user_id, user_id))
+                inserted = cursor.rowcount
+
+            conn.commit()
+            logging.info(f"✅ Imported {inserted} contacts for user {user_id}")
+            return {
+                "valid_rows": staged,
+                "duplicates_in_file": staged - unique_numbers,
+                "do_not_call": do_not_call,
+                "already_exists": unique_numbers - do_not_call - inserted,
+                "inserted": inserted,
+            }
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"❌ Error importing contacts for user {user_id}: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def get_contact(self, user_id: int, contact_id: int):
+        """A user's contact, with an `on_do_not_call` flag"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT c.id, c.phone_number, c.name, c.email, c.created_at,
+                        EXISTS (
+                            SELECT 1 FROM do_not_call d
+                            WHERE d.user_id = c.user_id AND d.phone_number = c.phone_number
+                        ) AS on_do_not_call
+                    FROM contacts c
+                    WHERE c.id = %s AND c.user_id = %s
+                """, (contact_id, user_id))
+                return cursor.fetchone()
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def get_contacts_paginated(self, user_id: int, page: int = 1, page_size: int = 50):
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("SELECT COUNT(*) FROM contacts WHERE user_id = %s", (user_id,))
+                total = cursor.fetchone()["count"]
+                cursor.execute("""
+                    SELECT id, phone_number, name, email, created_at
+                    FROM contacts
+                    WHERE user_id = %s
+                    ORDER BY id
+                    LIMIT %s OFFSET %s
+                """, (user_id, page_size, (page - 1) * page_size))
+                return {"contacts": cursor.fetchall(), "total": total, "page": page, "page_size": page_size}
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def add_do_not_call(self, user_id: int, phone_number: str, reason: str = None) -> bool:
+        """Add an E.164 number to the user's do-not-call list. Returns False if already listed."""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO do_not_call (user_id, phone_number, reason)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (user_id, phone_number) DO NOTHING
+                """, (user_id, phone_number, reason))
+                added = cursor.rowcount == 1
+            conn.commit()
+            return added
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"❌ Error adding do-not-call entry: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def is_do_not_call(self, user_id: int, phone_number: str) -> bool:
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM do_not_call WHERE user_id = %s AND phone_number = %s",
+                    (user_id, phone_number)
+                )
+                return cursor.fetchone() is not None
+        finally:
+            self.release_connection(conn)
+
+    # ==================== IDEMPOTENCY METHODS ====================
+
+    @instrumented
+    def claim_idempotency_key(self, user_id: int, key: str, request_hash: str):
+        """
+        Claim an Idempotency-Key before doing the work.
+        Returns (True, None) if this request owns the key, otherwise
+        (False, existing_row) so the caller can replay or reject. Keys older than
+        IDEMPOTENCY_KEY_TTL_HOURS, and keys left in progress for longer than
+        IDEMPOTENCY_IN_PROGRESS_LEASE_SECONDS, are treated as free.
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    INSERT INTO idempotency_keys (user_id, key, request_hash)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (user_id, key) DO UPDATE
+                    SET request_hash = EXCLUDED.request_hash,
+                        status = 'in_progress',
+                        response_status = NULL,
+                        response_body = NULL,
+                        created_at = CURRENT_TIMESTAMP,
+                        completed_at = NULL
+                    WHERE idempotency_keys.created_at < CURRENT_TIMESTAMP - make_interval(hours => %s)
+                       OR (idempotency_keys.status = 'in_progress'
+                           AND idempotency_keys.created_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                    RETURNING key
+                """, (user_id, key, request_hash, IDEMPOTENCY_KEY_TTL_HOURS, IDEMPOTENCY_IN_PROGRESS_LEASE_SECONDS))
+                if cursor.fetchone():
+                    conn.commit()
+                    return True, None
+
+                cursor.execute("""
+                    SELECT request_hash, status, response_status, response_body, created_at
+                    FROM idempotency_keys
+                    WHERE user_id = %s AND key = %s
+                """, (user_id, key))
+                existing = cursor.fetchone()
+            conn.commit()
+            return False, existing
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"❌ Error claiming idempotency key: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def complete_idempotency_key(self, user_id: int, key: str, response_status: int, response_body: str):
+        """Store the response (JSON text) to replay for retries with the same key"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE idempotency_keys
+                    SET status = 'completed', response_status = %s, response_body = %s,
+                        completed_at = CURRENT_TIMESTAMP
+                    WHERE user_id = %s AND key = %s
+                """, (response_status, response_body, user_id, key))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"❌ Error completing idempotency key: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    @instrumented
+    def release_idempotency_key(self, user_id: int, key: str):
+        """Forget a claimed key whose request failed before doing anything, so it can be retried"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM idempotency_keys WHERE user_id = %s AND key = %s AND status = 'in_progress'",
+                    (user_id, key)
+                )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"❌ Error releasing idempotency key: {e}")
+        finally:
+            self.release_connection(conn)
+
+    def purge_expired_idempotency_keys(self) -> int:
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM idempotency_keys WHERE created_at < CURRENT_TIMESTAMP - make_interval(hours => %s)",
+                    (IDEMPOTENCY_KEY_TTL_HOURS,)
+                )
+                deleted = cursor.rowcount
+            conn.commit()
+            return deleted
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error purging idempotency keys: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    # ==================== TOKEN REVOCATION METHODS ====================
+
+    def revoke_token(self, jti: str, user_id: int, expires_at) -> bool:
+        """Record a revoked access token; kept only until it would have expired anyway"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO revoked_tokens (jti, user_id, expires_at)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (jti) DO NOTHING
+                    """,
+                    (jti, user_id, expires_at)
+                )
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error revoking token: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    def get_revoked_token_ids(self) -> list:
+        """jti of every revoked token that has not expired yet"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT jti FROM revoked_tokens WHERE expires_at > CURRENT_TIMESTAMP")
+                return [row[0] for row in cursor.fetchall()]
+        finally:
+            self.release_connection(conn)
+
+    # ==================== AUTH SESSION METHODS ====================
+
+    def create_auth_session(self, session_id: str, user_id: int, refresh_hash: str, expires_in_days: int, user_agent: str = None):
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO auth_sessions (id, user_id, refresh_hash, user_agent, expires_at)
+                    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(days => %s))
+                    """,
+                    (session_id, user_id, refresh_hash, (user_agent or "")[:256] or None, expires_in_days)
+                )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error creating auth session: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    def rotate_auth_session(self, session_id: str, presented_hash: str, new_hash: str):
+        """
+        Swap the session's refresh token for a new one in a single indexed UPDATE.
+        Returns {"user_id", "generation"} or None. Replaying the previous
+        (already rotated) token outside the grace window revokes the session.
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    """
+                    UPDATE auth_sessions
+                    SET refresh_hash = %s, previous_hash = refresh_hash,
+                        generation = generation + 1, rotated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND refresh_hash = %s
+                      AND revoked_at IS NULL AND expires_at > CURRENT_TIMESTAMP
+                    RETURNING user_id, generation
+                    """,
+                    (new_hash, session_id, presented_hash)
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute(
+                        """
+                        UPDATE auth_sessions SET revoked_at = CURRENT_TIMESTAMP
+                        WHERE id = %s AND revoked_at IS NULL AND previous_hash = %s
+                          AND rotated_at <= CURRENT_TIMESTAMP - make_interval(secs => %s)
+                        RETURNING user_id
+                        """,
+                        (session_id, presented_hash, REFRESH_REUSE_GRACE_SECONDS)
+                    )
+                    reused = cursor.fetchone()
+                    if reused:
+                        logging.warning(f"⚠️ Refresh token reuse on session {session_id} (user {reused['user_id']}) - session revoked")
+            conn.commit()
+            return row
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error rotating auth session: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    def revoke_auth_session(self, session_id: str, user_id: int) -> bool:
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    UPDATE auth_sessions SET revoked_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND user_id = %s AND revoked_at IS NULL
+                    """,
+                    (session_id, user_id)
+                )
+                revoked = cursor.rowcount > 0
+            conn.commit()
+            return revoked
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error revoking auth session: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    def purge_expired_auth_sessions(self) -> int:
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM auth_sessions WHERE expires_at <= CURRENT_TIMESTAMP OR revoked_at < CURRENT_TIMESTAMP - INTERVAL '1 day'"
+                )
+                deleted = cursor.rowcount
+            conn.commit()
+            return deleted
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error purging auth sessions: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    def purge_expired_revoked_tokens(self) -> int:
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM revoked_tokens WHERE expires_at <= CURRENT_TIMESTAMP")
+                deleted = cursor.rowcount
+            conn.commit()
+            return deleted
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error purging revoked tokens: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    # ==================== PARTITION MAINTENANCE METHODS ====================
+
+    def ensure_call_history_partitions(self, months_ahead: int = 3) -> list:
+        """
+        Create any missing monthly call_history partitions from the current
+        month up to `months_ahead`. The existence check is a catalog lookup, so
+        this is cheap to call periodically; DDL only runs when a month is
+        missing and only in the worker that wins the advisory lock.
+        Returns the names of partitions created.
+        """
+        created = []
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT month::date
+                    FROM generate_series(
+                        date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE 'UTC'),
+                        date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE 'UTC') + make_interval(months => %s),
+                        interval '1 month'
+                    ) AS month
+                    WHERE to_regclass(format('call_history_p%%s', to_char(month, 'YYYYMM'))) IS NULL
+                """, (months_ahead,))
+                missing = [row[0] for row in cursor.fetchall()]
+
+                if missing:
+                    cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (PARTITION_LOCK_ID,))
+                    if cursor.fetchone()[0]:
+                        for month in missing:
+                            cursor.execute("SELECT ensure_call_history_partition(%s)", (month,))
+                            created.append(cursor.fetchone()[0])
+            conn.commit()
+            if created:
+                logging.info(f"✅ Created call_history partitions: {created}")
+            return created
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error creating call_history partitions: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    def list_call_history_partitions(self) -> list:
+        """Monthly partitions as [{"name": ..., "month": date}], oldest first"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT c.relname
+                    FROM pg_inherits i
+                    JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = 'call_history'::regclass
+                    ORDER BY c.relname
+                """)
+                partitions = []
+                for (name,) in cursor.fetchall():
+                    match = _PARTITION_NAME.match(name)
+                    if match:
+                        month = datetime(int(match.group(1)), int(match.group(2)), 1).date()
+                        partitions.append({"name": name, "month": month})
+                return partitions
+        finally:
+            self.release_connection(conn)
+
+    def get_partition_inline_artifacts(self, partition: str) -> list:
+        """Rows of a partition that still hold recording bytes or a transcript inline (no payloads)"""
+        if not _PARTITION_NAME.match(partition):
+            raise ValueError(f"Not a call_history partition: {partition}")
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(sql.SQL("""
+                    SELECT ch.call_id, ch.recording_blob, ch.transcript_blob,
+                        r.call_id IS NOT NULL AS has_recording,
+                        t.call_id IS NOT NULL AS has_transcript
+                    FROM {} ch
+                    LEFT JOIN call_recordings r ON r.call_id = ch.call_id
+                    LEFT JOIN call_transcripts t ON t.call_id = ch.call_id
+                    WHERE r.call_id IS NOT NULL OR t.call_id IS NOT NULL
+                """).format(sql.Identifier(partition)))
+                return cursor.fetchall()
+        finally:
+            self.release_connection(conn)
+
+    def get_transcript_text(self, call_id: str):
+        """Transcript JSON text as rendered by Postgres (None if missing)"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT transcript::text FROM call_transcripts WHERE call_id = %s", (call_id,))
+                row = cursor.fetchone()
+                return row[0] if row else None
+        finally:
+            self.release_connection(conn)
+
+    def clear_inline_artifacts(self, call_id: str, recording_blob: str = None, transcript_blob: str = None):
+        """
+        Drop inline recording bytes / transcript once they live in the blob store.
+        Only the artifacts whose blob name is given are cleared.
+        """
+        set_clauses = ["archived_at = CURRENT_TIMESTAMP"]
+        values = []
+        if recording_blob:
+            set_clauses.append("recording_blob = %s")
+            values.append(recording_blob)
+        if transcript_blob:
+            set_clauses.append("transcript_blob = %s")
+            values.append(transcript_blob)
+
+        where, params = call_id_filter(call_id)
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE call_history SET {', '.join(set_clauses)} WHERE {where}",
+                    (*values, *params)
+                )
+                if recording_blob:
+                    cursor.execute("DELETE FROM call_recordings WHERE call_id = %s", (call_id,))
+                    cursor.execute("DELETE FROM call_recording_renditions WHERE call_id = %s", (call_id,))
+                if transcript_blob:
+                    cursor.execute("DELETE FROM call_transcripts WHERE call_id = %s", (call_id,))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error clearing inline artifacts for {call_id}: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    def drop_call_history_partition(self, partition: str):
+        """Detach and drop a monthly partition (rollups in call_stats_daily are kept)"""
+        if not _PARTITION_NAME.match(partition):
+            raise ValueError(f"Not a call_history partition: {partition}")
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                # Side tables have no FK to the partitioned table - remove their rows first
+                for side_table in ("call_transcripts", "call_events", "call_recordings",
+                                   "call_recording_renditions", "call_recording_waveforms", "call_agent_events"):
+                    cursor.execute(sql.SQL("DELETE FROM {} WHERE call_id IN (SELECT call_id FROM {})").format(
+                        sql.Identifier(side_table), sql.Identifier(partition)
+                    ))
+                cursor.execute(sql.SQL("ALTER TABLE call_history DETACH PARTITION {}").format(sql.Identifier(partition)))
+                cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(partition)))
+            conn.commit()
+            logging.info(f"🗑️ Dropped call_history partition {partition}")
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error dropping partition {partition}: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
+
+    # ==================== CALL ANALYTICS METHODS ====================
+
+    @instrumented
+    def finalize_call(self, call_id: str, final_status: str, updates: dict = None, conn=None):
+        """
+        Write a call's final status/duration and fold it into call_stats_daily
+        in the same transaction.
+
+        The row is locked and the rollup receives only the *delta* against
+        what was previously counted, so repeated webhooks (room_finished +
+        participant_left, late duration corrections) never double count.
+        Returns True if this call transitioned to a final status now.
+        Pass `conn` to run inside a PGDB.transaction().
+        """
+        updates = dict(updates or {})
+        where, params = call_id_filter(call_id)
+        try:
+            with self._write_cursor(conn) as cursor:
+                cursor.execute(f"""
+                    SELECT status, duration, user_id, voice_name, language, created_at,
+                           billable_seconds, answered
+                    FROM call_history
+                    WHERE {where}
+                    FOR UPDATE
+                """, params)
+                row = cursor.fetchone()
+                if not row:
+                    logging.warning(f"Call {call_id} not found for finalize")
+                    return False
+
+                old_status, old_duration, user_id, voice_name, language, created_at, old_billable, answered = row
+                was_final = old_status in FINAL_CALL_STATUSES
+                if was_final and not (old_status == "unanswered" and final_status == "completed" and answered):
+                    # never flip an already-final call - except when answer evidence arrived late
+                    final_status = old_status
+                updates["status"] = final_status
+
+                new_duration = updates.get("duration", old_duration) or 0
+                was_answered = was_final and old_status == "completed"
+                is_answered = final_status == "completed"
+                # ✅ Billed per started second of talk time
+                new_billable = math.ceil(new_duration) if is_answered else 0
+                updates["billable_seconds"] = new_billable
+
+                delta_total = 0 if was_final else 1
+                delta_answered = int(is_answered) - int(was_answered)
+                delta_duration = (new_duration if is_answered else 0) - ((old_duration or 0) if was_answered else 0)
+                delta_billable = new_billable - ((old_billable or 0) if was_answered else 0)
+
+                for key in updates:
+                    if not key.replace('_', '').isalnum():
+                        raise ValueError(f"Invalid column name: {key}")
+                set_sql = ", ".join(f"{key} = %s" for key in updates)
+                cursor.execute(
+                    f"UPDATE call_history SET {set_sql}, updated_at = CURRENT_TIMESTAMP WHERE {where}",
+                    (*updates.values(), *params)
+                )
+
+                if delta_total or delta_answered or delta_duration or delta_billable:
+                    cursor.execute("""
+                        INSERT INTO call_stats_daily (
+                            user_id, day, voice_name, language,
+                            total_calls, answered_calls, total_duration, billable_seconds
+                        )
+                        VALUES (%s, (%s AT TIME ZONE 'UTC')::date, %s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (user_id, day, voice_name, language)
+                        DO UPDATE SET total_calls = call_stats_daily.total_calls + EXCLUDED.total_calls,
+                                      answered_calls = call_stats_daily.answered_calls + EXCLUDED.answered_calls,
+                                      total_duration = call_stats_daily.total_duration + EXCLUDED.total_duration,
+                                      billable_seconds = call_stats_daily.billable_seconds + EXCLUDED.billable_seconds,
+                                      updated_at = CURRENT_TIMESTAMP
+                    """, (
+                        user_id, created_at, voice_name or '', language or '',
+                        delta_total, delta_answered, delta_duration, delta_billable
+                    ))
+
+            logging.info(f"✅ Finalized call {call_id}: {final_status}")
+            return not was_final
+        except Exception as e:
+            logging.error(f"Error finalizing call {call_id}: {e}")
+            raise
+
+    @instrumented
+    def settle_call(self, call_id: str, ended_at=None):
+        """
+        Event-driven finalize: status, duration and billable seconds from the
+        LiveKit event timestamps already on the row, never the server clock.
+
+        ended_at is the event time of an end signal (participant_left /
+        room_finished); the earliest one seen wins, so late or out-of-order
+        webhooks only ever correct the result. Called without ended_at it
+        recomputes an already-ended call (e.g. answer evidence arrived late)
+        and does nothing for a call still in progress.
+        Returns the final status, or None.
+        """
+        where, params = call_id_filter(call_id)
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT answered, answered_at, started_at, created_at, ended_at
+                    FROM call_history
+                    WHERE {where}
+                    FOR UPDATE
+                """, params)
+                row = cursor.fetchone()
+            if not row:
+                logging.warning(f"Call {call_id} not found to settle")
+                return None
+
+            answered, answered_at, started_at, created_at, old_ended_at = row
+            ended = min(old_ended_at, ended_at) if (old_ended_at and ended_at) else (ended_at or old_ended_at)
+            if ended is None:
+                return None
+
+            started = started_at or created_at
+            duration = 0
+            if answered:
+                talk_started = answered_at or started
+                duration = round(max(0.0, (ended - talk_started).total_seconds()), 1)
+
+            final_status = "completed" if answered else "unanswered"
+            self.finalize_call(call_id, final_status, {
+                "duration": duration,
+                "ended_at": ended,
+                "started_at": started,
+            }, conn=conn)
+            return final_status
+
+    @instrumented
+    def get_call_stats(self, user_id: int, from_date: str = None, to_date: str = None, group_by: str = None):
+        """
+        Aggregate call_stats_daily for a user. Reads rollups only, so the cost
+        depends on days x voices x languages in range, never on call volume.
+
+        group_by: None (single total), "day", "voice" or "language"
+        """
+        group_columns = {
+            None: None,
+            "day": "day",
+            "voice": "voice_name",
+            "language": "language",
+        }
+        if group_by not in group_columns:
+            raise ValueError(f"Invalid group_by: {group_by}")
+        group_column = group_columns[group_by]
+
+        select_group = f"{group_column} AS bucket," if group_column else ""
+        group_sql = f"GROUP BY {group_column} ORDER BY {group_column}" if group_column else ""
+
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"""
+                    SELECT {select_group}
+                        COALESCE(SUM(total_calls), 0) AS total_calls,
+                        COALESCE(SUM(answered_calls), 0) AS answered_calls,
+                        COALESCE(SUM(total_duration), 0) AS total_duration,
+                        COALESCE(SUM(billable_seconds), 0) AS billable_seconds,
+                        COALESCE(SUM(bookings), 0) AS bookings,
+                        COUNT(DISTINCT day) AS active_days
+                    FROM call_stats_daily
+                    WHERE user_id = %s
+                      AND (%s::date IS NULL OR day >= %s::date)
+                      AND (%s::date IS NULL OR day <= %s::date)
+                    {group_sql}
+                """, (user_id, from_date, from_date, to_date, to_date))
+                return cursor.fetchall()
         finally:
             self.release_connection(conn)
 
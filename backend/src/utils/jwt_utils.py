@@ -1,24 +1,137 @@
+import hashlib
 import os
-from datetime import datetime, timedelta
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from jose import jwt, JWTError
 import logging
 
 # Use environment variable for security, fallback to a default for dev
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your_dev_secret_key")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 500  
+# ✅ Short-lived access tokens; clients renew them with a refresh token (POST /api/token/refresh)
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+
+# ✅ Verified-token cache: HMAC check + claim parsing once per token, not per request
+TOKEN_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+REVOCATION_REFRESH_INTERVAL = float(os.getenv("JWT_REVOCATION_REFRESH_INTERVAL", "30"))
+
+_token_cache = OrderedDict()  # token -> verified payload (only until its exp)
+_token_cache_lock = threading.Lock()
+_revoked_jtis = frozenset()   # replaced wholesale on refresh, so reads need no lock
+_local_revocations = {}       # jti -> time revoked in this worker (survives a racing refresh)
+
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# ==================== REFRESH TOKENS ====================
+# Opaque "<session id>.<secret>": the session id is the auth_sessions primary key
+# (one indexed lookup), only a SHA-256 of the secret is stored - no bcrypt on refresh.
+
+def hash_refresh_secret(secret: str) -> str:
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+
+def new_refresh_token(session_id: str):
+    """Returns (refresh token, hash to store for it)"""
+    secret = secrets.token_urlsafe(32)
+    return f"{session_id}.{secret}", hash_refresh_secret(secret)
+
+
+def parse_refresh_token(token: str):
+    """(session id, secret hash), or None if the token is malformed"""
+    session_id, _, secret = (token or "").partition(".")
+    if not session_id or not secret:
+        return None
+    return session_id, hash_refresh_secret(secret)
+
+
 def decode_access_token(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except JWTError as e:
-        logging.error(f"JWT decode error: {e}")
-        return None
\ No newline at end of file
+    """
+    Verified claims for `token`, or None if it is invalid, expired or revoked.
+    Treat the returned dict as read-only - it is shared through the cache.
+    """
+    now = time.time()
+    with _token_cache_lock:
+        payload = _token_cache.get(token)
+        if payload is not None:
+            if payload["exp"] > now:
+                _token_cache.move_to_end(token)
+            else:
+                del _token_cache[token]
+                payload = None
+
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError as e:
+            logging.error(f"JWT decode error: {e}")
+            return None
+        if "exp" in payload:
+            with _token_cache_lock:
+                _token_cache[token] = payload
+                if len(_token_cache) > TOKEN_CACHE_SIZE:
+                    _token_cache.popitem(last=False)
+
+    if payload.get("jti") in _revoked_jtis:
+        logging.warning(f"Revoked token used (jti={payload['jti']})")
+        return None
+    return payload
+
+
+# ==================== REVOCATION ====================
+
+def is_revoked(jti: str) -> bool:
+    return jti in _revoked_jtis
+
+
+def set_revoked_jtis(jtis):
+    """Replace the revocation set (periodic refresh from revoked_tokens)"""
+    global _revoked_jtis
+    cutoff = time.time() - 2 * REVOCATION_REFRESH_INTERVAL
+    for jti, revoked_at in list(_local_revocations.items()):
+        if revoked_at < cutoff:
+            _local_revocations.pop(jti, None)
+    _revoked_jtis = frozenset(jtis) | frozenset(_local_revocations)
+
+
+def add_revoked_jti(jti: str):
+    """Revoke locally right away; other workers pick it up on their next refresh"""
+    global _revoked_jtis
+    _local_revocations[jti] = time.time()
+    _revoked_jtis = _revoked_jtis | {jti}
+
+
+def revoke_token(payload: dict):
+    """Persist a token's revocation (until it would have expired anyway)"""
+    from src.utils.db import PGDB
+
+    jti = payload.get("jti")
+    if not jti:
+        return False
+    PGDB().revoke_token(jti, int(payload["sub"]), datetime.fromtimestamp(payload["exp"], tz=timezone.utc))
+    add_revoked_jti(jti)
+    return True
+
+
+async def run_revocation_refresh(interval_seconds: float = REVOCATION_REFRESH_INTERVAL):
+    """Background loop started from the app lifespan: keep the revocation set in sync"""
+    import asyncio
+    from src.utils.db import PGDB
+
+    db = PGDB()
+    while True:
+        try:
+            set_revoked_jtis(await asyncio.to_thread(db.get_revoked_token_ids))
+        except Exception as e:
+            logging.error(f"Token revocation refresh failed: {e}")
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,151 @@
+"""
+Scheduled database maintenance.
+
+    python -m src.utils.maintenance partitions [--months-ahead 3]
+    python -m src.utils.maintenance retention --older-than-months 12 [--mode externalize|drop] [--dry-run]
+
+partitions: pre-create monthly call_history partitions (also runs periodically
+            inside the app, see run_partition_maintenance).
+retention:  for partitions older than the cutoff, either move inline
+            recordings/transcripts to the GCS bucket (externalize, default)
+            or drop the whole partition (drop). Rollups in call_stats_daily
+            are kept either way.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from src.utils.db import PGDB
+
+load_dotenv()
+
+db = PGDB()
+
+ARCHIVE_PREFIX = os.getenv("ARCHIVE_BLOB_PREFIX", "archive")
+
+
+def cold_partitions(older_than_months: int) -> list:
+    """Partitions whose whole month ended more than `older_than_months` ago"""
+    now = datetime.now(timezone.utc)
+    cutoff_index = now.year * 12 + (now.month - 1) - older_than_months
+    return [
+        p for p in db.list_call_history_partitions()
+        if p["month"].year * 12 + (p["month"].month - 1) < cutoff_index
+    ]
+
+
+def externalize_partition(partition: str, bucket, dry_run: bool = False) -> dict:
+    """
+    Move a partition's inline recordings/transcripts to the blob store.
+    Artifacts whose original agent upload still exists in the bucket are just
+    cleared; anything else is uploaded under ARCHIVE_BLOB_PREFIX first.
+    """
+    stats = {"calls": 0, "recordings": 0, "transcripts": 0, "uploaded": 0}
+    for row in db.get_partition_inline_artifacts(partition):
+        call_id = row["call_id"]
+        recording_blob = transcript_blob = None
+
+        if row["has_recording"]:
+            recording_blob = row["recording_blob"]
+            if not (recording_blob and bucket.blob(recording_blob).exists()):
+                recording_blob = f"{ARCHIVE_PREFIX}/recordings/{call_id}.ogg"
+                if not dry_run:
+                    data, content_type, _ = db.get_recording_blob(call_id)
+                    bucket.blob(recording_blob).upload_from_string(bytes(data), content_type=content_type or "audio/ogg")
+                stats["uploaded"] += 1
+            stats["recordings"] += 1
+
+        if row["has_transcript"]:
+            transcript_blob = row["transcript_blob"]
+            if not (transcript_blob and bucket.blob(transcript_blob).exists()):
+                transcript_blob = f"{ARCHIVE_PREFIX}/transcripts/{call_id}.json"
+                if not dry_run:
+                    bucket.blob(transcript_blob).upload_from_string(
+                        db.get_transcript_text(call_id), content_type="application/json"
+                    )
+                stats["uploaded"] += 1
+            stats["transcripts"] += 1
+
+        if not dry_run:
+            db.clear_inline_artifacts(call_id, recording_blob=recording_blob, transcript_blob=transcript_blob)
+        stats["calls"] += 1
+
+    logging.info(f"📦 {'[dry-run] ' if dry_run else ''}Externalized {partition}: {stats}")
+    return stats
+
+
+def apply_retention(older_than_months: int, mode: str = "externalize", dry_run: bool = False) -> dict:
+    partitions = cold_partitions(older_than_months)
+    results = {}
+    if mode == "drop":
+        for p in partitions:
+            if not dry_run:
+                db.drop_call_history_partition(p["name"])
+            results[p["name"]] = "dropped"
+        return results
+
+    from src.utils.utils import get_gcs_client
+
+    bucket = get_gcs_client().bucket(os.getenv("GOOGLE_BUCKET_NAME"))
+    for p in partitions:
+        results[p["name"]] = externalize_partition(p["name"], bucket, dry_run)
+    return results
+
+
+async def run_partition_maintenance(interval_seconds: float = 6 * 3600, months_ahead: int = 3):
+    """
+    Background loop started from the app lifespan: keep future partitions in
+    place and purge expired idempotency keys, token revocations and auth sessions
+    """
+    while True:
+        try:
+            await asyncio.to_thread(db.ensure_call_history_partitions, months_ahead)
+        except Exception as e:
+            logging.error(f"Partition maintenance failed: {e}")
+        try:
+            purged = await asyncio.to_thread(db.purge_expired_idempotency_keys)
+            if purged:
+                logging.info(f"🧹 Purged {purged} expired idempotency keys")
+        except Exception as e:
+            logging.error(f"Idempotency key purge failed: {e}")
+        try:
+            await asyncio.to_thread(db.purge_expired_revoked_tokens)
+            await asyncio.to_thread(db.purge_expired_auth_sessions)
+        except Exception as e:
+            logging.error(f"Token/session purge failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    partitions = sub.add_parser("partitions", help="Create upcoming monthly call_history partitions")
+    partitions.add_argument("--months-ahead", type=int, default=3)
+
+    retention = sub.add_parser("retention", help="Archive or drop cold call_history partitions")
+    retention.add_argument("--older-than-months", type=int, required=True)
+    retention.add_argument("--mode", choices=["externalize", "drop"], default="externalize")
+    retention.add_argument("--dry-run", action="store_true")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        if args.command == "partitions":
+            print(f"Created: {db.ensure_call_history_partitions(args.months_ahead) or 'none'}")
+        elif args.command == "retention":
+            for name, result in apply_retention(args.older_than_months, args.mode, args.dry_run).items():
+                print(f"{name}: {result}")
+    finally:
+        db.close_pool()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+In-process metrics registry (per worker).
+
+    from src.utils.metrics import metrics
+    metrics.inc("rate_limit_rejected_total", rule="login")
+
+Exposed at GET /api/admin/metrics as JSON, or in Prometheus text format with
+?format=prometheus.
+"""
+import threading
+import time
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, ((label, value), ...)) -> float
+        self._gauges = {}    # name -> callable returning a number or {label_value: number}
+        self.started_at = time.time()
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def register_gauge(self, name: str, callback):
+        """`callback()` is evaluated at scrape time"""
+        self._gauges[name] = callback
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        result = {"uptime_seconds": round(time.time() - self.started_at, 1), "counters": {}, "gauges": {}}
+        for (name, labels), value in sorted(counters.items()):
+            result["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for name, callback in self._gauges.items():
+            try:
+                result["gauges"][name] = callback()
+            except Exception as e:
+                result["gauges"][name] = {"error": str(e)}
+        return result
+
+    def render_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+        for name, samples in snapshot["counters"].items():
+            lines.append(f"# TYPE {name} counter")
+            for sample in samples:
+                lines.append(f"{name}{_format_labels(sample['labels'])} {sample['value']}")
+        for name, value in snapshot["gauges"].items():
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for key, number in value.items():
+                    if isinstance(number, (int, float)):
+                        lines.append(f'{name}{{key="{key}"}} {number}')
+            elif isinstance(value, (int, float)):
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return "{" + body + "}"
+
+
+metrics = MetricsRegistry()
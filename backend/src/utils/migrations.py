@@ -0,0 +1,640 @@
+"""
+Versioned schema migrations.
+
+Run once per deploy (before starting the app):
+
+    python -m src.utils.migrations upgrade
+    python -m src.utils.migrations status
+
+The app itself never runs DDL on startup; it only checks that the database is
+at SCHEMA_VERSION (see PGDB.check_schema_version).
+"""
+import argparse
+import logging
+import os
+import sys
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Arbitrary constant so concurrent deploys serialize on the same advisory lock
+MIGRATION_LOCK_ID = 727_001
+
+# ==================== MIGRATIONS ====================
+# Each entry: (version, description, [SQL statements]).
+# Never edit a migration that has shipped - append a new one instead.
+
+MIGRATIONS = [
+    (1, "baseline schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(100),
+            email VARCHAR(100) UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            first_name VARCHAR(100),
+            last_name VARCHAR(100),
+            is_admin BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS call_history (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            call_id TEXT NOT NULL UNIQUE,
+            status TEXT,
+            duration DOUBLE PRECISION,
+            transcript JSONB,
+            summary TEXT,
+            recording_url TEXT,
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMPTZ NULL,
+            ended_at TIMESTAMPTZ NULL,
+            voice_id TEXT,
+            voice_name TEXT,
+            from_number TEXT NULL,
+            to_number TEXT NULL,
+            transcript_url TEXT,
+            transcript_blob TEXT,
+            recording_blob TEXT,
+            events_log JSONB DEFAULT '[]',
+            agent_events JSONB DEFAULT '[]',
+            recording_blob_data BYTEA NULL,
+            recording_size INTEGER NULL,
+            recording_content_type VARCHAR(100) DEFAULT 'audio/ogg'
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_call_history_events_log ON call_history USING GIN (events_log);",
+        "CREATE INDEX IF NOT EXISTS idx_call_history_agent_events ON call_history USING GIN (agent_events);",
+        """
+        CREATE TABLE IF NOT EXISTS appointments (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            appointment_date DATE NOT NULL,
+            start_time TIME NOT NULL,
+            end_time TIME NOT NULL,
+            attendee_email VARCHAR(255) NOT NULL,
+            attendee_name VARCHAR(255),
+            title TEXT NOT NULL,
+            description TEXT,
+            notes TEXT,
+            status VARCHAR(50) DEFAULT 'scheduled',
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_prompts (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL UNIQUE REFERENCES users(id) ON DELETE CASCADE,
+            system_prompt TEXT NOT NULL DEFAULT 'You are SUMA, a helpful AI assistant. Be professional and courteous in all interactions.',
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+        """,
+    ]),
+    (2, "pre-compressed transcript payloads", [
+        # gzip of the exact /calls/{call_id}/transcript response body, written with the transcript
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS transcript_gzip BYTEA NULL;",
+    ]),
+    (3, "artifact checksums and updated_at for HTTP caching", [
+        """
+        ALTER TABLE call_history
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS transcript_checksum TEXT NULL,
+            ADD COLUMN IF NOT EXISTS recording_checksum TEXT NULL;
+        """,
+        """
+        UPDATE call_history
+        SET updated_at = COALESCE(ended_at, started_at, created_at, CURRENT_TIMESTAMP),
+            transcript_checksum = CASE WHEN transcript IS NOT NULL
+                THEN encode(sha256(convert_to(transcript::text, 'UTF8')), 'hex') END,
+            recording_checksum = CASE WHEN recording_blob_data IS NOT NULL
+                THEN encode(sha256(recording_blob_data), 'hex') END;
+        """,
+    ]),
+    (4, "call_stats_daily rollups", [
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS language TEXT NULL;",
+        "ALTER TABLE appointments ADD COLUMN IF NOT EXISTS call_id TEXT NULL;",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_call_id ON appointments (call_id) WHERE call_id IS NOT NULL;",
+        # One row per user/day/voice/language, maintained incrementally when a call is finalized
+        """
+        CREATE TABLE IF NOT EXISTS call_stats_daily (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            day DATE NOT NULL,
+            voice_name TEXT NOT NULL DEFAULT '',
+            language TEXT NOT NULL DEFAULT '',
+            total_calls INTEGER NOT NULL DEFAULT 0,
+            answered_calls INTEGER NOT NULL DEFAULT 0,
+            total_duration DOUBLE PRECISION NOT NULL DEFAULT 0,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, day, voice_name, language)
+        );
+        """,
+        # Backfill from history that was finalized before rollups existed
+        """
+        INSERT INTO call_stats_daily (user_id, day, voice_name, language, total_calls, answered_calls, total_duration)
+        SELECT user_id,
+               (created_at AT TIME ZONE 'UTC')::date,
+               COALESCE(voice_name, ''),
+               COALESCE(language, ''),
+               COUNT(*),
+               COUNT(*) FILTER (WHERE status = 'completed'),
+               COALESCE(SUM(duration) FILTER (WHERE status = 'completed'), 0)
+        FROM call_history
+        WHERE status IN ('completed', 'unanswered')
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (user_id, day, voice_name, language) DO NOTHING;
+        """,
+    ]),
+    (5, "monthly range partitioning of call_history on created_at", [
+        # Creates (if missing) the partition holding `month_start`'s month, bounds in UTC
+        """
+        CREATE OR REPLACE FUNCTION ensure_call_history_partition(month_start DATE) RETURNS TEXT AS $$
+        DECLARE
+            start_date DATE := date_trunc('month', month_start)::date;
+            end_date DATE := (date_trunc('month', month_start) + interval '1 month')::date;
+            partition_name TEXT := format('call_history_p%s', to_char(start_date, 'YYYYMM'));
+        BEGIN
+            IF to_regclass(partition_name) IS NULL THEN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF call_history FOR VALUES FROM (%L) TO (%L)',
+                    partition_name,
+                    start_date::timestamp AT TIME ZONE 'UTC',
+                    end_date::timestamp AT TIME ZONE 'UTC'
+                );
+            END IF;
+            RETURN partition_name;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        "ALTER SEQUENCE call_history_id_seq OWNED BY NONE;",
+        "ALTER TABLE call_history RENAME TO call_history_unpartitioned;",
+        "UPDATE call_history_unpartitioned SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;",
+        """
+        CREATE TABLE call_history (LIKE call_history_unpartitioned INCLUDING DEFAULTS)
+        PARTITION BY RANGE (created_at);
+        """,
+        "ALTER TABLE call_history ALTER COLUMN created_at SET NOT NULL;",
+        # Safety net for rows outside the pre-created months
+        "CREATE TABLE call_history_default PARTITION OF call_history DEFAULT;",
+        """
+        DO $$
+        DECLARE
+            month DATE;
+        BEGIN
+            FOR month IN
+                SELECT generate_series(
+                    date_trunc('month', COALESCE(
+                        (SELECT MIN(created_at) FROM call_history_unpartitioned),
+                        CURRENT_TIMESTAMP
+                    ) AT TIME ZONE 'UTC'),
+                    date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE 'UTC') + interval '3 months',
+                    interval '1 month'
+                )::date
+            LOOP
+                PERFORM ensure_call_history_partition(month);
+            END LOOP;
+        END $$;
+        """,
+        "INSERT INTO call_history SELECT * FROM call_history_unpartitioned;",
+        "DROP TABLE call_history_unpartitioned;",
+        "ALTER SEQUENCE call_history_id_seq OWNED BY call_history.id;",
+        # Unique constraints on a partitioned table must include the partition key.
+        # call_id stays unique in practice because ids are generated per call.
+        "ALTER TABLE call_history ADD CONSTRAINT call_history_pkey PRIMARY KEY (id, created_at);",
+        "ALTER TABLE call_history ADD CONSTRAINT call_history_call_id_key UNIQUE (call_id, created_at);",
+        """
+        ALTER TABLE call_history ADD CONSTRAINT call_history_user_id_fkey
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
+        """,
+        # Set when the retention job moves a row's recording/transcript to the blob store
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS archived_at TIMESTAMPTZ NULL;",
+        "CREATE INDEX IF NOT EXISTS idx_call_history_user_created ON call_history (user_id, created_at DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_call_history_events_log ON call_history USING GIN (events_log);",
+        "CREATE INDEX IF NOT EXISTS idx_call_history_agent_events ON call_history USING GIN (agent_events);",
+    ]),
+    (6, "move transcript, events and recording bytes out of call_history", [
+        # 1:1 side tables keyed by call_id. call_history keeps only hot scalar
+        # columns, so webhook status updates rewrite a small tuple (and can be
+        # HOT updates) instead of one that drags JSONB/BYTEA along.
+        # No FK to call_history: a partitioned table has no unique call_id.
+        """
+        CREATE TABLE IF NOT EXISTS call_transcripts (
+            call_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            transcript JSONB NOT NULL,
+            transcript_gzip BYTEA NULL,
+            checksum TEXT NULL,
+            updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS call_events (
+            call_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            events_log JSONB NOT NULL DEFAULT '[]',
+            agent_events JSONB NOT NULL DEFAULT '[]',
+            updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS call_recordings (
+            call_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            data BYTEA NOT NULL,
+            size INTEGER NOT NULL,
+            content_type VARCHAR(100) DEFAULT 'audio/ogg',
+            checksum TEXT NULL,
+            updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        INSERT INTO call_transcripts (call_id, user_id, transcript, transcript_gzip, checksum, updated_at)
+        SELECT call_id, user_id, transcript, transcript_gzip, transcript_checksum, updated_at
+        FROM call_history
+        WHERE transcript IS NOT NULL
+        ON CONFLICT (call_id) DO NOTHING;
+        """,
+        """
+        INSERT INTO call_events (call_id, user_id, events_log, agent_events, updated_at)
+        SELECT call_id, user_id, COALESCE(events_log, '[]'), COALESCE(agent_events, '[]'), updated_at
+        FROM call_history
+        WHERE COALESCE(events_log, '[]') <> '[]' OR COALESCE(agent_events, '[]') <> '[]'
+        ON CONFLICT (call_id) DO NOTHING;
+        """,
+        """
+        INSERT INTO call_recordings (call_id, user_id, data, size, content_type, checksum, updated_at)
+        SELECT call_id, user_id, recording_blob_data,
+               COALESCE(recording_size, octet_length(recording_blob_data)),
+               recording_content_type, recording_checksum, updated_at
+        FROM call_history
+        WHERE recording_blob_data IS NOT NULL
+        ON CONFLICT (call_id) DO NOTHING;
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_call_transcripts_user ON call_transcripts (user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_call_events_user ON call_events (user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_call_recordings_user ON call_recordings (user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_call_events_events_log ON call_events USING GIN (events_log);",
+        # Drops the GIN indexes on events_log/agent_events along with the columns
+        """
+        ALTER TABLE call_history
+            DROP COLUMN IF EXISTS transcript,
+            DROP COLUMN IF EXISTS transcript_gzip,
+            DROP COLUMN IF EXISTS transcript_checksum,
+            DROP COLUMN IF EXISTS events_log,
+            DROP COLUMN IF EXISTS agent_events,
+            DROP COLUMN IF EXISTS recording_blob_data,
+            DROP COLUMN IF EXISTS recording_size,
+            DROP COLUMN IF EXISTS recording_content_type,
+            DROP COLUMN IF EXISTS recording_checksum;
+        """,
+        # Leave room on each page for HOT updates of status/duration/ended_at.
+        # Storage parameters are per partition: existing ones now, new ones on creation.
+        """
+        DO $$
+        DECLARE
+            partition_name TEXT;
+        BEGIN
+            FOR partition_name IN
+                SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'call_history'::regclass
+            LOOP
+                EXECUTE format('ALTER TABLE %I SET (fillfactor = 85)', partition_name);
+            END LOOP;
+        END $$;
+        """,
+        """
+        CREATE OR REPLACE FUNCTION ensure_call_history_partition(month_start DATE) RETURNS TEXT AS $$
+        DECLARE
+            start_date DATE := date_trunc('month', month_start)::date;
+            end_date DATE := (date_trunc('month', month_start) + interval '1 month')::date;
+            partition_name TEXT := format('call_history_p%s', to_char(start_date, 'YYYYMM'));
+        BEGIN
+            IF to_regclass(partition_name) IS NULL THEN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF call_history FOR VALUES FROM (%L) TO (%L) WITH (fillfactor = 85)',
+                    partition_name,
+                    start_date::timestamp AT TIME ZONE 'UTC',
+                    end_date::timestamp AT TIME ZONE 'UTC'
+                );
+            END IF;
+            RETURN partition_name;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+    ]),
+    (7, "contacts and do-not-call list", [
+        # phone_number is always E.164 (see src/utils/contacts.normalize_phone)
+        """
+        CREATE TABLE IF NOT EXISTS contacts (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            phone_number TEXT NOT NULL,
+            name TEXT NULL,
+            email TEXT NULL,
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, phone_number)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS do_not_call (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            phone_number TEXT NOT NULL,
+            reason TEXT NULL,
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, phone_number)
+        );
+        """,
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS contact_id INTEGER NULL;",
+    ]),
+    (8, "idempotency keys for call initiation", [
+        # One row per (user, Idempotency-Key): claimed before dispatch, then holds the response to replay
+        """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            key TEXT NOT NULL,
+            request_hash TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'in_progress',
+            response_status INTEGER NULL,
+            response_body JSONB NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMPTZ NULL,
+            PRIMARY KEY (user_id, key)
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at);",
+    ]),
+    (9, "created_at index for recent/active call scans", [
+        # created_at is never updated, so this index does not cost HOT updates
+        "CREATE INDEX IF NOT EXISTS idx_call_history_created ON call_history (created_at);",
+    ]),
+    (10, "revoked access tokens", [
+        """
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            jti TEXT PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            expires_at TIMESTAMPTZ NOT NULL,
+            revoked_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires ON revoked_tokens (expires_at);",
+    ]),
+    (11, "refresh-token sessions", [
+        """
+        CREATE TABLE IF NOT EXISTS auth_sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            refresh_hash TEXT NOT NULL,
+            previous_hash TEXT,
+            generation INTEGER NOT NULL DEFAULT 0,
+            user_agent TEXT,
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            rotated_at TIMESTAMPTZ,
+            expires_at TIMESTAMPTZ NOT NULL,
+            revoked_at TIMESTAMPTZ
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_auth_sessions_user ON auth_sessions (user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_auth_sessions_expires ON auth_sessions (expires_at);",
+    ]),
+    (12, "append-only agent telemetry", [
+        """
+        CREATE TABLE IF NOT EXISTS call_agent_events (
+            id BIGSERIAL PRIMARY KEY,
+            call_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            event_type TEXT NOT NULL,
+            event_data JSONB NOT NULL DEFAULT '{}',
+            event_ts TIMESTAMPTZ,
+            received_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_call_agent_events_call ON call_agent_events (call_id, id);",
+        # Carry over what was appended to the call_events.agent_events array
+        """
+        INSERT INTO call_agent_events (call_id, user_id, event_type, event_data, event_ts, received_at)
+        SELECT e.call_id, e.user_id, ev->>'event_type', COALESCE(ev->'event_data', '{}'),
+               CASE WHEN ev->>'timestamp' ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}[T ][0-9]{2}:[0-9]{2}'
+                    THEN (ev->>'timestamp')::timestamptz END,
+               CASE WHEN ev->>'received_at' ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}[T ][0-9]{2}:[0-9]{2}'
+                    THEN (ev->>'received_at')::timestamptz ELSE e.updated_at END AS received_at
+        FROM call_events e, jsonb_array_elements(e.agent_events) AS ev
+        WHERE e.agent_events <> '[]' AND ev->>'event_type' IS NOT NULL
+        ORDER BY e.call_id, received_at;
+        """,
+        "ALTER TABLE call_events DROP COLUMN IF EXISTS agent_events;",
+    ]),
+    (13, "answered flag set from webhook events", [
+        # Constant defaults: no table rewrite
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS answered BOOLEAN NOT NULL DEFAULT FALSE;",
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS answered_at TIMESTAMPTZ NULL;",
+        # Backfill from the logged webhooks (events_log timestamps are naive UTC)
+        """
+        UPDATE call_history ch
+        SET answered = TRUE, answered_at = a.answered_at
+        FROM (
+            SELECT e.call_id,
+                   MIN(CASE WHEN ev->>'timestamp' ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}T'
+                            THEN (ev->>'timestamp')::timestamp AT TIME ZONE 'UTC' END) AS answered_at
+            FROM call_events e, jsonb_array_elements(e.events_log) AS ev
+            WHERE ev->>'event' = 'egress_started'
+               OR (ev->>'event' = 'participant_joined'
+                   AND ev #>> '{data,participant,identity}' LIKE 'sip-%')
+            GROUP BY e.call_id
+        ) a
+        WHERE ch.call_id = a.call_id AND NOT ch.answered;
+        """,
+        """
+        UPDATE call_history
+        SET answered = TRUE, answered_at = COALESCE(answered_at, started_at)
+        WHERE status = 'completed' AND NOT answered;
+        """,
+    ]),
+    (14, "billable seconds", [
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS billable_seconds INTEGER NOT NULL DEFAULT 0;",
+        "ALTER TABLE call_stats_daily ADD COLUMN IF NOT EXISTS billable_seconds BIGINT NOT NULL DEFAULT 0;",
+        """
+        UPDATE call_history SET billable_seconds = CEIL(duration)::integer
+        WHERE status = 'completed' AND duration > 0;
+        """,
+        """
+        UPDATE call_stats_daily s
+        SET billable_seconds = b.billable_seconds
+        FROM (
+            SELECT user_id, (created_at AT TIME ZONE 'UTC')::date AS day,
+                   COALESCE(voice_name, '') AS voice_name, COALESCE(language, '') AS language,
+                   SUM(billable_seconds) AS billable_seconds
+            FROM call_history
+            WHERE status = 'completed'
+            GROUP BY 1, 2, 3, 4
+        ) b
+        WHERE s.user_id = b.user_id AND s.day = b.day
+          AND s.voice_name = b.voice_name AND s.language = b.language;
+        """,
+    ]),
+    (15, "transcoded recording renditions", [
+        """
+        CREATE TABLE IF NOT EXISTS call_recording_renditions (
+            call_id TEXT NOT NULL,
+            rendition TEXT NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            data BYTEA NOT NULL,
+            size INTEGER NOT NULL,
+            content_type VARCHAR(100) NOT NULL,
+            bitrate_kbps INTEGER NULL,
+            checksum TEXT NOT NULL,
+            updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (call_id, rendition)
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_call_recording_renditions_user ON call_recording_renditions (user_id);",
+    ]),
+    (16, "recording waveform peaks", [
+        """
+        CREATE TABLE IF NOT EXISTS call_recording_waveforms (
+            call_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            peaks BYTEA NOT NULL,
+            points INTEGER NOT NULL,
+            duration_ms INTEGER NOT NULL,
+            checksum TEXT NOT NULL,
+            updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_call_recording_waveforms_user ON call_recording_waveforms (user_id);",
+    ]),
+    (17, "artifact readiness status on call_history", [
+        # NULL status = no artifact expected (no blob was reported for the call)
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS transcript_status VARCHAR(16) NULL;",
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS transcript_attempts SMALLINT NOT NULL DEFAULT 0;",
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS transcript_error TEXT NULL;",
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS recording_status VARCHAR(16) NULL;",
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS recording_attempts SMALLINT NOT NULL DEFAULT 0;",
+        "ALTER TABLE call_history ADD COLUMN IF NOT EXISTS recording_error TEXT NULL;",
+        # Backfill: whatever is stored (or archived) is ready; rows reported
+        # before this version have no retry bookkeeping, so the rest failed
+        """
+        UPDATE call_history ch
+        SET transcript_status = CASE
+            WHEN ch.archived_at IS NOT NULL
+              OR EXISTS (SELECT 1 FROM call_transcripts t WHERE t.call_id = ch.call_id) THEN 'ready'
+            ELSE 'failed' END
+        WHERE ch.transcript_blob IS NOT NULL;
+        """,
+        """
+        UPDATE call_history ch
+        SET recording_status = CASE
+            WHEN ch.archived_at IS NOT NULL
+              OR EXISTS (SELECT 1 FROM call_recordings r WHERE r.call_id = ch.call_id) THEN 'ready'
+            ELSE 'failed' END
+        WHERE ch.recording_blob IS NOT NULL;
+        """,
+    ]),
+    (18, "index for reconciling stuck artifact downloads", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_call_history_transcript_inflight ON call_history (updated_at)
+        WHERE transcript_status IN ('pending', 'fetching', 'failed');
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_call_history_recording_inflight ON call_history (updated_at)
+        WHERE recording_status IN ('pending', 'fetching', 'failed');
+        """,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def ensure_schema_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+
+def get_current_version(conn) -> int:
+    """Highest applied migration version (0 if schema_version does not exist yet)"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('schema_version')")
+        if cursor.fetchone()[0] is None:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cursor.fetchone()[0]
+
+
+def upgrade(conn, target: int = None) -> list:
+    """
+    Apply all pending migrations up to `target` (default: latest).
+    Idempotent - safe to run on every deploy. Each migration runs in its own
+    transaction; an advisory lock keeps concurrent runners from racing.
+    Returns the list of applied versions.
+    """
+    target = target or SCHEMA_VERSION
+    applied = []
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    conn.commit()
+    try:
+        with conn.cursor() as cursor:
+            ensure_schema_version_table(cursor)
+        conn.commit()
+
+        current = get_current_version(conn)
+        for version, description, statements in MIGRATIONS:
+            if version <= current or version > target:
+                continue
+            try:
+                with conn.cursor() as cursor:
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                        (version, description)
+                    )
+                conn.commit()
+                applied.append(version)
+                logging.info(f"✅ Applied migration {version}: {description}")
+            except Exception as e:
+                conn.rollback()
+                logging.error(f"❌ Migration {version} ({description}) failed: {e}")
+                raise
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+    return applied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    parser.add_argument("command", choices=["upgrade", "status"], help="upgrade: apply pending migrations; status: show versions")
+    parser.add_argument("--target", type=int, default=None, help="Stop at this version (default: latest)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    try:
+        if args.command == "upgrade":
+            applied = upgrade(conn, args.target)
+            print(f"Schema at version {get_current_version(conn)} (applied: {applied or 'none'})")
+        else:
+            current = get_current_version(conn)
+            print(f"Database version: {current}, code version: {SCHEMA_VERSION}")
+            for version, description, _ in MIGRATIONS:
+                print(f"  [{'x' if version <= current else ' '}] {version}: {description}")
+            return 0 if current >= SCHEMA_VERSION else 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
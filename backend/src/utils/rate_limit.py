@@ -0,0 +1,220 @@
+"""
+Token-bucket rate limiting, applied as ASGI middleware before routing - a
+rejected request never reaches a dependency, bcrypt or the DB pool.
+
+Rules match on path prefix + method and key the bucket by client IP or by the
+caller's verified user id ("user"), falling back to IP when the bearer token
+does not verify. WebSocket handshakes are limited like GET requests.
+
+The client IP is the ASGI peer address, which uvicorn only rewrites from
+X-Forwarded-For for proxies listed in FORWARDED_ALLOW_IPS (see serve.py).
+Defaults are in DEFAULT_RULES; override them with RATE_LIMIT_RULES (JSON list
+of rules, same shape) or turn limiting off with RATE_LIMIT_ENABLED=0.
+
+Backends:
+  local  (default) per-worker buckets in memory - limits are per worker
+  redis  shared buckets (RATE_LIMIT_BACKEND=redis, REDIS_URL) - limits are
+         global across workers and hosts; needs the `redis` package. If Redis
+         is unreachable, requests are let through and counted in metrics.
+"""
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+
+from starlette.datastructures import Headers
+
+from src.utils.jwt_utils import decode_access_token
+from src.utils.metrics import metrics
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_LIMIT = re.compile(r"^\s*(\d+)\s*/\s*(second|minute|hour|day)\s*$")
+
+DEFAULT_RULES = [
+    {"name": "login", "path": "/api/login", "methods": ["POST"], "limit": "10/minute", "key": "ip"},
+    {"name": "register", "path": "/api/register", "methods": ["POST"], "limit": "5/minute", "key": "ip"},
+    {"name": "token_refresh", "path": "/api/token/refresh", "methods": ["POST"], "limit": "30/minute", "key": "ip"},
+    {"name": "agent", "path": "/api/agent/", "limit": "600/minute", "key": "ip"},
+    {"name": "initiate_call", "path": "/api/assistant-initiate-call", "methods": ["POST"], "limit": "30/minute", "key": "user"},
+    {"name": "contacts_import", "path": "/api/contacts/import", "methods": ["POST"], "limit": "10/hour", "key": "user"},
+]
+
+
+def parse_limit(limit: str):
+    """'10/minute' -> (capacity, refill tokens per second)"""
+    match = _LIMIT.match(limit)
+    if not match:
+        raise ValueError(f"Invalid rate limit '{limit}' (expected e.g. '10/minute')")
+    count, period = int(match.group(1)), _PERIODS[match.group(2)]
+    return count, count / period
+
+
+class Rule:
+    def __init__(self, name: str, path: str, limit: str, key: str = "ip", methods=None):
+        if key not in ("ip", "user"):
+            raise ValueError(f"Rate limit rule '{name}': key must be 'ip' or 'user'")
+        self.name = name
+        self.path = path
+        self.limit = limit
+        self.key = key
+        self.methods = {m.upper() for m in methods} if methods else None
+        self.capacity, self.refill_rate = parse_limit(limit)
+
+    def matches(self, method: str, path: str) -> bool:
+        if self.methods and method not in self.methods:
+            return False
+        if self.path.endswith("/"):
+            return path.startswith(self.path)
+        return path == self.path or path == self.path + "/"
+
+
+def load_rules():
+    raw = os.getenv("RATE_LIMIT_RULES")
+    rules = json.loads(raw) if raw else DEFAULT_RULES
+    return [Rule(**rule) for rule in rules]
+
+
+# ==================== BACKENDS ====================
+
+class LocalBackend:
+    """In-memory buckets for this worker, bounded LRU"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    async def consume(self, key: str, capacity: int, refill_rate: float, cost: float = 1):
+        """Returns (allowed, remaining tokens, seconds until `cost` tokens are available)"""
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        retry_after = 0 if allowed else (cost - tokens) / refill_rate
+        return allowed, tokens, retry_after
+
+
+class RedisBackend:
+    """Shared buckets in Redis; the refill-and-take step is one Lua call (atomic)"""
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local cost = tonumber(ARGV[4])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        import redis.asyncio as redis  # optional dependency
+
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+
+    async def consume(self, key: str, capacity: int, refill_rate: float, cost: float = 1):
+        allowed, tokens = await self._script(
+            keys=[self.prefix + key], args=[capacity, refill_rate, time.time(), cost]
+        )
+        tokens = float(tokens)
+        allowed = bool(int(allowed))
+        retry_after = 0 if allowed else (cost - tokens) / refill_rate
+        return allowed, tokens, retry_after
+
+
+def create_backend():
+    backend = os.getenv("RATE_LIMIT_BACKEND", "local").lower()
+    if backend == "redis":
+        return RedisBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return LocalBackend(int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+
+
+# ==================== MIDDLEWARE ====================
+
+def _client_key(rule: Rule, scope, headers: Headers) -> str:
+    if rule.key == "user":
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            # Verified claims come from the token cache; garbage or rotated
+            # headers don't verify and share the caller's IP bucket instead
+            payload = decode_access_token(token.strip())
+            if payload and payload.get("sub"):
+                return f"user:{payload['sub']}"
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, rules=None, backend=None):
+        self.app = app
+        self.rules = rules if rules is not None else load_rules()
+        self.backend = backend or create_backend()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        # A WebSocket handshake is a GET upgrade request
+        method = scope["method"] if scope["type"] == "http" else "GET"
+        path = scope["path"]
+        rule = next((r for r in self.rules if r.matches(method, path)), None)
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = f"{rule.name}:{_client_key(rule, scope, Headers(scope=scope))}"
+        try:
+            allowed, remaining, retry_after = await self.backend.consume(key, rule.capacity, rule.refill_rate)
+        except Exception as e:
+            # Fail open: a broken limiter backend must not take the API down
+            logging.error(f"Rate limiter backend error: {e}")
+            metrics.inc("rate_limit_backend_errors_total", rule=rule.name)
+            await self.app(scope, receive, send)
+            return
+
+        if allowed:
+            metrics.inc("rate_limit_allowed_total", rule=rule.name)
+            await self.app(scope, receive, send)
+            return
+
+        metrics.inc("rate_limit_rejected_total", rule=rule.name)
+        retry_after = max(1, int(retry_after + 0.999))
+        body = json.dumps({"error": "Rate limit exceeded", "retry_after": retry_after}).encode("utf-8")
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+            (b"x-ratelimit-limit", rule.limit.replace(" ", "").encode()),
+            (b"x-ratelimit-remaining", str(int(remaining)).encode()),
+        ]
+
+        if scope["type"] == "websocket":
+            # Reject the handshake: a real 429 where the server supports denial
+            # responses, otherwise a close before accept (sent as HTTP 403)
+            if "websocket.http.response" in scope.get("extensions", {}):
+                await send({"type": "websocket.http.response.start", "status": 429, "headers": headers})
+                await send({"type": "websocket.http.response.body", "body": body})
+            else:
+                await send({"type": "websocket.close", "code": 1008, "reason": "Rate limit exceeded"})
+            return
+
+        await send({"type": "http.response.start", "status": 429, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,206 @@
+"""
+Local LRU disk cache for recording bytes.
+
+The stream endpoint otherwise reads the whole bytea from Postgres (or the
+object from GCS once archived) for every Range request. Hot recordings are
+kept as plain files instead:
+
+    <RECORDING_CACHE_DIR>/<call_id>.<rendition>.<checksum>
+
+The checksum is part of the name, so a re-stored recording is simply a new
+entry and stale bytes are never served. Full responses go out as a
+FileResponse (sendfile/pathsend where the server supports it), Range requests
+are sliced from an mmap of the file.
+
+    RECORDING_CACHE_DIR      default <tmp>/recording-cache (shared by all workers)
+    RECORDING_CACHE_MAX_MB   total size bound, default 1024; 0 disables the cache
+
+LRU order is the file mtime, refreshed on hits. Workers write through a temp
+file + rename and evict under an flock, so concurrent writers and evictors never
+expose a partial file. Entries used in the last EVICT_GRACE_SECONDS are never
+evicted, which covers the gap between a lookup and the response opening the
+file (an already open file survives unlink).
+"""
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+
+from src.utils.metrics import metrics
+
+TOUCH_INTERVAL_SECONDS = 10
+EVICT_GRACE_SECONDS = 60
+STALE_TEMP_SECONDS = 3600
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+
+class RecordingCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 4  # one long call must not flush everything else
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._bytes = 0   # as of the last eviction scan
+        self._files = 0
+
+    @classmethod
+    def from_env(cls):
+        directory = os.getenv("RECORDING_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "recording-cache")
+        return cls(directory, int(float(os.getenv("RECORDING_CACHE_MAX_MB", "1024")) * 1024 * 1024))
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, call_id: str, rendition: str, token: str) -> str:
+        name = ".".join(_UNSAFE_CHARS.sub("_", part) for part in (call_id, rendition, token))
+        return os.path.join(self.directory, name)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            hits, misses = self._hits, self._misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "bytes": self._bytes,
+            "files": self._files,
+        }
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+        metrics.inc("recording_cache_requests_total", result="hit" if hit else "miss")
+
+    # ---------- reads ----------
+
+    def lookup(self, call_id: str, rendition: str, token: str):
+        """(path, stat_result) of a cached entry, or None; counts a hit or miss"""
+        if not self.enabled or not token:
+            return None
+        path = self._path(call_id, rendition, token)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._count(False)
+            return None
+
+        now = time.time()
+        if now - st.st_mtime > TOUCH_INTERVAL_SECONDS:
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+        self._count(True)
+        return path, st
+
+    def read_range(self, path: str, start: int, end: int) -> bytes:
+        """Bytes start..end (inclusive) of a cached file through mmap"""
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[start:end + 1]
+
+    # ---------- writes ----------
+
+    def put(self, call_id: str, rendition: str, token: str, data: bytes):
+        """Cache `data` (blocking - run it in a thread); returns the path or None"""
+        if not self.enabled or not token or not data or len(data) > self.max_entry_bytes:
+            return None
+        path = self._path(call_id, rendition, token)
+        if os.path.exists(path):
+            return path
+
+        tmp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"⚠️ Could not cache recording {call_id} ({rendition}): {e}")
+            if tmp_path:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+            return None
+
+        metrics.inc("recording_cache_writes_total")
+        self.evict()
+        return path
+
+    def evict(self) -> int:
+        """Drop least recently used files until the cache fits; returns files removed"""
+        try:
+            lock_file = open(os.path.join(self.directory, ".lock"), "a")
+        except OSError:
+            return 0
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return 0  # another worker is evicting right now
+
+            now = time.time()
+            entries = []
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    if entry.name.startswith("."):
+                        if entry.name.startswith(".tmp-") and now - st.st_mtime > STALE_TEMP_SECONDS:
+                            _unlink(entry.path)
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            if total > self.max_bytes:
+                for mtime, size, path in sorted(entries):
+                    if total <= self.max_bytes:
+                        break
+                    if now - mtime < EVICT_GRACE_SECONDS:
+                        break  # everything from here on is in use
+                    if _unlink(path):
+                        total -= size
+                        removed += 1
+
+            self._bytes = total
+            self._files = len(entries) - removed
+        if removed:
+            metrics.inc("recording_cache_evictions_total", removed)
+        return removed
+
+
+def _unlink(path: str) -> bool:
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logging.warning(f"⚠️ Could not evict {path}: {e}")
+        return False
+
+
+def archived_token(blob_name: str) -> str:
+    """Cache token for a recording served from GCS (no stored checksum)"""
+    return "gcs-" + hashlib.sha256(blob_name.encode()).hexdigest()[:32]
+
+
+recording_cache = RecordingCache.from_env()
+metrics.register_gauge("recording_cache", recording_cache.snapshot)
@@ -0,0 +1,286 @@
+"""
+Recording transcoding.
+
+Egress uploads OGG recordings; they are stored as-is in call_recordings (the
+original). After that, a background stage encodes compact renditions with
+ffmpeg and stores them in call_recording_renditions:
+
+    voice   Opus in Ogg, mono, low bitrate tuned for speech (RECORDING_VOICE_BITRATE, default 24 kbps)
+    mp3     MP3, mono (RECORDING_MP3_BITRATE, default 48 kbps) - plays everywhere, including Safari
+    preview the first RECORDING_PREVIEW_SECONDS (default 15) as MP3, for list previews
+
+The same stage stores a waveform in call_recording_waveforms: one int8 peak
+(0-127, absolute amplitude) per bucket, RECORDING_WAVEFORM_POINTS buckets
+(default 1000), so players can draw the waveform without the audio.
+
+The stream endpoint picks a rendition from ?rendition= or the Accept header
+(choose_rendition) and falls back to the original while renditions are missing.
+
+    python -m src.utils.recording_pipeline backfill [--limit 100]
+
+Needs the ffmpeg binary (FFMPEG_BIN, default "ffmpeg"); without it transcoding
+is skipped and the original is served. RECORDING_TRANSCODE_CONCURRENCY caps
+parallel ffmpeg processes per worker (default 2).
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import sys
+from array import array
+
+from dotenv import load_dotenv
+
+from src.utils.db import PGDB
+from src.utils.metrics import metrics
+from src.utils.recording_cache import recording_cache
+
+load_dotenv()
+
+db = PGDB()
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+TRANSCODE_TIMEOUT = float(os.getenv("RECORDING_TRANSCODE_TIMEOUT", "300"))
+TRANSCODE_CONCURRENCY = int(os.getenv("RECORDING_TRANSCODE_CONCURRENCY", "2"))
+
+ORIGINAL = "original"
+PREVIEW = "preview"
+
+PREVIEW_SECONDS = int(os.getenv("RECORDING_PREVIEW_SECONDS", "15"))
+WAVEFORM_POINTS = int(os.getenv("RECORDING_WAVEFORM_POINTS", "1000"))
+WAVEFORM_SAMPLE_RATE = 8000
+
+RENDITIONS = {
+    "voice": {
+        "content_type": "audio/ogg; codecs=opus",
+        "bitrate_kbps": int(os.getenv("RECORDING_VOICE_BITRATE", "24")),
+        "args": ["-c:a", "libopus", "-application", "voip", "-f", "ogg"],
+    },
+    "mp3": {
+        "content_type": "audio/mpeg",
+        "bitrate_kbps": int(os.getenv("RECORDING_MP3_BITRATE", "48")),
+        "args": ["-c:a", "libmp3lame", "-f", "mp3"],
+    },
+    PREVIEW: {
+        "content_type": "audio/mpeg",
+        "bitrate_kbps": int(os.getenv("RECORDING_MP3_BITRATE", "48")),
+        "args": [
+            "-t", str(PREVIEW_SECONDS),
+            "-af", f"afade=t=out:st={max(0, PREVIEW_SECONDS - 1)}:d=1",
+            "-c:a", "libmp3lame", "-f", "mp3",
+        ],
+    },
+}
+
+_semaphore = None  # created lazily on the running loop
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which(FFMPEG_BIN) is not None
+
+
+def _run_ffmpeg(data: bytes, output_args: list) -> bytes:
+    """Pipe `data` through ffmpeg (mono, no video) and return its stdout"""
+    command = [
+        FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-nostdin",
+        "-i", "pipe:0",
+        "-vn", "-ac", "1",
+        *output_args,
+        "pipe:1",
+    ]
+    try:
+        result = subprocess.run(command, input=data, capture_output=True, timeout=TRANSCODE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise TranscodeError(f"ffmpeg timed out after {TRANSCODE_TIMEOUT}s")
+    if result.returncode != 0 or not result.stdout:
+        raise TranscodeError(result.stderr.decode("utf-8", "replace").strip()[-500:] or "no output")
+    return result.stdout
+
+
+def transcode(data: bytes, rendition: str) -> bytes:
+    """Encode one rendition with ffmpeg (blocking - run it in a thread)"""
+    spec = RENDITIONS[rendition]
+    return _run_ffmpeg(data, ["-b:a", f"{spec['bitrate_kbps']}k", *spec["args"]])
+
+
+# ==================== WAVEFORM ====================
+
+def peaks_from_samples(samples, points: int = WAVEFORM_POINTS) -> bytes:
+    """Signed 16-bit samples -> one int8 peak (0-127) per bucket"""
+    count = len(samples)
+    points = min(points, count)
+    peaks = bytearray(points)
+    for i in range(points):
+        bucket = samples[i * count // points:(i + 1) * count // points]
+        peak = max(max(bucket), -min(bucket))
+        peaks[i] = min(127, peak * 127 // 32767)
+    return bytes(peaks)
+
+
+def downsample_peaks(peaks: bytes, points: int) -> bytes:
+    """Max-pool a stored peak array down to `points` buckets (the list view needs far fewer)"""
+    count = len(peaks)
+    if points <= 0 or points >= count:
+        return peaks
+    return bytes(max(peaks[i * count // points:(i + 1) * count // points]) for i in range(points))
+
+
+def compute_waveform(data: bytes, points: int = WAVEFORM_POINTS) -> tuple:
+    """Decode with ffmpeg and compute the peak array (blocking). Returns (peaks, duration_ms)"""
+    pcm = _run_ffmpeg(data, ["-ar", str(WAVEFORM_SAMPLE_RATE), "-f", "s16le", "-c:a", "pcm_s16le"])
+    samples = array("h")
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    if not samples:
+        raise TranscodeError("no samples decoded")
+    return peaks_from_samples(samples, points), len(samples) * 1000 // WAVEFORM_SAMPLE_RATE
+
+
+async def transcode_recording(call_id: str, data: bytes = None, renditions=None) -> dict:
+    """
+    Build and store the renditions and the waveform of a call's recording
+    (original from the DB when `data` is not given). Returns {rendition: size}
+    for what was stored, plus "waveform": points.
+    """
+    global _semaphore
+    if not ffmpeg_available():
+        logging.warning(f"⚠️ {FFMPEG_BIN} not found - skipping transcoding for {call_id}")
+        return {}
+    if data is None:
+        data, _, _ = await asyncio.to_thread(db.get_recording_blob, call_id)
+        if not data:
+            logging.warning(f"⚠️ No recording to transcode for {call_id}")
+            return {}
+        data = bytes(data)
+
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(TRANSCODE_CONCURRENCY)
+
+    stored = {}
+    for rendition in renditions or RENDITIONS:
+        spec = RENDITIONS[rendition]
+        try:
+            async with _semaphore:
+                encoded = await asyncio.to_thread(transcode, data, rendition)
+            await asyncio.to_thread(
+                db.store_recording_rendition, call_id, rendition, encoded,
+                spec["content_type"], spec["bitrate_kbps"]
+            )
+            await asyncio.to_thread(
+                recording_cache.put, call_id, rendition, hashlib.sha256(encoded).hexdigest(), encoded
+            )
+        except Exception as e:
+            logging.error(f"❌ Transcoding {rendition} for {call_id} failed: {e}")
+            metrics.inc("recording_transcode_total", rendition=rendition, result="error")
+            continue
+        stored[rendition] = len(encoded)
+        metrics.inc("recording_transcode_total", rendition=rendition, result="ok")
+        if rendition != PREVIEW:
+            metrics.inc("recording_transcode_bytes_saved_total", max(0, len(data) - len(encoded)), rendition=rendition)
+        logging.info(f"✅ {rendition} rendition for {call_id}: {len(data)} -> {len(encoded)} bytes")
+
+    try:
+        async with _semaphore:
+            peaks, duration_ms = await asyncio.to_thread(compute_waveform, data)
+        await asyncio.to_thread(db.store_recording_waveform, call_id, peaks, duration_ms)
+    except Exception as e:
+        logging.error(f"❌ Waveform for {call_id} failed: {e}")
+        metrics.inc("recording_transcode_total", rendition="waveform", result="error")
+        return stored
+    stored["waveform"] = len(peaks)
+    metrics.inc("recording_transcode_total", rendition="waveform", result="ok")
+    return stored
+
+
+# ==================== RENDITION SELECTION ====================
+
+_ACCEPT_RENDITIONS = (
+    ("codecs=opus", "voice"),
+    ("audio/ogg", "voice"),
+    ("audio/opus", "voice"),
+    ("audio/mpeg", "mp3"),
+    ("audio/mp3", "mp3"),
+)
+
+
+def _parse_accept(header: str) -> list:
+    """Accept header -> [(media range lowercased, q)] sorted by q, highest first"""
+    ranges = []
+    for part in (header or "").split(","):
+        media, *params = [p.strip() for p in part.split(";")]
+        if not media:
+            continue
+        q = 1.0
+        extra = []
+        for param in params:
+            if param.lower().startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+            else:
+                extra.append(param.lower())
+        ranges.append((";".join([media.lower(), *extra]), q))
+    return sorted(ranges, key=lambda item: -item[1])
+
+
+def choose_rendition(accept: str, available, requested: str = None) -> str:
+    """
+    Rendition to serve: an explicit (available) ?rendition= wins; otherwise the
+    client's most preferred audio type in Accept; for */* or no preference the
+    universally playable mp3. Falls back to the original. The preview clip is
+    only served when asked for explicitly.
+    """
+    available = set(available or ())
+    if requested == ORIGINAL or (requested and requested in available):
+        return requested
+
+    for media_range, q in _parse_accept(accept):
+        if q <= 0:
+            continue
+        for token, rendition in _ACCEPT_RENDITIONS:
+            if token in media_range and rendition in available:
+                return rendition
+
+    return "mp3" if "mp3" in available else ORIGINAL
+
+
+# ==================== CLI ====================
+
+async def backfill(limit: int) -> dict:
+    results = {}
+    for call_id in await asyncio.to_thread(db.get_recordings_missing_renditions, list(RENDITIONS), limit):
+        results[call_id] = await transcode_recording(call_id)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recording transcoding")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill_cmd = sub.add_parser("backfill", help="Transcode stored recordings that lack renditions")
+    backfill_cmd.add_argument("--limit", type=int, default=100)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if not ffmpeg_available():
+        print(f"{FFMPEG_BIN} not found", file=sys.stderr)
+        return 1
+    try:
+        for call_id, sizes in asyncio.run(backfill(args.limit)).items():
+            print(f"{call_id}: {sizes or 'failed'}")
+    finally:
+        db.close_pool()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
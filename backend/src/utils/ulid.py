@@ -0,0 +1,62 @@
+"""
+ULID generation (https://github.com/ulid/spec): 48-bit millisecond timestamp +
+80 random bits, Crockford base32, 26 characters, lexicographically sortable.
+
+Used for call ids (call-{user_id}-{ulid}); ids generated in the same
+millisecond by this process are strictly increasing (monotonic mode).
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_DECODE = {c: i for i, c in enumerate(_CROCKFORD)}
+_RANDOM_BITS = 80
+_MAX_RANDOM = (1 << _RANDOM_BITS) - 1
+
+ULID_LENGTH = 26
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        chars.append(_CROCKFORD[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def new_ulid() -> str:
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms <= _last_ms:
+            # Same (or earlier, clock step back) millisecond: increment the random part
+            now_ms = _last_ms
+            _last_random += 1
+            if _last_random > _MAX_RANDOM:
+                now_ms += 1
+                _last_random = int.from_bytes(os.urandom(10), "big")
+        else:
+            _last_random = int.from_bytes(os.urandom(10), "big")
+        _last_ms = now_ms
+        return _encode(now_ms, 10) + _encode(_last_random, 16)
+
+
+def ulid_timestamp(value: str):
+    """Creation time (UTC) encoded in a ULID, or None if `value` is not a ULID"""
+    if not value or len(value) != ULID_LENGTH:
+        return None
+    try:
+        ms = 0
+        for char in value[:10].upper():
+            ms = (ms << 5) | _DECODE[char]
+    except KeyError:
+        return None
+    if ms >= 1 << 48:
+        return None
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
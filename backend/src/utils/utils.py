@@ -7,17 +7,15 @@ import logging
 import os  # ✅ ADD THIS - needed for os.getenv()
 import json
 import base64
-import httpx
 import traceback
+import hashlib
 from datetime import datetime, timezone  # ✅ Make sure timezone is imported
-from livekit import api
 
-# GCS imports
-from google.cloud import storage
-from google.cloud.exceptions import NotFound
-from google.oauth2 import service_account
+# NOTE: livekit, google-cloud-storage and httpx are imported inside the functions
+# that use them so importing this module (and the API) stays cheap on cold start.
 
-from src.utils.db import PGDB
+from src.utils.db import PGDB, call_id_filter, ARTIFACT_KINDS, ARTIFACT_INTERRUPTED
+from src.utils.metrics import metrics
 
 db = PGDB()
 auth_scheme = HTTPBearer()
@@ -28,6 +26,9 @@ auth_scheme = HTTPBearer()
 
 def get_gcs_client():
     """Initialize GCS client with service account"""
+    from google.cloud import storage
+    from google.oauth2 import service_account
+
     gcp_key_b64 = os.getenv("GCS_SERVICE_ACCOUNT_KEY") or os.getenv("GCP_SERVICE_ACCOUNT_KEY_BASE64")
     if not gcp_key_b64:
         raise RuntimeError("GCS_SERVICE_ACCOUNT_KEY not set")
@@ -41,7 +42,6 @@ def get_gcs_client():
 def get_current_user(token: HTTPAuthorizationCredentials = Depends(auth_scheme)):
     # Token decode step
     try:
-        logging.info(f"token: {token}")
         payload = decode_access_token(token.credentials)
         if not payload or "sub" not in payload:
             logging.warning("JWT decode failed or missing 'sub' claim.")
@@ -69,6 +69,8 @@ def get_current_user(token: HTTPAuthorizationCredentials = Depends(auth_scheme))
                 detail="User not found.",
             )
         return user
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Database error while fetching user_id {user_id}: {e}")
         raise HTTPException(
@@ -89,74 +91,68 @@ def is_admin(current_user=Depends(get_current_user)):
     Check if the current user is an admin.
     If not, return a 403 Forbidden response.
     """
-    # # Assuming current_user[5] is the admin flag (True/False)
-    print(current_user)
-    try:
-        if current_user[5] == False:
-            raise HTTPException(
-                status_code=403,
-                detail="You do not have permission to perform this action."
-            )
-    except Exception as e:
-        logging.error(f"Error checking admin status for user : {e}")
+    # get_user_by_id returns a RealDictRow, so read the flag by name
+    if not current_user or not current_user.get("is_admin"):
         raise HTTPException(
-            status_code=500,
-            detail=f"{e}"
+            status_code=403,
+            detail="You do not have permission to perform this action."
         )
 
     return current_user
 
 def add_call_event(call_id: str, event_type: str, event_data: dict = None):
-    """Store event in call_history.events_log (deduplicated)"""
-    conn = db.get_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT events_log FROM call_history WHERE call_id = %s", (call_id,))
-            row = cursor.fetchone()
-            if not row:
-                logging.warning(f"Call {call_id} not found for event {event_type}")
-                return
-
-            events_log = row[0] or []
-            if isinstance(events_log, str):
-                try:
-                    events_log = json.loads(events_log)
-                except Exception:
-                    events_log = []
-
-            if any(ev.get("event") == event_type for ev in events_log):
-                logging.info(f"Duplicate event {event_type} ignored for {call_id}")
-                return
-
-            events_log.append({
-                "event": event_type,
-                "timestamp": datetime.utcnow().isoformat(),
-                "data": event_data or {}
-            })
-
-            cursor.execute(
-                "UPDATE call_history SET events_log = %s WHERE call_id = %s",
-                (json.dumps(events_log), call_id)
-            )
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logging.error(f"Error adding call event: {e}")
-    finally:
-        db.release_connection(conn)  # ✅ 
+    """Store event in call_events.events_log (deduplicated)"""
+    db.add_call_event(call_id, event_type, event_data)
 
-from livekit import api
 import os
 import asyncio
 from dotenv import load_dotenv
 
 
+# ============================================
+# ✅ BACKGROUND TASKS
+# ============================================
+
+# Strong references to in-flight ingestion tasks: keeps them from being
+# garbage-collected mid-run and lets shutdown wait for them to finish.
+_background_tasks = set()
+
+
+def spawn_background_task(coro, name: str = None) -> asyncio.Task:
+    """Run a coroutine in the background, tracked for graceful shutdown"""
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def drain_background_tasks(timeout: float = 30.0) -> int:
+    """
+    Wait up to `timeout` seconds for in-flight background tasks, then cancel
+    whatever is left. Returns the number of tasks that had to be cancelled.
+    """
+    pending = set(_background_tasks)
+    if not pending:
+        return 0
+
+    logging.info(f"⏳ Draining {len(pending)} background task(s) (timeout {timeout}s)")
+    _, still_pending = await asyncio.wait(pending, timeout=timeout)
+    for task in still_pending:
+        logging.warning(f"⚠️ Cancelling background task {task.get_name()} on shutdown")
+        task.cancel()
+    if still_pending:
+        await asyncio.gather(*still_pending, return_exceptions=True)
+    return len(still_pending)
+
+
 LIVEKIT_API_URL = os.getenv("LIVEKIT_URL", "").replace("wss://", "https://")
 
 async def get_livekit_call_status(call_id: str):
     """
     Get current status from LiveKit API
     """
+    from livekit import api
+
     try:
         lkapi = api.LiveKitAPI(
             url=os.getenv("LIVEKIT_URL", "").replace("wss://", "https://"),
@@ -193,107 +189,198 @@ async def get_livekit_call_status(call_id: str):
 
 import traceback
 
-async def fetch_and_store_transcript(call_id: str, transcript_url: str = None, transcript_blob: str = None):
+ARTIFACT_FETCH_ATTEMPTS = int(os.getenv("ARTIFACT_FETCH_ATTEMPTS", "4"))
+ARTIFACT_RETRY_DELAY = float(os.getenv("ARTIFACT_RETRY_DELAY", "10"))  # doubles after every failure
+# A pending/fetching download not updated for this long has lost its task (worker died)
+ARTIFACT_STALE_SECONDS = float(os.getenv("ARTIFACT_STALE_SECONDS", "300"))
+ARTIFACT_RECONCILE_INTERVAL = float(os.getenv("ARTIFACT_RECONCILE_INTERVAL", "60"))
+ARTIFACT_RECONCILE_MAX_AGE_HOURS = float(os.getenv("ARTIFACT_RECONCILE_MAX_AGE_HOURS", "48"))
+
+
+async def artifact_delay(call_id: str, kind: str, seconds: float):
+    """Sleep before a download attempt; a shutdown cancelling it marks the download interrupted"""
+    try:
+        await asyncio.sleep(seconds)
+    except asyncio.CancelledError:
+        db.set_artifact_status(call_id, kind, "failed", ARTIFACT_INTERRUPTED)
+        raise
+
+
+async def _fetch_with_retries(call_id: str, kind: str, fetch, attempts_done: int = 0):
+    """
+    Run `fetch()` (download + store, raises on failure) until
+    ARTIFACT_FETCH_ATTEMPTS attempts (counting `attempts_done`) with exponential
+    backoff, keeping call_history.<kind>_status/_attempts/_error current so
+    clients can see pending -> fetching -> ready | failed instead of polling
+    for a 404. A cancelled task (shutdown) is recorded as failed/interrupted,
+    which run_artifact_reconcile_loop picks up again.
+    """
+    for attempt in range(attempts_done + 1, ARTIFACT_FETCH_ATTEMPTS + 1):
+        try:
+            db.set_artifact_status(call_id, kind, "fetching", attempt=True)
+            result = await fetch()
+        except asyncio.CancelledError:
+            logging.warning(f"⚠️ {kind} download for {call_id} interrupted (attempt {attempt})")
+            db.set_artifact_status(call_id, kind, "failed", ARTIFACT_INTERRUPTED)
+            raise
+        except Exception as e:
+            error = str(e)[:500] or type(e).__name__
+            if attempt < ARTIFACT_FETCH_ATTEMPTS:
+                delay = ARTIFACT_RETRY_DELAY * 2 ** (attempt - 1)
+                logging.warning(f"⚠️ {kind} for {call_id} not stored (attempt {attempt}), retrying in {delay:.0f}s: {error}")
+                db.set_artifact_status(call_id, kind, "pending", error)
+                metrics.inc("artifact_fetch_total", kind=kind, result="retry")
+                await artifact_delay(call_id, kind, delay)
+                continue
+            logging.error(f"❌ {kind} for {call_id} failed after {attempt} attempts: {error}")
+            db.set_artifact_status(call_id, kind, "failed", error)
+            metrics.inc("artifact_fetch_total", kind=kind, result="failed")
+            return None
+
+        db.set_artifact_status(call_id, kind, "ready")
+        metrics.inc("artifact_fetch_total", kind=kind, result="ok")
+        return result
+
+    db.set_artifact_status(call_id, kind, "failed", "out of attempts")
+    return None
+
+
+async def reconcile_artifacts() -> int:
+    """Re-spawn downloads whose task was lost (crash, deploy); returns how many"""
+    fetchers = {"transcript": fetch_and_store_transcript, "recording": fetch_and_store_recording}
+    respawned = 0
+    for kind in ARTIFACT_KINDS:
+        claimed = await asyncio.to_thread(
+            db.claim_stale_artifacts, kind, ARTIFACT_STALE_SECONDS,
+            ARTIFACT_FETCH_ATTEMPTS, ARTIFACT_RECONCILE_MAX_AGE_HOURS
+        )
+        for row in claimed:
+            spawn_background_task(
+                fetchers[kind](row["call_id"], None, row["blob"], attempts_done=row["attempts"]),
+                name=f"{kind}-reconcile-{row['call_id']}"
+            )
+        respawned += len(claimed)
+    if respawned:
+        logging.info(f"🔁 Re-queued {respawned} stuck transcript/recording downloads")
+        metrics.inc("artifact_fetch_requeued_total", respawned)
+    return respawned
+
+
+async def run_artifact_reconcile_loop():
+    """Background loop started from the app lifespan (first pass right away)"""
+    while True:
+        try:
+            await reconcile_artifacts()
+        except Exception as e:
+            logging.error(f"❌ Artifact reconcile failed: {e}")
+        await asyncio.sleep(ARTIFACT_RECONCILE_INTERVAL)
+
+
+async def fetch_and_store_transcript(call_id: str, transcript_url: str = None, transcript_blob: str = None,
+                                     attempts_done: int = 0):
     """
     Download transcript from GCS blob ONLY (never use signed URLs).
     Signed URLs cause timeouts and ReadErrors.
     """
-    try:
-        transcript_data = None
-        
-        # ✅ ONLY use GCS blob (direct access with service account)
-        if transcript_blob:
-            logging.info(f"📥 Downloading transcript from blob: {transcript_blob}")
-            try:
-                gcs = get_gcs_client()
-                bucket_name = os.getenv("GOOGLE_BUCKET_NAME")
-                bucket = gcs.bucket(bucket_name)
-                blob = bucket.blob(transcript_blob)
-                
-                if blob.exists():
-                    transcript_json = blob.download_as_text()
-                    transcript_data = json.loads(transcript_json)
-                    logging.info(f"✅ Downloaded transcript from blob")
-                else:
-                    logging.error(f"❌ Blob not found: {transcript_blob}")
-            except Exception as e:
-                logging.error(f"❌ Blob download failed: {e}")
-                traceback.print_exc()
-                return None
-        else:
-            logging.warning(f"⚠️ No transcript_blob provided for {call_id}")
-            return None
-        
-        # Store in database
-        if transcript_data:
-            # Check if has content
-            has_content = False
-            if isinstance(transcript_data, dict):
-                items = transcript_data.get("items") or transcript_data.get("messages") or []
-                has_content = len(items) > 0
-            elif isinstance(transcript_data, list):
-                has_content = len(transcript_data) > 0
-            
-            if has_content:
-                db.update_call_history(call_id, {"transcript": transcript_data})
-                logging.info(f"✅ Transcript stored ({len(str(transcript_data))} chars)")
-            else:
-                logging.warning(f"⚠️ Empty transcript for {call_id}")
-                db.update_call_history(call_id, {"transcript": {"items": [], "note": "No conversation"}})
-            
-            return transcript_data
-        
-        logging.warning(f"⚠️ No transcript data for {call_id}")
-        return None
-        
-    except Exception as e:
-        logging.error(f"❌ Error fetching transcript: {e}")
-        traceback.print_exc()
+    # ✅ ONLY use GCS blob (direct access with service account)
+    if not transcript_blob:
+        logging.warning(f"⚠️ No transcript_blob provided for {call_id}")
         return None
 
+    async def download_and_store():
+        logging.info(f"📥 Downloading transcript from blob: {transcript_blob}")
+        gcs = get_gcs_client()
+        bucket_name = os.getenv("GOOGLE_BUCKET_NAME")
+        bucket = gcs.bucket(bucket_name)
+        blob = bucket.blob(transcript_blob)
+
+        # The agent may report the blob before the upload has finished - retried
+        if not blob.exists():
+            raise FileNotFoundError(f"Blob not found: {transcript_blob}")
+        transcript_data = json.loads(blob.download_as_text())
+        logging.info(f"✅ Downloaded transcript from blob")
+
+        # Check if has content
+        has_content = False
+        if isinstance(transcript_data, dict):
+            items = transcript_data.get("items") or transcript_data.get("messages") or []
+            has_content = len(items) > 0
+        elif isinstance(transcript_data, list):
+            has_content = len(transcript_data) > 0
+
+        # Store in database
+        if has_content:
+            db.update_call_history(call_id, {"transcript": transcript_data})
+            logging.info(f"✅ Transcript stored ({len(str(transcript_data))} chars)")
+        else:
+            logging.warning(f"⚠️ Empty transcript for {call_id}")
+            db.update_call_history(call_id, {"transcript": {"items": [], "note": "No conversation"}})
+        return transcript_data
+
+    return await _fetch_with_retries(call_id, "transcript", download_and_store, attempts_done)
 
-async def fetch_and_store_recording(call_id: str, recording_url: str = None, recording_blob_name: str = None):
+
+async def fetch_and_store_recording(call_id: str, recording_url: str = None, recording_blob_name: str = None,
+                                    attempts_done: int = 0):
     """Download recording and store BYTES in database"""
     try:
         logging.info(f"🎵 Fetching recording for call {call_id}")
         
         # Get blob name from DB if not provided
         if not recording_blob_name:
+            where, params = call_id_filter(call_id)
             conn = db.get_connection()
             try:
                 with conn.cursor() as cursor:
-                    cursor.execute("""
+                    cursor.execute(f"""
                         SELECT recording_blob
                         FROM call_history
-                        WHERE call_id = %s
-                    """, (call_id,))
+                        WHERE {where}
+                    """, params)
                     row = cursor.fetchone()
                     if row:
                         recording_blob_name = row[0]
             finally:
                 db.release_connection(conn)
-        
-        if not recording_blob_name:
-            logging.warning(f"⚠️ No recording blob for {call_id}")
-            return
-        
-        # ✅ Download from GCS blob ONLY
-        recording_data = await _fetch_from_gcs_blob(recording_blob_name)
-        
-        if recording_data:
-            # ✅ Store in database
-            db.store_recording_blob(
-                call_id=call_id,
-                recording_data=recording_data,
-                content_type="audio/ogg"
-            )
-            logging.info(f"✅ Stored {len(recording_data)} bytes for {call_id}")
-        else:
-            logging.error(f"❌ Failed to download recording for {call_id}")
-            
     except Exception as e:
         logging.error(f"❌ Error fetching recording: {e}")
         traceback.print_exc()
+        return
+
+    if not recording_blob_name:
+        logging.warning(f"⚠️ No recording blob for {call_id}")
+        return
+
+    async def download_and_store():
+        # ✅ Download from GCS blob ONLY (egress may still be uploading - retried)
+        recording_data = await _fetch_from_gcs_blob(recording_blob_name)
+        if not recording_data:
+            raise FileNotFoundError(f"Recording not downloadable from GCS: {recording_blob_name}")
+
+        # ✅ Store in database
+        db.store_recording_blob(
+            call_id=call_id,
+            recording_data=recording_data,
+            content_type="audio/ogg"
+        )
+        logging.info(f"✅ Stored {len(recording_data)} bytes for {call_id}")
+        return recording_data
+
+    recording_data = await _fetch_with_retries(call_id, "recording", download_and_store, attempts_done)
+    if not recording_data:
+        return
+
+    # ✅ Warm the disk cache - a fresh recording is the one most likely to be replayed
+    from src.utils.recording_cache import recording_cache
+    from src.utils.recording_pipeline import transcode_recording, ORIGINAL
+    checksum = hashlib.sha256(recording_data).hexdigest()
+    spawn_background_task(
+        asyncio.to_thread(recording_cache.put, call_id, ORIGINAL, checksum, recording_data),
+        name=f"recording-cache-{call_id}"
+    )
+
+    # ✅ Compact voice/mp3 renditions in the background (original stays the source of truth)
+    spawn_background_task(transcode_recording(call_id, recording_data), name=f"transcode-{call_id}")
 
 
 async def _fetch_from_gcs_blob(blob_name: str) -> bytes:
@@ -322,6 +409,8 @@ async def _fetch_from_url(url: str) -> bytes:
     Download the ACTUAL AUDIO FILE from HTTP URL.
     Returns: Raw audio bytes (MP3/OGG file content)
     """
+    import httpx
+
     try:
         async with httpx.AsyncClient(timeout=60.0) as client:
             response = await client.get(url)
@@ -398,47 +487,36 @@ def calculate_duration(started_at, ended_at) -> float:
         return 0
     
     
-def check_if_answered(events_log) -> bool:
+def webhook_event_time(data: dict) -> datetime:
     """
-    Determine if call was actually answered by checking events_log.
-    
-    ⚠️ CRITICAL: We can ONLY check events_log because transcript 
-    doesn't exist yet when room_ended fires!
-    
-    Returns True if:
-    - SIP participant joined (means they picked up)
-    - Recording started (egress_started means call was answered)
+    When LiveKit emitted a webhook (its createdAt, unix seconds - may be a
+    string). Falls back to the receive time for payloads without one.
     """
-    if not events_log:
-        logging.warning("⚠️ No events_log - assuming unanswered")
-        return False
-    
+    created_at = (data or {}).get("createdAt") or (data or {}).get("created_at")
     try:
-        events = json.loads(events_log) if isinstance(events_log, str) else events_log
-        
-        # ✅ Check if recording started (definitive proof)
-        egress_started = any(ev.get("event") == "egress_started" for ev in events)
-        
-        # ✅ Check if SIP participant joined (they picked up)
-        sip_participant_joined = False
-        for ev in events:
-            if ev.get("event") == "participant_joined":
-                participant = ev.get("data", {}).get("participant", {})
-                identity = participant.get("identity", "")
-                if identity.startswith("sip-"):
-                    sip_participant_joined = True
-                    break
-        
-        # ✅ Either condition means call was answered
-        answered = egress_started or sip_participant_joined
-        
-        logging.info(f"📊 Answered check: egress={egress_started}, sip_joined={sip_participant_joined} → {answered}")
-        
-        return answered
-        
-    except Exception as e:
-        logging.error(f"❌ Error parsing events_log: {e}")
-        return False
+        return datetime.fromtimestamp(int(created_at), tz=timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return datetime.now(timezone.utc)
+
+
+def answered_signal(event: str, data: dict):
+    """
+    When a LiveKit webhook proves the callee picked up, the time it happened
+    (else None):
+    - Recording started (egress_started)
+    - SIP participant joined (identity "sip-...")
+    Called per webhook, so room end never has to scan the events log.
+    """
+    if event == "egress_started":
+        pass
+    elif event == "participant_joined":
+        identity = ((data or {}).get("participant") or {}).get("identity", "")
+        if not identity.startswith("sip-"):
+            return None
+    else:
+        return None
+
+    return webhook_event_time(data)
     
 
 